@@ -0,0 +1,644 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright  2017  Miguel Tremblay
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not see  <http://www.gnu.org/licenses/>.
+############################################################################
+
+"""
+Name:        benchmark.py
+Description: Measure the performance of get_canadian_weather_observations.py
+ without the ECCC web site: a synthetic station list is created and the files
+ are downloaded from a local server mimicking the ECCC bulk data pages.
+
+Notes: the results can be saved with --json and compared to a previous run
+ with --baseline: the program exits with an error if a measure is slower than
+ the baseline by more than --tolerance.
+
+Author: Miguel Tremblay (http://ptaff.ca/miguel/)
+Date: July 25th 2017
+"""
+
+import sys
+import os
+import json
+import time
+import random
+import shutil
+import tempfile
+import argparse
+import datetime
+import calendar
+import threading
+import functools
+import itertools
+import contextlib
+import http.server
+import urllib.parse
+
+import get_canadian_weather_observations as gcwo
+
+# Columns of the files served by the mock server, in English
+HOURLY_HEADER = ["Longitude (x)", "Latitude (y)", "Station Name", "Climate ID", \
+                 "Date/Time (LST)", "Year", "Month", "Day", "Time (LST)", "Temp (°C)", \
+                 "Temp Flag", "Dew Point Temp (°C)", "Dew Point Temp Flag", "Rel Hum (%)", \
+                 "Rel Hum Flag", "Wind Dir (10s deg)", "Wind Dir Flag", "Wind Spd (km/h)", \
+                 "Wind Spd Flag", "Visibility (km)", "Visibility Flag", "Stn Press (kPa)", \
+                 "Stn Press Flag", "Hmdx", "Hmdx Flag", "Wind Chill", "Wind Chill Flag", \
+                 "Weather"]
+DAILY_HEADER = ["Longitude (x)", "Latitude (y)", "Station Name", "Climate ID", "Date/Time", \
+                "Year", "Month", "Day", "Data Quality", "Max Temp (°C)", "Max Temp Flag", \
+                "Min Temp (°C)", "Min Temp Flag", "Mean Temp (°C)", "Mean Temp Flag", \
+                "Heat Deg Days (°C)", "Heat Deg Days Flag", "Cool Deg Days (°C)", \
+                "Cool Deg Days Flag", "Total Rain (mm)", "Total Rain Flag", "Total Snow (cm)", \
+                "Total Snow Flag", "Total Precip (mm)", "Total Precip Flag", \
+                "Snow on Grnd (cm)", "Snow on Grnd Flag", "Dir of Max Gust (10s deg)", \
+                "Dir of Max Gust Flag", "Spd of Max Gust (km/h)", "Spd of Max Gust Flag"]
+MONTHLY_HEADER = ["Longitude (x)", "Latitude (y)", "Station Name", "Climate ID", \
+                  "Date/Time", "Year", "Month", "Mean Max Temp (°C)", "Mean Max Temp Flag", \
+                  "Mean Min Temp (°C)", "Mean Min Temp Flag", "Mean Temp (°C)", \
+                  "Mean Temp Flag", "Total Rain (mm)", "Total Rain Flag", "Total Snow (cm)", \
+                  "Total Snow Flag", "Total Precip (mm)", "Total Precip Flag"]
+# Period of the monthly files served by the mock server
+MONTHLY_YEARS = 30
+
+# Prefix of the names of the measures, and if a lower value is better
+dMeasureLowerIsBetter = { "time" : True, "rate" : False }
+
+############################################################################
+# Synthetic station list
+
+def create_station_list(sPath, nStations, nSeed):
+   """
+   Write a station list with the format of the ECCC 'Station Inventory EN.csv', with
+   nStations stations at random positions in Canada and random periods of observation.
+
+   OUTPUT
+   Number of years of hourly, daily and monthly observations in the list
+   """
+
+   randomGenerator = random.Random(nSeed)
+   nCurrentYear = datetime.date.today().year
+   lProvinces = list(gcwo.dProvEN.keys())
+   dYears = { "hourly" : 0, "daily" : 0, "monthly" : 0 }
+
+   with open(sPath, "w", encoding="utf-8-sig", newline="") as fichier:
+      fichier.write("Modified Date: " + \
+                    datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M UTC") + "\n")
+      fichier.write('"Station Inventory Disclaimer: synthetic station list for benchmarks."\n')
+      fichier.write('"Station ID Disclaimer: synthetic station IDs."\n')
+      fichier.write(",".join('"' + sTitle + '"' for sTitle in gcwo.COLUMN_TITLE_EN) + "\n")
+
+      for nStation in range(nStations):
+         nFirstYear = randomGenerator.randint(1840, nCurrentYear)
+         nLastYear = randomGenerator.randint(nFirstYear, min(nFirstYear + 60, nCurrentYear))
+         lPeriods = []
+         for sTimeframe in ["hourly", "daily", "monthly"]:
+            # About half the stations have hourly values, most have daily and monthly values
+            if randomGenerator.random() < (0.4 if sTimeframe == "hourly" else 0.9):
+               nStart = randomGenerator.randint(nFirstYear, nLastYear)
+               nEnd = randomGenerator.randint(nStart, nLastYear)
+               lPeriods = lPeriods + [str(nStart), str(nEnd)]
+               dYears[sTimeframe] = dYears[sTimeframe] + nEnd - nStart + 1
+            else:
+               lPeriods = lPeriods + ["", ""]
+         # One station out of 10 is an airport
+         sAirport = ""
+         if nStation % 10 == 0:
+            sAirport = "".join(randomGenerator.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") \
+                               for i in range(3))
+         fLatitude = randomGenerator.uniform(42.0, 83.0)
+         fLongitude = randomGenerator.uniform(-141.0, -52.0)
+         lRow = ["BENCHMARK STATION " + str(nStation), randomGenerator.choice(lProvinces), \
+                 "%07d" % (nStation), str(100000 + nStation), "", sAirport, \
+                 "%.2f" % (fLatitude), "%.2f" % (fLongitude), \
+                 str(int(fLatitude * 1e7)), str(int(fLongitude * 1e7)), \
+                 str(randomGenerator.randint(0, 2000)), str(nFirstYear), str(nLastYear)] + \
+                 lPeriods
+         fichier.write(",".join('"' + sValue + '"' for sValue in lRow) + "\n")
+
+   return dYears
+
+############################################################################
+# Mock ECCC web site
+
+def get_eccc_filename(sLang, sTimeframe, sProvince, sClimateID, nYear=None, nMonth=None):
+   """
+   Return the name of a file as given by ECCC in the Content-Disposition header,
+   i.e. en_climate_hourly_NT_2203095_001-1990_P1H.csv
+   """
+
+   sPrefix = sLang + "_climate_" + sTimeframe + "_" + sProvince + "_" + sClimateID + "_"
+   if sTimeframe == "hourly":
+      # ECCC writes the months before October on 3 digits
+      sMonth = "%03d" % (nMonth) if nMonth < 10 else str(nMonth)
+      return sPrefix + sMonth + "-" + str(nYear) + "_P1H.csv"
+   elif sTimeframe == "daily":
+      return sPrefix + str(nYear) + "_P1D.csv"
+   return sPrefix + "P1M.csv"
+
+def format_csv_line(lValues):
+   """
+   Return the line of a CSV file with the quoted values.
+   """
+
+   return ",".join('"' + sValue + '"' for sValue in lValues)
+
+@functools.lru_cache(maxsize=None)
+def get_row_values(sTimeframe):
+   """
+   Return the observations of the rows of the files of the mock server, after their date, 
+   for the longest period of a file. They are drawn once, so the files are created quickly.
+   """
+
+   randomGenerator = random.Random(0)
+   lRows = []
+   if sTimeframe == "hourly":
+      for nHour in range(31 * 24):
+         lRows.append(format_csv_line(["%.1f" % (randomGenerator.uniform(-40, 30)), "", \
+                                       "%.1f" % (randomGenerator.uniform(-45, 20)), "", \
+                                       str(randomGenerator.randint(20, 100)), "", \
+                                       str(randomGenerator.randint(0, 36)), "", \
+                                       str(randomGenerator.randint(0, 80)), "", "25.0", "", \
+                                       "%.2f" % (randomGenerator.uniform(97, 103)), "", "", \
+                                       "", "", "", "NA"]))
+   else:
+      nValues = 11 if sTimeframe == "daily" else 6
+      for nDay in range(366 if sTimeframe == "daily" else MONTHLY_YEARS * 12):
+         lRows.append(format_csv_line(["%.1f" % (randomGenerator.uniform(-40, 30)), ""] * \
+                                      nValues))
+   return lRows
+
+@functools.lru_cache(maxsize=256)
+def get_file_content(sTimeframe, nYear, nMonth):
+   """
+   Return the content of a CSV file of the mock server, with the size of a real file. The
+   values do not depend on the station, so the files can be cached.
+   """
+
+   lRows = get_row_values(sTimeframe)
+   sStation = format_csv_line(["-133.50", "68.75", "BENCHMARK STATION", "0000000"])
+   lLines = []
+   if sTimeframe == "hourly":
+      lLines.append(format_csv_line(HOURLY_HEADER))
+      sYearMonth = "%04d-%02d" % (nYear, nMonth)
+      sPrefix = sStation + ',"' + sYearMonth + "-"
+      sSuffix = '","%04d","%02d","' % (nYear, nMonth)
+      for nDay in range(calendar.monthrange(nYear, nMonth)[1]):
+         for nHour in range(24):
+            lLines.append(sPrefix + "%02d %02d:00" % (nDay + 1, nHour) + sSuffix + \
+                          "%02d" % (nDay + 1) + '","' + "%02d:00" % (nHour) + '",' + \
+                          lRows[nDay * 24 + nHour])
+   elif sTimeframe == "daily":
+      lLines.append(format_csv_line(DAILY_HEADER))
+      timeDate = datetime.date(nYear, 1, 1)
+      nRow = 0
+      while timeDate.year == nYear:
+         lLines.append(sStation + "," + \
+                       format_csv_line([timeDate.isoformat(), "%04d" % (nYear), \
+                                        "%02d" % (timeDate.month), "%02d" % (timeDate.day), \
+                                        ""]) + "," + lRows[nRow])
+         timeDate = timeDate + datetime.timedelta(days=1)
+         nRow = nRow + 1
+   else:
+      lLines.append(format_csv_line(MONTHLY_HEADER))
+      for nYearMonth in range(MONTHLY_YEARS * 12):
+         sYear = "%04d" % (1990 + nYearMonth // 12)
+         sMonth = "%02d" % (nYearMonth % 12 + 1)
+         lLines.append(sStation + "," + \
+                       format_csv_line([sYear + "-" + sMonth, sYear, sMonth]) + "," + \
+                       lRows[nYearMonth])
+
+   return ("\ufeff" + "\n".join(lLines) + "\n").encode("utf-8")
+
+class MockECCCHandler(http.server.BaseHTTPRequestHandler):
+   """
+   Answer the requests of get_canadian_weather_observations.py like the ECCC web site:
+   the root page, to check the connexion, and the bulk data pages of the files.
+   """
+
+   protocol_version = "HTTP/1.1"
+   # Send the small responses immediately, like a real server
+   disable_nagle_algorithm = True
+
+   def log_message(self, sFormat, *args):
+      pass
+
+   def send_body(self, nStatus, bBody, lHeaders=[]):
+      self.send_response(nStatus)
+      for (sName, sValue) in lHeaders:
+         self.send_header(sName, sValue)
+      self.send_header("Content-Length", str(len(bBody)))
+      self.end_headers()
+      self.wfile.write(bBody)
+
+   def do_GET(self):
+      server = self.server
+      urlParsed = urllib.parse.urlparse(self.path)
+      if "bulk_data" not in urlParsed.path:
+         self.send_body(200, b"<html>Mock ECCC climate web site</html>")
+         return
+
+      with server.lock:
+         server.nRequests = server.nRequests + 1
+         fDraw = server.randomGenerator.random()
+      if server.fLatency > 0:
+         time.sleep(server.fLatency)
+      if fDraw < server.fErrorRate:
+         with server.lock:
+            server.nErrors = server.nErrors + 1
+         self.send_body(503, b"", [("Retry-After", "0")])
+         return
+
+      dQuery = urllib.parse.parse_qs(urlParsed.query)
+      try:
+         dStation = server.dStations[dQuery["stationID"][0]]
+         sTimeframe = gcwo.TIMEFRAME_CODES[int(dQuery["timeframe"][0]) - 1]
+         nYear = int(dQuery["Year"][0])
+         nMonth = int(dQuery["Month"][0])
+      except (KeyError, ValueError, IndexError):
+         self.send_body(404, b"")
+         return
+      if sTimeframe == "climate":
+         sTimeframe = "monthly"
+      if sTimeframe != "hourly":
+         nMonth = 1
+      if sTimeframe == "monthly":
+         nYear = 2000
+
+      sLang = "fr" if "bulk_data_f" in urlParsed.path else "en"
+      sFilename = get_eccc_filename(sLang, sTimeframe, \
+                                    gcwo.dProvEN[dStation["Province"]], \
+                                    dStation["Climate ID"], nYear, nMonth)
+      bContent = get_file_content(sTimeframe, nYear, nMonth)
+      with server.lock:
+         server.nBytes = server.nBytes + len(bContent)
+      self.send_body(200, bContent, \
+                     [("Content-Type", "application/octet-stream"), \
+                      ("Content-Disposition", 'attachment; filename="' + sFilename + '"')])
+
+class MockECCCServer(http.server.ThreadingHTTPServer):
+   """
+   Local server mimicking the ECCC web site for the stations of dStations. Every request
+   for a file waits fLatency seconds, and a fraction fErrorRate of them fails with a
+   '503 Service Unavailable'.
+   """
+
+   daemon_threads = True
+
+   def __init__(self, dStations, fLatency=0.0, fErrorRate=0.0, nSeed=0):
+      http.server.ThreadingHTTPServer.__init__(self, ("127.0.0.1", 0), MockECCCHandler)
+      self.dStations = dStations
+      self.fLatency = fLatency
+      self.fErrorRate = fErrorRate
+      self.randomGenerator = random.Random(nSeed)
+      self.lock = threading.Lock()
+      self.nRequests = 0
+      self.nErrors = 0
+      self.nBytes = 0
+      self.thread = None
+
+   def get_url(self):
+      return "http://127.0.0.1:" + str(self.server_address[1]) + "/"
+
+   def start(self):
+      self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+      self.thread.start()
+      return self
+
+   def stop(self):
+      self.shutdown()
+      self.server_close()
+
+@contextlib.contextmanager
+def use_mock_server(server):
+   """
+   Send the requests of get_canadian_weather_observations.py to the mock server.
+   """
+
+   sWebsiteURL = gcwo.ECCC_WEBSITE_URL
+   sURLEn = gcwo.ECCC_WEBSITE_URL_EN
+   sURLFr = gcwo.ECCC_WEBSITE_URL_FR
+   gcwo.ECCC_WEBSITE_URL = server.get_url()
+   gcwo.ECCC_WEBSITE_URL_EN = sURLEn.replace(sWebsiteURL, server.get_url())
+   gcwo.ECCC_WEBSITE_URL_FR = sURLFr.replace(sWebsiteURL, server.get_url())
+   try:
+      yield server
+   finally:
+      gcwo.ECCC_WEBSITE_URL = sWebsiteURL
+      gcwo.ECCC_WEBSITE_URL_EN = sURLEn
+      gcwo.ECCC_WEBSITE_URL_FR = sURLFr
+
+############################################################################
+# Benchmarks
+
+@contextlib.contextmanager
+def quiet():
+   """
+   Hide the messages of get_canadian_weather_observations.py.
+   """
+
+   with open(os.devnull, "w") as fichier, contextlib.redirect_stdout(fichier):
+      yield
+
+def measure(function, nRepeat):
+   """
+   Run function nRepeat times. Return the shortest time in seconds and the value returned
+   by the last call.
+   """
+
+   fBest = None
+   for i in range(nRepeat):
+      fStart = time.perf_counter()
+      result = function()
+      fTime = time.perf_counter() - fStart
+      if fBest is None or fTime < fBest:
+         fBest = fTime
+   return (fBest, result)
+
+def benchmark_station_resolution(sStationList, nRepeat):
+   """
+   Time the parsing of the station list and the resolution of the requested stations:
+   all, by province, by airport code, by station ID and by position.
+   """
+
+   with quiet():
+      (fParse, catalog) = measure(lambda: gcwo.StationCatalog("en").load(sStationList, \
+                                                                         bUseCache=False), \
+                                  nRepeat)
+   lStationID = list(catalog.dStationList.keys())
+   lInput = ["all", "QC ON", " ".join(list(catalog.dStationAirport.keys())[:50]), \
+             " ".join(lStationID[::max(1, len(lStationID) // 500)])]
+
+   def resolve():
+      for sInput in lInput:
+         catalog.fetch_requested_stations(sInput.split())
+      catalog.fetch_requested_stations([], sNear="60.0,-100.0", nNearest=10)
+      catalog.fetch_requested_stations([], sNear="45.5,-73.6", fRadius=200.0)
+      return catalog
+
+   with quiet():
+      # The spatial index and the station table are built by the first query
+      resolve()
+      (fResolve, catalog) = measure(resolve, nRepeat)
+
+   return catalog, { "time_station_list_parse_s" : fParse, \
+                     "time_station_resolution_s" : fResolve }
+
+def benchmark_planning(catalog, sDirectory, nRepeat):
+   """
+   Time the planning of every hourly, daily and monthly file of the station list.
+   """
+
+   downloader = gcwo.Downloader(catalog, sDirectory, bDryRun=True, bJournal=False)
+   def plan():
+      return sum(1 for task in downloader.plan(["all"], bHourly=True, bDaily=True, \
+                                               bMonthly=True))
+   with quiet():
+      (fPlan, nPlanned) = measure(plan, nRepeat)
+   downloader.close()
+
+   return { "time_planning_s" : fPlan, \
+            "rate_planning_files_per_s" : nPlanned / fPlan, \
+            "count_planned_files" : nPlanned }
+
+def create_downloaded_files(catalog, lStations, sDirectory):
+   """
+   Create the empty hourly and daily files of the stations lStations in sDirectory, as if
+   they had been downloaded. Return the number of files created.
+   """
+
+   nFiles = 0
+   for sStation in lStations:
+      dStation = catalog.get_station(sStation)
+      sProvince = gcwo.dProvEN[dStation["Province"]]
+      for (sTimeframe, sPrefix) in [("hourly", "HLY"), ("daily", "DLY")]:
+         if dStation[sPrefix + " First Year"] == "":
+            continue
+         sDirectoryStation = os.path.join(sDirectory, sStation, sTimeframe)
+         os.makedirs(sDirectoryStation, exist_ok=True)
+         for nYear in range(int(dStation[sPrefix + " First Year"]), \
+                            int(dStation[sPrefix + " Last Year"]) + 1):
+            for nMonth in (range(1, 13) if sTimeframe == "hourly" else [1]):
+               sFilename = get_eccc_filename("en", sTimeframe, sProvince, \
+                                             dStation["Climate ID"], nYear, nMonth)
+               open(os.path.join(sDirectoryStation, sFilename), "w").close()
+               nFiles = nFiles + 1
+   return nFiles
+
+def benchmark_no_clobber(catalog, sDirectory, nStations, nRepeat):
+   """
+   Time the planning with --no-clobber of the hourly and daily files of nStations stations
+   whose files are all already in the output directory.
+   """
+
+   lStations = [sStation for sStation in catalog.dStationList \
+                if catalog.get_station(sStation)["HLY First Year"] != ""][:nStations]
+   nFiles = create_downloaded_files(catalog, lStations, sDirectory)
+
+   downloader = gcwo.Downloader(catalog, sDirectory, bNoClobber=True, bDryRun=True, \
+                                bJournal=False)
+   def plan():
+      return sum(1 for task in downloader.plan(lStations, bHourly=True, bDaily=True))
+   with quiet():
+      (fScan, nPlanned) = measure(plan, nRepeat)
+   downloader.close()
+
+   return { "time_no_clobber_scan_s" : fScan, \
+            "rate_no_clobber_files_per_s" : nFiles / fScan, \
+            "count_no_clobber_existing_files" : nFiles, \
+            "count_no_clobber_planned_files" : nPlanned }
+
+def benchmark_download(catalog, sDirectory, nFiles, nJobs, fLatency, fErrorRate, nSeed):
+   """
+   Download nFiles hourly files from the mock server with nJobs jobs, and measure the
+   number of files and of bytes per second from the planning to the end of the downloads.
+   """
+
+   server = MockECCCServer(catalog.dStationList, fLatency, fErrorRate, nSeed).start()
+   try:
+      with use_mock_server(server), quiet():
+         fStart = time.perf_counter()
+         with gcwo.Downloader(catalog, sDirectory, nJobs=nJobs, \
+                              fRetryDelay=0.0) as downloader:
+            downloader.check_connexion()
+            iterTask = itertools.islice(downloader.plan(["all"], bHourly=True), nFiles)
+            lFailed = downloader.download(iterTask)
+         fTime = time.perf_counter() - fStart
+   finally:
+      server.stop()
+
+   nDownloaded = server.nRequests - server.nErrors
+   return { "time_download_s" : fTime, \
+            "rate_download_files_per_s" : nDownloaded / fTime, \
+            "rate_download_mb_per_s" : server.nBytes / fTime / 1e6, \
+            "count_download_requests" : server.nRequests, \
+            "count_download_errors" : server.nErrors, \
+            "count_download_failed_files" : len(lFailed) }
+
+############################################################################
+# Results
+
+def compare_to_baseline(dResults, dBaseline, fTolerance):
+   """
+   Return the list of the measures worse than in dBaseline by more than the fraction
+   fTolerance. Only the time and rate measures are compared.
+   """
+
+   lRegressions = []
+   for sName, fValue in dResults.items():
+      sKind = sName.split("_")[0]
+      if sKind not in dMeasureLowerIsBetter or sName not in dBaseline:
+         continue
+      fBaseline = dBaseline[sName]
+      if dMeasureLowerIsBetter[sKind]:
+         bRegression = fValue > fBaseline * (1.0 + fTolerance)
+      else:
+         bRegression = fValue < fBaseline * (1.0 - fTolerance)
+      if bRegression:
+         lRegressions.append("%s: %.4g (baseline %.4g)" % (sName, fValue, fBaseline))
+   return lRegressions
+
+def print_results(dResults):
+   """
+   Print the measures, one per line.
+   """
+
+   nWidth = max(len(sName) for sName in dResults)
+   for sName, value in dResults.items():
+      if isinstance(value, float):
+         print(sName.ljust(nWidth) + "  %12.4f" % (value))
+      else:
+         print(sName.ljust(nWidth) + "  %12s" % (value))
+
+def run_benchmarks(tOptions):
+   """
+   Run the benchmarks selected on the command line and return their measures.
+   """
+
+   dResults = { "count_stations" : tOptions.Stations }
+   sDirectory = tempfile.mkdtemp(prefix="eccc_benchmark_")
+   try:
+      sStationList = os.path.join(sDirectory, "Station Inventory EN.csv")
+      create_station_list(sStationList, tOptions.Stations, tOptions.Seed)
+
+      catalog, dMeasures = benchmark_station_resolution(sStationList, tOptions.Repeat)
+      dResults.update(dMeasures)
+      print("Station resolution done", file=sys.stderr)
+
+      if "planning" in tOptions.Benchmarks:
+         sOutput = os.path.join(sDirectory, "plan")
+         os.makedirs(sOutput)
+         dResults.update(benchmark_planning(catalog, sOutput, tOptions.Repeat))
+         print("Planning done", file=sys.stderr)
+
+      if "no-clobber" in tOptions.Benchmarks:
+         sOutput = os.path.join(sDirectory, "no_clobber")
+         os.makedirs(sOutput)
+         dResults.update(benchmark_no_clobber(catalog, sOutput, tOptions.ScanStations, \
+                                              tOptions.Repeat))
+         print("No-clobber scan done", file=sys.stderr)
+
+      if "download" in tOptions.Benchmarks:
+         sOutput = os.path.join(sDirectory, "download")
+         os.makedirs(sOutput)
+         dResults.update(benchmark_download(catalog, sOutput, tOptions.Files, tOptions.Jobs, \
+                                            tOptions.Latency, tOptions.ErrorRate, \
+                                            tOptions.Seed))
+         print("Download done", file=sys.stderr)
+   finally:
+      shutil.rmtree(sDirectory, ignore_errors=True)
+
+   return dResults
+
+def get_command_line():
+   """
+   Parse the command line and perform all the checks.
+   """
+
+   parser = argparse.ArgumentParser(description="measure the performance of get_canadian_weather_observations.py with a synthetic station list and a local server mimicking the ECCC web site.")
+   parser.add_argument("--stations", dest="Stations", \
+                       help="Number of stations in the synthetic station list. Default: 8000, about the size of the ECCC list.", \
+                       action="store", type=int, default=8000)
+   parser.add_argument("--scan-stations", dest="ScanStations", \
+                       help="Number of stations whose files are already downloaded for the --no-clobber scan. Default: 20.", \
+                       action="store", type=int, default=20)
+   parser.add_argument("--files", dest="Files", \
+                       help="Number of files downloaded from the mock server. Default: 200.", \
+                       action="store", type=int, default=200)
+   parser.add_argument("--jobs", "-j", dest="Jobs", \
+                       help="Number of files downloaded concurrently. Default: 4.", \
+                       action="store", type=int, default=4)
+   parser.add_argument("--latency", dest="Latency", \
+                       help="Delay in seconds of the mock server before answering a request for a file. Default: 0.02.", \
+                       action="store", type=float, default=0.02)
+   parser.add_argument("--error-rate", dest="ErrorRate", \
+                       help="Fraction of the requests for a file answered by '503 Service Unavailable'. Default: 0.", \
+                       action="store", type=float, default=0.0)
+   parser.add_argument("--repeat", dest="Repeat", \
+                       help="Number of runs of the station resolution, planning and scan benchmarks. The shortest time is kept. Default: 3.", \
+                       action="store", type=int, default=3)
+   parser.add_argument("--seed", dest="Seed", \
+                       help="Seed of the synthetic station list and of the errors of the mock server. Default: 1.", \
+                       action="store", type=int, default=1)
+   parser.add_argument("--benchmark", dest="Benchmarks", \
+                       help="Benchmark to run after the station resolution, can be repeated: planning, no-clobber or download. Default: all.", \
+                       action="append", choices=["planning", "no-clobber", "download"], default=None)
+   parser.add_argument("--json", dest="Json", metavar="FILE", \
+                       help="Save the measures in FILE.", \
+                       action="store", type=str, default=None)
+   parser.add_argument("--baseline", dest="Baseline", metavar="FILE", \
+                       help="Compare the measures to the ones saved in FILE with --json, and exit with an error if one is worse by more than --tolerance.", \
+                       action="store", type=str, default=None)
+   parser.add_argument("--tolerance", dest="Tolerance", \
+                       help="Fraction by which a measure can be worse than the baseline. Default: 0.25.", \
+                       action="store", type=float, default=0.25)
+
+   options = parser.parse_args()
+   if options.Benchmarks is None:
+      options.Benchmarks = ["planning", "no-clobber", "download"]
+   if options.Stations < 1 or options.Files < 1 or options.Jobs < 1 or options.Repeat < 1:
+      print("ERROR: --stations, --files, --jobs and --repeat must be positive.")
+      exit(1)
+   if not 0.0 <= options.ErrorRate < 1.0:
+      print("ERROR: --error-rate must be between 0 and 1: " + str(options.ErrorRate))
+      exit(1)
+   if options.Baseline is not None and not os.path.exists(options.Baseline):
+      print("ERROR: baseline file does not exist: " + options.Baseline)
+      exit(1)
+
+   return options
+
+
+if __name__ == "__main__":
+
+   tOptions = get_command_line()
+   dResults = run_benchmarks(tOptions)
+   print_results(dResults)
+
+   if tOptions.Json is not None:
+      with open(tOptions.Json, "w", encoding="utf-8") as fichier:
+         json.dump(dResults, fichier, indent=1)
+
+   if tOptions.Baseline is not None:
+      with open(tOptions.Baseline, "r", encoding="utf-8") as fichier:
+         dBaseline = json.load(fichier)
+      lRegressions = compare_to_baseline(dResults, dBaseline, tOptions.Tolerance)
+      if len(lRegressions) > 0:
+         print("ERROR: performance regression compared to " + tOptions.Baseline + ":")
+         for sRegression in lRegressions:
+            print("\t" + sRegression)
+         exit(1)
+      print("No performance regression compared to " + tOptions.Baseline)
@@ -31,18 +31,37 @@ Date: July 25th 2017
 import sys
 import os
 import shutil
-import glob
 import datetime
 import urllib
 import io
+import re
 import csv
+import json
+import hashlib
+import gzip
+import pickle
+import time
 import urllib.request
+import urllib.parse
+import urllib.error
 import cgi
-from multiprocessing import Pool
+import http.client
+import threading
+import math
+import array
+import heapq
+import random
+import email.utils
+import shlex
+import socket
+import argparse
+import functools
+import calendar
+import codecs
+import xml.etree.ElementTree
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 
-# From dateutil package: https://pypi.python.org/pypi/python-dateutil
-from dateutil import rrule
 # From progress https://pypi.python.org/pypi/progress
 from progress.bar import Bar
 
@@ -55,8 +74,69 @@ VERBOSE= 2
 
 nGlobalVerbosity = 1
 
-# Dictionnary used for variables specific to the language of the request
-dLang = {}
+# Number of files planned in advance for each concurrent download
+PENDING_DOWNLOADS_PER_JOB = 4
+# Size in bytes of the chunks read from the network and written on disk
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Cache of the parsed station list
+STATION_CACHE_DIRECTORY = os.path.join(os.environ.get("XDG_CACHE_HOME", \
+                                                      os.path.expanduser("~/.cache")), \
+                                       "get_canadian_weather_observations")
+STATION_CACHE_VERSION = 2
+# Time to live in seconds of the online station list in cache
+STATION_CACHE_TTL = 24 * 3600
+
+# Retries after a transient error: number, delay in seconds before the first retry
+# (doubled for each attempt), maximum delay and maximum delay asked by the server
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 60.0
+MAX_RETRY_AFTER = 600.0
+
+# Name of the file recording the downloads, in the output directory
+MANIFEST_FILENAME = "download_manifest.jsonl"
+# Name of the file recording the progress of the last run, in the output directory
+JOURNAL_FILENAME = "download_journal.jsonl"
+# Periods without observation of the stations, in the output directory
+COVERAGE_FILENAME = "download_coverage.jsonl"
+# Requests to download again the invalid files found by --verify, in the output directory
+VERIFY_FILENAME = "verify_requests_{lang}_{format}.txt"
+# Number of files checked at once by each process of --verify
+VERIFY_CHUNK_SIZE = 16
+# Columnar archive: sub-directory of the partitions, compression, key of the metadata 
+# listing the observation files of a partition
+ARCHIVE_DIRECTORY = "archive"
+ARCHIVE_COMPRESSION = "zstd"
+ARCHIVE_SOURCES_KEY = b"eccc_sources"
+# Name of the partitions, i.e. en_hourly_2203095_1990.parquet
+ARCHIVE_FILENAME_REGEX = re.compile(r"^(?P<lang>en|fr)_(?P<timeframe>hourly|daily|monthly)_" + \
+                                    r"(?P<climateid>[^_]+)(?:_(?P<year>\d{4}))?\.parquet$")
+ARCHIVE_TIMEFRAMES = ["hourly", "daily", "monthly"]
+# Columns kept as text or converted to integers in the archive, in English and French
+ARCHIVE_TEXT_COLUMN_REGEX = re.compile(r"(Flag|Indicateur)$|^(Time \(LST\)|Heure \(HNL\)|" + \
+                                       r"Weather|Temps|Data Quality|Qualité des Données)$")
+ARCHIVE_INTEGER_COLUMNS = ["Year", "Month", "Day", "Année", "Mois", "Jour"]
+ARCHIVE_MONTH_COLUMN = 6
+# Columns that do not contain an observation, after the station and the date
+EMPTY_IGNORED_COLUMN_REGEX = re.compile(r"(Flag|Indicateur)$|^(Time \(LST\)|Heure \(HNL\)|" + \
+                                        r"Data Quality|Qualité des Données)$")
+# Values written by ECCC when there is no observation
+lEmptyValues = ["", "NA"]
+# Locks of the partitions of the archive being updated
+dArchiveLocks = {}
+lockArchiveLocks = threading.Lock()
+# Matrix of one variable for all the stations: sub-directory, type of the values, version of
+# the index and unit of the time axis of each timeframe (see numpy.datetime64)
+MATRIX_DIRECTORY = "matrix"
+MATRIX_DTYPE = "float32"
+MATRIX_VERSION = 1
+dMatrixTimeUnit = { "hourly" : "h", "daily" : "D", "monthly" : "M" }
+# Composite stations suggested: distance in km between a station and its predecessor, 
+# years their records can overlap and years without observation between them
+COMPOSITE_RADIUS = 10.0
+COMPOSITE_OVERLAP = 1
+COMPOSITE_MAX_GAP = 5
 
 # URLs
 ECCC_WEBSITE_URL = "https://climate.weather.gc.ca/"
@@ -69,6 +149,26 @@ ECCC_WEBSITE_URL_EN = ECCC_WEBSITE_URL +\
 ECCC_WEBSITE_URL_FR = ECCC_WEBSITE_URL +\
            "climate_data/bulk_data_f.html?format={format}&stationID={station}&timeframe={timeframe}&Year={year}&Month={month}&submit=++T%C3%A9l%C3%A9charger+%0D%0Ades+donn%C3%A9es"
 
+# Timeframes in the order of their code in the URLs: 1 for hourly, 2 for daily, ...
+TIMEFRAME_CODES = ["hourly", "daily", "monthly", "climate"]
+
+# Name of the files provided by ECCC, i.e. en_climate_hourly_NT_2203095_001-1990_P1H.csv
+FILENAME_REGEX = re.compile(r"^(?P<lang>en|fr)_[^_]+_[^_]+_[A-Z]{2}_(?P<climateid>[^_]+)_" +\
+                            r"(?:(?:(?P<month>\d{1,3})-)?(?P<year>\d{4})_)?" +\
+                            r"P1(?P<period>[HDM])\.(?P<format>csv|xml)(?:\.gz|\.zst)?$", re.IGNORECASE)
+dPeriodTimeframe = { "H" : "hourly", "D" : "daily", "M" : "monthly" }
+# Former name of the files, i.e. eng-hourly-01012014-01312014.csv
+FORMER_FILENAME_REGEX = re.compile(r"^(?P<lang>en|fr).*-(?P<timeframe>hourly|daily|monthly|almanac)-" +\
+                                   r"(?P<period>[0-9-]+)\.(?P<format>csv|xml)(?:\.gz|\.zst)?$", \
+                                   re.IGNORECASE)
+
+# Suffix and level of the compressed observation files, see --compress
+dCompressionSuffix = { "gzip" : ".gz", "zstd" : ".zst" }
+dCompressionLevel = { "gzip" : 6, "zstd" : 9 }
+
+# Mean radius of the Earth in km, for the distances between stations
+EARTH_RADIUS = 6371.0088
+
 # CSV file station list
 COLUMN_TITLE_EN=["Name","Province","Climate ID","Station ID","WMO ID","TC ID",\
                  "Latitude (Decimal Degrees)","Longitude (Decimal Degrees)",\
@@ -76,22 +176,11 @@ COLUMN_TITLE_EN=["Name","Province","Climate ID","Station ID","WMO ID","TC ID",\
                  "HLY First Year","HLY Last Year","DLY First Year","DLY Last Year",\
                  "MLY First Year","MLY Last Year"]
 
-# Dictionnaries to contain the station ID of the list
-dStationList = {}
-dStationAirport = {}
-dProvTerrList = { "AB" : [], \
-                  "BC" : [], \
-                  "MB" : [], \
-                  "NB" : [], \
-                  "NL" : [], \
-                  "NS" : [], \
-                  "NT" : [], \
-                  "NU" : [], \
-                  "ON" : [], \
-                  "PE" : [], \
-                  "QC" : [], \
-                  "SK" : [], \
-                  "YT" : []  }
+# Columns of the station list with the years of observation, and prefix of the columns
+# of each timeframe
+STATION_YEAR_COLUMNS = ["First Year", "Last Year", "HLY First Year", "HLY Last Year", \
+                        "DLY First Year", "DLY Last Year", "MLY First Year", "MLY Last Year"]
+dTimeframePrefix = { "hourly" : "HLY ", "daily" : "DLY ", "monthly" : "MLY " }
 
 # Province and territory string and code management
 lProvTerrCode = ["AB","BC","MB","NB","NL","NS","NT","NU", \
@@ -122,7 +211,6 @@ dProvEN = { "ALBERTA" : "AB" , \
             "QUEBEC" : "QC", \
             "SASKATCHEWAN" : "SK", \
             "YUKON TERRITORY" : "YT"  }
-dProvCode = None # Will be set to EN or FR
                   
 def my_print(sMessage, nMessageVerbosity=NORMAL):
    """
@@ -134,18 +222,45 @@ def my_print(sMessage, nMessageVerbosity=NORMAL):
    elif nMessageVerbosity == VERBOSE and nGlobalVerbosity == VERBOSE:
       print (sMessage)
 
-def set_language(sLang):
+class ObservationsError(Exception):
    """
-   Set the different values specific to the language (URL, station list header, etc.)
+   Error raised instead of exiting the program, so the functions and classes of this module 
+   can be used as a library. nExitCode is the exit status of the command line for this error.
+   """
+
+   def __init__(self, sMessage, nExitCode=1):
+      Exception.__init__(self, sMessage)
+      self.nExitCode = nExitCode
+
+class DateFormatError(ObservationsError):
+   """
+   Requested dates are not valid.
+   """
+
+class StationListError(ObservationsError):
+   """
+   Station list cannot be loaded.
+   """
+
+class ECCCConnexionError(ObservationsError):
+   """
+   ECCC Climate web site cannot be reached.
+   """
+
+class RequestError(ObservationsError):
+   """
+   Request of a batch cannot be parsed.
+   """
+
+class CompressionError(ObservationsError):
+   """
+   Observation files cannot be compressed or decompressed.
+   """
+
+class ArchiveError(ObservationsError):
+   """
+   Columnar archive cannot be written or read.
    """
-   global dProvCode
-   
-   if sLang == "en":
-      dLang['station_list_URL'] = STATION_LIST_EN      
-      dProvCode = dProvEN
-   elif sLang == "fr":
-      dLang['station_list_URL'] = STATION_LIST_FR
-      dProvCode = dProvFR
 
 def check_input_dates(lDates):
    """
@@ -187,9 +302,8 @@ def check_input_dates(lDates):
       timeEndDate = check_date_format(sEndDate)
    if sStartDate != None and sEndDate != None: 
       if timeStartDate > timeEndDate:  # Check if start date is before end date
-         my_print("ERROR: Start date is after end date:\n " + sStartDate + " after " + sEndDate,
-                  nMessageVerbosity=NORMAL)
-         exit(8)
+         raise DateFormatError("ERROR: Start date is after end date:\n " + sStartDate + \
+                               " after " + sEndDate, 8)
       # Start date format: YYYY-MM / End date format: YYYY
       elif len(sStartDate) > len(sEndDate):
          my_print("Start date is in format 'YYYY-MM' while End date is 'YYYY': '"+ \
@@ -214,357 +328,995 @@ def check_date_format(sDate):
    """
    Check if the provided string is a valid date of the format 'YYYY' or 'YYYY-MM'
 
-   If one value is not valid, the program displays an error message and exits.
+   If one value is not valid, DateFormatError is raised.
    """
 
+   sError = "Requested date must be of format 'YYYY' or 'YYYY-MM'.\n" +\
+            "Provided value: '" + sDate + "'"
+
    if len(sDate) == 4: # YYYY format
       try:
          timeDate = datetime.datetime.strptime(sDate, '%Y')
          my_print("Requested date is: " + sDate,  nMessageVerbosity=VERBOSE)
       except ValueError:
-         my_print ("Requested date must be of format 'YYYY' or 'YYYY-MM'.", \
-                   nMessageVerbosity=NORMAL)
-         my_print("Provided value: '" + sDate + "'", \
-                  nMessageVerbosity=NORMAL)
-         exit(5)
+         raise DateFormatError(sError, 5)
    elif len(sDate) == 7: # YYYY-MM format
       try:
          timeDate = datetime.datetime.strptime(sDate, '%Y-%m')
          my_print("Requested date is: " + sDate,  nMessageVerbosity=VERBOSE)
       except ValueError:
-         my_print ("Requested date must be of format 'YYYY' or 'YYYY-MM'.", \
-                   nMessageVerbosity=NORMAL)
-         my_print("Provided value: '" + sDate + "'",  nMessageVerbosity=NORMAL)
-         exit(6)
+         raise DateFormatError(sError, 6)
    else: # Date format not allowed
-      my_print ("Requested date must be of format 'YYYY' or 'YYYY-MM'.", \
-                nMessageVerbosity=NORMAL)
-      my_print("Provided value: '" + sDate + "'",  nMessageVerbosity=NORMAL)
-      exit(7)
+      raise DateFormatError(sError, 7)
 
    return timeDate
    
 
-def check_eccc_climate_connexion():
+class PooledResponse(io.RawIOBase):
+   """
+   File-like object returned by HTTPConnectionPool.urlopen. When it is closed, the underlying
+   connection is given back to the pool if the whole response has been read, and closed otherwise.
+   """
+
+   def __init__(self, httpPool, tKey, connection, httpResponse, sURL):
+      self.httpPool = httpPool
+      self.tKey = tKey
+      self.connection = connection
+      self.httpResponse = httpResponse
+      self.url = sURL
+      self.status = httpResponse.status
+      self.headers = httpResponse.headers
+
+   def readable(self):
+      return True
+
+   def readinto(self, buffer):
+      return self.httpResponse.readinto(buffer)
+
+   def read(self, nSize=-1):
+      if nSize is None or nSize < 0:
+         return self.httpResponse.read()
+      return self.httpResponse.read(nSize)
+
+   def getheader(self, sName, default=None):
+      return self.httpResponse.getheader(sName, default)
+
+   def close(self):
+      if self.connection is not None:
+         if self.httpResponse.isclosed() and not self.httpResponse.will_close:
+            self.httpPool.release(self.tKey, self.connection)
+         else:
+            self.httpResponse.close()
+            self.connection.close()
+         self.connection = None
+      super().close()
+
+
+class HTTPConnectionPool:
+   """
+   Pool of persistent (keep-alive) HTTP/HTTPS connections shared by the download threads.
+   All the files are downloaded from the same host, so reusing the connections saves a
+   TCP and TLS handshake for every file. The pool keeps at most nMaxConnections idle 
+   connections per host, which should be the number of concurrent downloads.
+
+   URL with another scheme (i.e. the FTP station list) are opened with urllib.
+   """
+
+   MAX_REDIRECTIONS = 5
+
+   def __init__(self, nMaxConnections=1, nTimeout=60):
+      self.nMaxConnections = nMaxConnections
+      self.nTimeout = nTimeout
+      self.dIdleConnections = {}
+      self.lock = threading.Lock()
+      self.dHeaders = { "User-Agent" : "get_canadian_weather_observations.py/" + VERSION, \
+                        "Connection" : "keep-alive" }
+
+   def acquire(self, tKey):
+      """
+      Return an idle connection for the (scheme, host, port) key, or a new one if none is
+      available. The boolean returned is True if the connection was already used.
+      """
+      with self.lock:
+         lIdle = self.dIdleConnections.get(tKey)
+         if lIdle:
+            return lIdle.pop(), True
+
+      (sScheme, sHost, nPort) = tKey
+      if sScheme == "https":
+         connection = http.client.HTTPSConnection(sHost, nPort, timeout=self.nTimeout)
+      else:
+         connection = http.client.HTTPConnection(sHost, nPort, timeout=self.nTimeout)
+      return connection, False
+
+   def release(self, tKey, connection):
+      """
+      Give back a connection to the pool. Close it if enough connections are idle.
+      """
+      with self.lock:
+         lIdle = self.dIdleConnections.setdefault(tKey, [])
+         if len(lIdle) < self.nMaxConnections:
+            lIdle.append(connection)
+            return
+      connection.close()
+
+   def close(self):
+      """
+      Close all the idle connections.
+      """
+      with self.lock:
+         for lIdle in self.dIdleConnections.values():
+            for connection in lIdle:
+               connection.close()
+         self.dIdleConnections = {}
+
+   def request(self, tKey, sSelector, dHeaders):
+      """
+      Send the request on a pooled connection and return the connection and its response.
+      If a reused connection has been closed by the server in the meantime, the request is
+      sent again on a new connection.
+      """
+      connection, bReused = self.acquire(tKey)
+      try:
+         connection.request("GET", sSelector, headers=dHeaders)
+         httpResponse = connection.getresponse()
+      except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+         connection.close()
+         if not bReused:
+            raise
+         my_print("Kept-alive connection closed by server, reconnecting", \
+                  nMessageVerbosity=VERBOSE)
+         return self.request(tKey, sSelector, dHeaders)
+      except Exception:
+         connection.close()
+         raise
+      return connection, httpResponse
+
+   def urlopen(self, sURL, dHeaders=None):
+      """
+      Open the URL and return a PooledResponse. Redirections are followed. 
+      Raise urllib.error.HTTPError if the server returns an error, like urllib.request.urlopen.
+      """
+      dAllHeaders = dict(self.dHeaders)
+      if dHeaders is not None:
+         dAllHeaders.update(dHeaders)
+
+      for i in range(self.MAX_REDIRECTIONS + 1):
+         tURL = urllib.parse.urlsplit(sURL)
+         if tURL.scheme not in ["http", "https"]:
+            return urllib.request.urlopen(urllib.request.Request(sURL, headers=dAllHeaders), \
+                                          timeout=self.nTimeout)
+         nPort = tURL.port
+         if nPort is None:
+            nPort = 443 if tURL.scheme == "https" else 80
+         tKey = (tURL.scheme, tURL.hostname, nPort)
+         sSelector = tURL.path or "/"
+         if tURL.query:
+            sSelector = sSelector + "?" + tURL.query
+
+         connection, httpResponse = self.request(tKey, sSelector, dAllHeaders)
+         response = PooledResponse(self, tKey, connection, httpResponse, sURL)
+
+         if httpResponse.status in [301, 302, 303, 307, 308] and \
+            httpResponse.getheader("Location") is not None:
+            sURL = urllib.parse.urljoin(sURL, httpResponse.getheader("Location"))
+            response.read()
+            response.close()
+            my_print("Redirected to: " + sURL, nMessageVerbosity=VERBOSE)
+         elif httpResponse.status >= 400:
+            response.read()
+            response.close()
+            raise urllib.error.HTTPError(sURL, httpResponse.status, httpResponse.reason, \
+                                         httpResponse.headers, None)
+         else:
+            return response
+
+      raise urllib.error.URLError("Too many redirections for: " + sURL)
+
+
+def open_url(sURL, httpPool=None, dHeaders=None):
+   """
+   Open the URL with the connection pool if one is provided, with urllib otherwise.
+   """
+
+   if httpPool is None:
+      if dHeaders is None:
+         dHeaders = {}
+      return urllib.request.urlopen(urllib.request.Request(sURL, headers=dHeaders))
+   return httpPool.urlopen(sURL, dHeaders)
+
+
+def check_eccc_climate_connexion(httpPool=None):
    """
    Check if we can connect the ECCC Climate web site. If not, there is point to continue.
+   The connection is kept in httpPool, if provided, for the following downloads.
    """
 
    my_print("Checking if ECCC Climate web site is available...", nMessageVerbosity=VERBOSE)
 
    try:
-      urllib.request.urlopen(ECCC_WEBSITE_URL)
-   except urllib.error.URLError :
-      my_print ("ERROR: Climate web site not available", nMessageVerbosity=NORMAL)
-      my_print ("Check your internet connexion or try to reach\n '" +\
-                ECCC_WEBSITE_URL + "'\n in a web browser.", nMessageVerbosity=NORMAL)
-      my_print ("Exiting.", nMessageVerbosity=NORMAL)
-      sys.exit(1)
+      httpResponse = open_url(ECCC_WEBSITE_URL, httpPool)
+      httpResponse.read()
+      httpResponse.close()
+   except (OSError, http.client.HTTPException) :
+      raise ECCCConnexionError("ERROR: Climate web site not available\n" +\
+                               "Check your internet connexion or try to reach\n '" +\
+                               ECCC_WEBSITE_URL + "'\n in a web browser.", 1)
 
    my_print("ECCC Climate web site reached! Continuing. ", nMessageVerbosity=VERBOSE)
 
    
-def load_station_list(sPath):
+class StationIndex:
    """
-   Download the latest file from the ECCC climate web site.
+   Spatial index of the stations: a k-d tree of their positions on the unit sphere, built 
+   from the columns 'Latitude (Decimal Degrees)' and 'Longitude (Decimal Degrees)' of the 
+   station list. The straight-line distance between two points of the sphere grows with 
+   their great circle distance, so the nearest stations in the tree are the nearest on Earth.
    """
-   global dStationList, dStationAirport, dProvTerrList
 
-   # Check if a local path is given
-   if sPath is not None:
-      my_print("Loading local file for station list at: " + sPath, nMessageVerbosity=VERBOSE)
-      # Open file
-      if os.path.exists(sPath) == False:
-         my_print("ERROR: Local station path does not exist: " +sPath,\
-                  nMessageVerbosity=NORMAL)
-         my_print("Please fix this error or try the online version of station file.")
-         my_print("Exiting")
-         exit(2)
+   def __init__(self, dStationList):
+      self.lStation = []
+      self.lPoint = []
+      for sStation in dStationList:
+         lPosition = get_station_position(dStationList[sStation])
+         if lPosition is None:
+            continue # Station without coordinates
+         self.lStation.append(sStation)
+         self.lPoint.append(get_unit_vector(*lPosition))
+
+      # Nodes of the tree are the indexes of the stations
+      self.lLeft = [-1] * len(self.lStation)
+      self.lRight = [-1] * len(self.lStation)
+      self.lAxis = [0] * len(self.lStation)
+      self.nRoot = self.build(list(range(len(self.lStation))))
+      my_print("Spatial index built for " + str(len(self.lStation)) + " stations", \
+               nMessageVerbosity=VERBOSE)
+
+   def build(self, lIndex):
+      """
+      Build the sub-tree of the stations lIndex, split on the axis of the largest spread.
+      Return the index of its root, -1 if empty.
+      """
+
+      if len(lIndex) == 0:
+         return -1
+      nAxis = max(range(3), key=lambda nAxis: \
+                  max(self.lPoint[i][nAxis] for i in lIndex) - \
+                  min(self.lPoint[i][nAxis] for i in lIndex))
+      lIndex.sort(key=lambda i: self.lPoint[i][nAxis])
+      nMedian = len(lIndex) // 2
+      nNode = lIndex[nMedian]
+      self.lAxis[nNode] = nAxis
+      self.lLeft[nNode] = self.build(lIndex[:nMedian])
+      self.lRight[nNode] = self.build(lIndex[nMedian + 1:])
+      return nNode
+
+   def nearest(self, fLat, fLon, nNearest):
+      """
+      Return the list of (station ID, distance in km) of the nNearest stations of the 
+      position, from the nearest.
+      """
+
+      tPoint = get_unit_vector(fLat, fLon)
+      lHeap = [] # Max-heap of the nearest stations found: (-squared chord, station index)
+
+      def visit(nNode):
+         if nNode < 0:
+            return
+         fDistance = get_squared_chord(tPoint, self.lPoint[nNode])
+         if len(lHeap) < nNearest:
+            heapq.heappush(lHeap, (-fDistance, nNode))
+         elif fDistance < -lHeap[0][0]:
+            heapq.heapreplace(lHeap, (-fDistance, nNode))
+         fDiff = tPoint[self.lAxis[nNode]] - self.lPoint[nNode][self.lAxis[nNode]]
+         if fDiff < 0:
+            (nNear, nFar) = (self.lLeft[nNode], self.lRight[nNode])
+         else:
+            (nNear, nFar) = (self.lRight[nNode], self.lLeft[nNode])
+         visit(nNear)
+         if len(lHeap) < nNearest or fDiff * fDiff < -lHeap[0][0]:
+            visit(nFar)
+
+      if nNearest > 0:
+         visit(self.nRoot)
+      return sorted([(self.lStation[nNode], get_chord_distance(-fDistance)) \
+                     for (fDistance, nNode) in lHeap], key=lambda tStation: tStation[1])
+
+   def within(self, fLat, fLon, fRadius):
+      """
+      Return the list of (station ID, distance in km) of the stations at fRadius km or less
+      of the position, from the nearest.
+      """
+
+      tPoint = get_unit_vector(fLat, fLon)
+      # Chord of the radius. Beyond half the circumference, the whole sphere is included.
+      fAngle = min(fRadius / EARTH_RADIUS, math.pi)
+      fMaxDistance = (2 * math.sin(fAngle / 2)) ** 2
+      lFound = []
+
+      lStack = [self.nRoot]
+      while len(lStack) > 0:
+         nNode = lStack.pop()
+         if nNode < 0:
+            continue
+         fDistance = get_squared_chord(tPoint, self.lPoint[nNode])
+         if fDistance <= fMaxDistance:
+            lFound.append((self.lStation[nNode], get_chord_distance(fDistance)))
+         fDiff = tPoint[self.lAxis[nNode]] - self.lPoint[nNode][self.lAxis[nNode]]
+         if fDiff <= 0 or fDiff * fDiff <= fMaxDistance:
+            lStack.append(self.lLeft[nNode])
+         if fDiff >= 0 or fDiff * fDiff <= fMaxDistance:
+            lStack.append(self.lRight[nNode])
+
+      return sorted(lFound, key=lambda tStation: tStation[1])
+
+def get_unit_vector(fLat, fLon):
+   """
+   Return the position (x, y, z) on the unit sphere of a latitude and longitude in degrees.
+   """
+
+   fLat = math.radians(fLat)
+   fLon = math.radians(fLon)
+   return (math.cos(fLat) * math.cos(fLon), math.cos(fLat) * math.sin(fLon), math.sin(fLat))
+
+def get_squared_chord(tPoint1, tPoint2):
+   """
+   Return the squared straight-line distance between two points of the unit sphere.
+   """
+
+   return (tPoint1[0] - tPoint2[0]) ** 2 + (tPoint1[1] - tPoint2[1]) ** 2 + \
+          (tPoint1[2] - tPoint2[2]) ** 2
+
+def get_chord_distance(fSquaredChord):
+   """
+   Return the great circle distance in km corresponding to a squared chord of the unit sphere.
+   """
+
+   return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(fSquaredChord) / 2))
+
+def parse_coordinates(sNear):
+   """
+   Parse the position 'LAT,LON' in decimal degrees given with --near. Return [fLat, fLon].
+   Raise RequestError if it is not valid.
+   """
+
+   try:
+      [fLat, fLon] = [float(sValue) for sValue in sNear.split(",")]
+   except ValueError:
+      raise RequestError("ERROR: position must be of format 'LAT,LON' in decimal degrees, " + \
+                         "i.e. '45.50,-73.57'. Provided value: '" + sNear + "'", 18)
+   if not (-90 <= fLat <= 90 and -180 <= fLon <= 180):
+      raise RequestError("ERROR: latitude must be between -90 and 90 and longitude between " + \
+                         "-180 and 180. Provided value: '" + sNear + "'", 18)
+   return [fLat, fLon]
+
+class StationTable:
+   """
+   Years of the station list as arrays of integers, one per column of STATION_YEAR_COLUMNS,
+   in the order of lStation (dIndex gives the position of a station). A missing year is 0.
+   dMonths holds for each timeframe the arrays of the month indexes of January of the first 
+   year and December of the last year (see get_month_index), 0 if the station does not 
+   record this timeframe. It is built when the station list is loaded and cached with it,
+   so planning does not parse any date. The stations can be filtered in one
+   pass over the arrays, with numpy when it is already imported (the arrays are read without
+   copy). Importing numpy only for this would take longer than the pass itself.
+   """
+
+   def __init__(self, dStationList, dState=None):
+      # Arrays read from the cache (see get_state)
+      if dState is not None:
+         self.lStation = dState["stations"]
+         self.dIndex = dict((sStation, i) for i, sStation in enumerate(self.lStation))
+         self.dColumns = dState["columns"]
+         self.dMonths = dState["months"]
+         return
+
+      self.lStation = list(dStationList.keys())
+      self.dIndex = dict((sStation, i) for i, sStation in enumerate(self.lStation))
+      self.dColumns = {}
+      for sColumn in STATION_YEAR_COLUMNS:
+         self.dColumns[sColumn] = array.array("i", \
+            (get_station_year(dStationList[sStation].get(sColumn)) for sStation in self.lStation))
+
+      self.dMonths = {}
+      for sTimeframe in dTimeframePrefix:
+         arrayFirstYear = self.dColumns[dTimeframePrefix[sTimeframe] + "First Year"]
+         arrayLastYear = self.dColumns[dTimeframePrefix[sTimeframe] + "Last Year"]
+         self.dMonths[sTimeframe] = \
+            [array.array("i", (get_month_index(nYear, 1) if nYear > 0 else 0 \
+                               for nYear in arrayFirstYear)), \
+             array.array("i", (get_month_index(nYear, 12) if nYear > 0 else 0 \
+                               for nYear in arrayLastYear))]
+      my_print("Station table built for " + str(len(self.lStation)) + " stations", \
+               nMessageVerbosity=VERBOSE)
+
+   def get_state(self):
+      """
+      Return the arrays of the table, to be saved in the cache of the station list.
+      """
+
+      return { "stations" : self.lStation, "columns" : self.dColumns, "months" : self.dMonths }
+
+   def get_year_columns(self, lHas=None):
+      """
+      Return the list of the [first year, last year] columns to check: the ones of the 
+      timeframes lHas, or the whole record of the station.
+      """
+
+      if not lHas:
+         return [["First Year", "Last Year"]]
+      return [[dTimeframePrefix[sTimeframe] + "First Year", \
+               dTimeframePrefix[sTimeframe] + "Last Year"] for sTimeframe in lHas]
+
+   def filter(self, lStations=None, nMinYears=None, lHas=None, nActiveSince=None):
+      """
+      Return the stations of lStations (all the stations if None) that have observations
+      for all the timeframes lHas ('hourly', 'daily', 'monthly'), during at least nMinYears 
+      years and until nActiveSince or later. Without lHas, the whole record of the station
+      is checked.
+      """
+
+      lYearColumns = self.get_year_columns(lHas)
+      # From numpy: https://pypi.org/project/numpy/
+      numpy = sys.modules.get("numpy")
+
+      if numpy is not None:
+         mask = numpy.ones(len(self.lStation), dtype=bool)
+         for [sFirstColumn, sLastColumn] in lYearColumns:
+            arrayFirst = numpy.frombuffer(self.dColumns[sFirstColumn], dtype=numpy.intc)
+            arrayLast = numpy.frombuffer(self.dColumns[sLastColumn], dtype=numpy.intc)
+            mask &= (arrayFirst > 0) & (arrayLast > 0)
+            if nMinYears is not None:
+               mask &= arrayLast - arrayFirst + 1 >= nMinYears
+            if nActiveSince is not None:
+               mask &= arrayLast >= nActiveSince
+         setSelected = set(self.lStation[i] for i in numpy.flatnonzero(mask))
       else:
-         file_list = open(sPath, 'r')
-         station_list = csv.DictReader(file_list, fieldnames=COLUMN_TITLE_EN)
-   else:
-      try:
-         my_print("Loading online station list at: " + \
-                  dLang['station_list_URL'], nMessageVerbosity=VERBOSE)
-         my_print("This may take a while...", nMessageVerbosity=VERBOSE)         
-         # Recipe from http://bit.ly/2hc9XMB
-         webpage = urllib.request.urlopen(dLang['station_list_URL'])
-         station_list = csv.DictReader(io.TextIOWrapper(webpage), \
-                                       fieldnames=COLUMN_TITLE_EN)
-
-      except urllib.error.URLError :
-         my_print ("ERROR: Online CSV station list not available.", \
-                   nMessageVerbosity=NORMAL)
-         my_print ("Cannot reach the FTP web site.\n",\
-                   nMessageVerbosity=NORMAL)
-         my_print ("This can be caused by firewall settings or by the FTP site being unreachable.\n Try accessing the URL through a web browser:\n '" +\
-                    dLang['station_list_URL']+ "'\n", nMessageVerbosity=NORMAL)
-         my_print ("If not working, the FTP server may be experiencing down time.\n",\
-                    nMessageVerbosity=NORMAL) 
-         my_print ("Local station list not provided.\n You can try using a local version provided with get_canadian_weather_observations.py with '-S' arguments in command line. Exiting.",\
-                      nMessageVerbosity=NORMAL)
-         exit(9)
-            
+         setSelected = set()
+         lArrays = [[self.dColumns[sFirstColumn], self.dColumns[sLastColumn]] \
+                    for [sFirstColumn, sLastColumn] in lYearColumns]
+         for i, sStation in enumerate(self.lStation):
+            for [arrayFirst, arrayLast] in lArrays:
+               if arrayFirst[i] <= 0 or arrayLast[i] <= 0 or \
+                  (nMinYears is not None and arrayLast[i] - arrayFirst[i] + 1 < nMinYears) or \
+                  (nActiveSince is not None and arrayLast[i] < nActiveSince):
+                  break
+            else:
+               setSelected.add(sStation)
 
+      if lStations is None:
+         return [sStation for sStation in self.lStation if sStation in setSelected]
+      return [sStation for sStation in lStations if sStation in setSelected]
 
-   # Fill the dictionnaries with the station list
-   # Skip the first 4 lines
-   for i in range(4):
-      next(station_list)
+def get_station_year(sYear):
+   """
+   Return a year of the station list as an integer, 0 if it is not provided.
+   """
 
+   if not sYear:
+      return 0
    try:
-      for row in station_list:
-         # EC internal station code
-         nStationCode = row["Station ID"]
-         dStationList[nStationCode] = row
-
-         # If the station correspond to an airport
-         sAirport = row["TC ID"]
-         if len(sAirport) == 3:
-            if sAirport not in dStationAirport.keys():
-               dStationAirport[sAirport] = []
-            dStationAirport[sAirport].append(nStationCode)
-
-         # Order by province/territory
-         sProvTerr = row["Province"]
-         dProvTerrList[dProvCode[sProvTerr]].append(nStationCode)
-   except TypeError:
-      my_print("ERROR: Local station file has an invalid format: " +sPath,\
-               nMessageVerbosity=NORMAL)
-      my_print("Please fix this error or try the online version of station file.")
-      my_print("Exiting")
-      exit(2)
-   except KeyError:
-      my_print("ERROR: Local station file has an invalid format: " +sPath,\
-               nMessageVerbosity=NORMAL)
-      my_print("Do you have the file of the right language? Try using --lang fr.")
-      my_print("Exiting")
-      exit(2)
+      return int(sYear)
+   except ValueError:
+      return 0
 
-def fetch_requested_stations(lInput):
+class StationCatalog:
    """
-   Fetch all the lines in the dictionnary containing all the stations and store them 
-   in another dictionnary.
+   Station list of ECCC in one language, with the indexes used to resolve the requested
+   stations: by station ID, by airport code, by province or territory and by position
+   (see StationIndex, built on the first query). The stations can be filtered on their 
+   years of observation (see StationTable).
 
-   Arguments:
-    lInput: list of all the srings given in the input.
-    return lStationRequested: list of all the station ID corresponding to the input.
+   A catalog can be loaded once and kept in memory to process many requests. Errors are
+   raised as StationListError.
    """
-   lStationRequested = []
 
-   # If "all", or any lower/uppercase variant, load everything and exit
-   if "all" in lInput:
-      my_print("All stations requested", nMessageVerbosity=VERBOSE)
-      lStationRequested = dStationList.keys()
+   def __init__(self, sLang="en"):
+      """
+      Set the different values specific to the language (URL, station list header, etc.)
+      """
+
+      if sLang == "en":
+         self.sStationListURL = STATION_LIST_EN
+         self.dProvCode = dProvEN
+      elif sLang == "fr":
+         self.sStationListURL = STATION_LIST_FR
+         self.dProvCode = dProvFR
+      else:
+         raise ValueError("Language must be 'en' or 'fr': " + str(sLang))
+      self.sLang = sLang
+
+      # Dictionnaries to contain the station ID of the list
+      self.dStationList = {}
+      self.dStationAirport = {}
+      self.dProvTerrList = {}
+      for sProvTerr in lProvTerrCode:
+         self.dProvTerrList[sProvTerr] = []
+      self.sModifiedDate = None
+      self.spatialIndex = None
+      self.stationTable = None
+
+   def get_cache_path(self, sSource):
+      """
+      Return the path of the cache file of the station list loaded from sSource (local path
+      or URL) in the language of the catalog.
+      """
+
+      sKey = hashlib.sha1((sSource + "|" + self.sLang).encode("utf-8")).hexdigest()
+      return os.path.join(STATION_CACHE_DIRECTORY, "station_list_" + sKey[:16] + ".pickle")
+
+   def read_cache(self, sSource, nCacheTTL, bLocal):
+      """
+      Fill the station dictionnaries from the cache of the station list loaded from sSource.
+      The cache is valid if the local file (bLocal is True) did not change since the cache 
+      was written, or if the online file was downloaded less than nCacheTTL seconds ago.
+      Return True if the cache was used, False otherwise.
+      """
+
+      sCachePath = self.get_cache_path(sSource)
+      try:
+         with open(sCachePath, "rb") as fichier:
+            dCache = pickle.load(fichier)
+      except (OSError, pickle.PickleError, EOFError, AttributeError, ValueError):
+         return False
+
+      if dCache.get("version") != STATION_CACHE_VERSION or dCache.get("source") != sSource:
+         return False
+      if bLocal:
+         statSource = os.stat(sSource)
+         if dCache["source_mtime"] != statSource.st_mtime or \
+            dCache["source_size"] != statSource.st_size:
+            my_print("Station list changed since it was cached", nMessageVerbosity=VERBOSE)
+            return False
+      elif time.time() - dCache["created"] > nCacheTTL:
+         my_print("Cached station list is expired", nMessageVerbosity=VERBOSE)
+         return False
+
+      self.dStationList = dCache["stations"]
+      self.dStationAirport = dCache["airports"]
+      self.dProvTerrList = dCache["provinces"]
+      self.sModifiedDate = dCache["modified_date"]
+      self.spatialIndex = None
+      self.stationTable = StationTable(self.dStationList, dCache["table"])
+      my_print("Station list loaded from cache: " + sCachePath, nMessageVerbosity=VERBOSE)
+      my_print("Station list modified date: " + self.sModifiedDate, nMessageVerbosity=VERBOSE)
+      return True
+
+   def write_cache(self, sSource):
+      """
+      Save the station dictionnaries loaded from sSource in the cache.
+      """
+
+      dCache = { "version" : STATION_CACHE_VERSION, \
+                 "source" : sSource, \
+                 "source_mtime" : None, \
+                 "source_size" : None, \
+                 "modified_date" : self.sModifiedDate, \
+                 "created" : time.time(), \
+                 "stations" : self.dStationList, \
+                 "airports" : self.dStationAirport, \
+                 "provinces" : self.dProvTerrList, \
+                 "table" : self.get_station_table().get_state() }
+      if os.path.exists(sSource):
+         statSource = os.stat(sSource)
+         dCache["source_mtime"] = statSource.st_mtime
+         dCache["source_size"] = statSource.st_size
+
+      sCachePath = self.get_cache_path(sSource)
+      sTemporaryPath = sCachePath + "." + str(os.getpid()) + ".part"
+      try:
+         os.makedirs(STATION_CACHE_DIRECTORY, exist_ok=True)
+         with open(sTemporaryPath, "wb") as fichier:
+            pickle.dump(dCache, fichier, protocol=pickle.HIGHEST_PROTOCOL)
+         os.replace(sTemporaryPath, sCachePath)
+         my_print("Station list saved in cache: " + sCachePath, nMessageVerbosity=VERBOSE)
+      except OSError as e:
+         my_print("WARNING: cannot write station list cache: " + sCachePath + "\n\t" + repr(e), \
+                  nMessageVerbosity=VERBOSE)
+
+   def load(self, sPath=None, httpPool=None, bUseCache=True, nCacheTTL=STATION_CACHE_TTL):
+      """
+      Load the station list from the local file sPath, or download the latest file from the 
+      ECCC climate web site if sPath is None.
+
+      The parsed station list is cached in STATION_CACHE_DIRECTORY. A local file is parsed 
+      again only when it changes, the online file when the cache is older than nCacheTTL seconds.
+      """
+
+      if sPath is not None:
+         if os.path.exists(sPath) == False:
+            raise StationListError("ERROR: Local station path does not exist: " + sPath + "\n" +\
+                                   "Please fix this error or try the online version of station file.", 2)
+         sSource = os.path.abspath(sPath)
+      else:
+         sSource = self.sStationListURL
+      if bUseCache and self.read_cache(sSource, nCacheTTL, sPath is not None):
+         return self
+
+      # Check if a local path is given
+      if sPath is not None:
+         my_print("Loading local file for station list at: " + sPath, nMessageVerbosity=VERBOSE)
+         # Open file
+         file_list = open(sPath, 'r')
+         station_list = csv.DictReader(file_list, fieldnames=COLUMN_TITLE_EN)
+      else:
+         try:
+            my_print("Loading online station list at: " + \
+                     self.sStationListURL, nMessageVerbosity=VERBOSE)
+            my_print("This may take a while...", nMessageVerbosity=VERBOSE)         
+            # Recipe from http://bit.ly/2hc9XMB
+            webpage = open_url(self.sStationListURL, httpPool)
+            station_list = csv.DictReader(io.TextIOWrapper(webpage), \
+                                          fieldnames=COLUMN_TITLE_EN)
+
+         except urllib.error.URLError :
+            raise StationListError("ERROR: Online CSV station list not available.\n" +\
+                                   "Cannot reach the FTP web site.\n\n" +\
+                                   "This can be caused by firewall settings or by the FTP site being unreachable.\n Try accessing the URL through a web browser:\n '" +\
+                                   self.sStationListURL + "'\n\n" +\
+                                   "If not working, the FTP server may be experiencing down time.\n\n" +\
+                                   "Local station list not provided.\n You can try using a local version provided with get_canadian_weather_observations.py with '-S' arguments in command line.", 9)
+
+      # Fill the dictionnaries with the station list, replacing a list loaded before
+      self.dStationList = {}
+      self.dStationAirport = {}
+      self.dProvTerrList = {}
+      for sProvTerr in lProvTerrCode:
+         self.dProvTerrList[sProvTerr] = []
+      self.spatialIndex = None
+      self.stationTable = None
+      try:
+         # Skip the first 4 lines. The first one contains the modified date of the list.
+         sModifiedDate = next(station_list)["Name"].lstrip("\ufeff")
+         self.sModifiedDate = sModifiedDate.split(":", 1)[-1].strip()
+         for i in range(3):
+            next(station_list)
+
+         for row in station_list:
+            # EC internal station code
+            nStationCode = row["Station ID"]
+            self.dStationList[nStationCode] = row
+
+            # If the station correspond to an airport
+            sAirport = row["TC ID"]
+            if len(sAirport) == 3:
+               if sAirport not in self.dStationAirport.keys():
+                  self.dStationAirport[sAirport] = []
+               self.dStationAirport[sAirport].append(nStationCode)
+
+            # Order by province/territory
+            sProvTerr = row["Province"]
+            self.dProvTerrList[self.dProvCode[sProvTerr]].append(nStationCode)
+      except (TypeError, StopIteration):
+         raise StationListError("ERROR: Local station file has an invalid format: " + str(sPath) + "\n" +\
+                                "Please fix this error or try the online version of station file.", 2)
+      except KeyError:
+         raise StationListError("ERROR: Local station file has an invalid format: " + str(sPath) + "\n" +\
+                                "Do you have the file of the right language? Try using --lang fr.", 2)
+
+      self.stationTable = StationTable(self.dStationList)
+
+      if bUseCache:
+         self.write_cache(sSource)
+      return self
+
+   def get_station(self, sStation):
+      """
+      Return the line of the station list for the station ID sStation.
+      """
+
+      return self.dStationList[sStation]
+
+   def get_spatial_index(self):
+      """
+      Return the StationIndex of the catalog, built the first time it is needed.
+      """
+
+      if self.spatialIndex is None:
+         self.spatialIndex = StationIndex(self.dStationList)
+      return self.spatialIndex
+
+   def get_station_table(self):
+      """
+      Return the StationTable of the catalog, built the first time it is needed.
+      """
+
+      if self.stationTable is None:
+         self.stationTable = StationTable(self.dStationList)
+      return self.stationTable
+
+   def find_near_stations(self, fLat, fLon, fRadius=None, nNearest=None):
+      """
+      Return the list of (station ID, distance in km) of the stations near a position, 
+      from the nearest: the nNearest stations, within fRadius km if provided.
+      """
+
+      spatialIndex = self.get_spatial_index()
+      if fRadius is not None:
+         lStationDistance = spatialIndex.within(fLat, fLon, fRadius)
+         if nNearest is not None:
+            lStationDistance = lStationDistance[:nNearest]
+      else:
+         lStationDistance = spatialIndex.nearest(fLat, fLon, nNearest)
+      return lStationDistance
+
+   def fetch_requested_stations(self, lInput, sNear=None, fRadius=None, nNearest=None, \
+                                nMinYears=None, lHas=None, nActiveSince=None):
+      """
+      Fetch all the lines in the dictionnary containing all the stations and store them 
+      in another dictionnary.
+
+      Arguments:
+       lInput: list of all the srings given in the input.
+       sNear: position 'LAT,LON' given with --near. The stations within fRadius km and/or 
+        the nNearest stations of this position are added.
+       nMinYears, lHas, nActiveSince: only keep the stations with these years of
+        observation (see StationTable.filter). If no station nor position is given, all the
+        stations are filtered.
+       return lStationRequested: list of all the station ID corresponding to the input.
+      """
+      bFilter = nMinYears is not None or lHas or nActiveSince is not None
+      if bFilter and len(lInput) == 0 and sNear is None:
+         lInput = ["all"]
+      lStationRequested = self.select_stations(lInput, sNear, fRadius, nNearest)
+      if bFilter:
+         nRequested = len(lStationRequested)
+         lStationRequested = self.get_station_table().filter(lStationRequested, nMinYears, \
+                                                             lHas, nActiveSince)
+         my_print("Stations kept by the filters: " + str(len(lStationRequested)) + \
+                  " out of " + str(nRequested), nMessageVerbosity=VERBOSE)
       return lStationRequested
-      
-   # If not all stations requested, build the station list
-   for sElement in lInput:
-      if len(sElement) == 3 and sElement.isalpha(): # Airport code         
-         if sElement in dStationAirport.keys():
-            my_print("Airport code added in list: " +sElement, nMessageVerbosity=VERBOSE)
-            my_print("Corresponding station(s): " + \
-                    str(dStationAirport[sElement]) , nMessageVerbosity=VERBOSE)
-            lStationRequested = lStationRequested + dStationAirport[sElement]
-         else:
-            my_print("Warning: requested airport code not in station list: '" + sElement +\
-                     "'\nIgnoring", nMessageVerbosity=NORMAL)
-      elif sElement.isdigit(): # Station ID
-         if sElement in dStationList.keys():
-            my_print("Station code added in list: " +sElement, nMessageVerbosity=VERBOSE)
-            my_print("Corresponding station: " + \
-                    str(dStationList[sElement]) , nMessageVerbosity=VERBOSE)
-            lStationRequested.append(sElement)
-         else:
-            my_print("Warning: requested station code not in station list: '" + sElement +\
-                     "'\nIgnoring", nMessageVerbosity=NORMAL)
-      elif len(sElement) == 2 :
-         if sElement in lProvTerrCode: # Province or territory
-            my_print("Station in province or territory added: " +sElement, \
-                     nMessageVerbosity=VERBOSE)
-            lStationRequested = lStationRequested + dProvTerrList[sElement]
-         else:
-            my_print("Warning: requested province or territory not in list: '" + sElement +\
-                     "'\nOptions are:", nMessageVerbosity=NORMAL)
-            my_print(lProvTerrCode, nMessageVerbosity=NORMAL)
-      else: # Argument did not fit any criteria
-            my_print("Warning: requested argument not valid: '" + sElement +\
-                     "' Skipping.", nMessageVerbosity=NORMAL)
+
+   def select_stations(self, lInput, sNear=None, fRadius=None, nNearest=None):
+      """
+      Return the list of the station ID corresponding to the input and to the position.
+      See fetch_requested_stations.
+      """
+      lStationRequested = []
+
+      if sNear is not None:
+         [fLat, fLon] = parse_coordinates(sNear)
+         for (sStation, fDistance) in self.find_near_stations(fLat, fLon, fRadius, nNearest):
+            my_print("Station near " + sNear + " added in list: " + sStation + \
+                     " (%.1f km)" % (fDistance), nMessageVerbosity=VERBOSE)
+            lStationRequested.append(sStation)
+
+      # If "all", or any lower/uppercase variant, load everything and exit
+      if "all" in lInput:
+         my_print("All stations requested", nMessageVerbosity=VERBOSE)
+         lStationRequested = list(self.dStationList.keys())
+         return lStationRequested
          
-   return lStationRequested
+      # If not all stations requested, build the station list
+      for sElement in lInput:
+         if len(sElement) == 3 and sElement.isalpha(): # Airport code         
+            if sElement in self.dStationAirport.keys():
+               my_print("Airport code added in list: " +sElement, nMessageVerbosity=VERBOSE)
+               my_print("Corresponding station(s): " + \
+                       str(self.dStationAirport[sElement]) , nMessageVerbosity=VERBOSE)
+               lStationRequested = lStationRequested + self.dStationAirport[sElement]
+            else:
+               my_print("Warning: requested airport code not in station list: '" + sElement +\
+                        "'\nIgnoring", nMessageVerbosity=NORMAL)
+         elif sElement.isdigit(): # Station ID
+            if sElement in self.dStationList.keys():
+               my_print("Station code added in list: " +sElement, nMessageVerbosity=VERBOSE)
+               my_print("Corresponding station: " + \
+                       str(self.dStationList[sElement]) , nMessageVerbosity=VERBOSE)
+               lStationRequested.append(sElement)
+            else:
+               my_print("Warning: requested station code not in station list: '" + sElement +\
+                        "'\nIgnoring", nMessageVerbosity=NORMAL)
+         elif len(sElement) == 2 :
+            if sElement in lProvTerrCode: # Province or territory
+               my_print("Station in province or territory added: " +sElement, \
+                        nMessageVerbosity=VERBOSE)
+               lStationRequested = lStationRequested + self.dProvTerrList[sElement]
+            else:
+               my_print("Warning: requested province or territory not in list: '" + sElement +\
+                        "'\nOptions are:", nMessageVerbosity=NORMAL)
+               my_print(lProvTerrCode, nMessageVerbosity=NORMAL)
+         else: # Argument did not fit any criteria
+               my_print("Warning: requested argument not valid: '" + sElement +\
+                        "' Skipping.", nMessageVerbosity=NORMAL)
+            
+      return lStationRequested
+
+def get_month_index(nYear, nMonth=1):
+   """
+   Return the index of a month: the number of months since year 0 (year * 12 + month - 1).
+   Periods are compared and iterated with these integers.
+   """
+
+   return nYear * 12 + nMonth - 1
+
+def format_month_index(nMonthIndex, bMonth=True):
+   """
+   Return the month index as a string 'YYYY-MM', or 'YYYY' if bMonth is False.
+   """
+
+   if bMonth:
+      return "%04d-%02d" % (nMonthIndex // 12, nMonthIndex % 12 + 1)
+   return "%04d" % (nMonthIndex // 12)
+
+def get_requested_months(lDateRequested):
+   """
+   Convert the requested dates returned by check_input_dates in month indexes.
+   """
+
+   return [None if timeDate is None else get_month_index(timeDate.year, timeDate.month) \
+           for timeDate in lDateRequested]
 
-def check_specific_date(sStation, timeDate, timeFirstYear, timeLastYear, sPeriod=None):
+def check_specific_date(sStation, nDate, nFirstMonth, nLastMonth, sPeriod=None):
    """
    When a specific date is given, check if it falls between the intervals. 
    Return True if it is in the interval, False otherwise.
    """
 
-   if timeDate < timeFirstYear: # Requested before the station starts recording
+   if nDate < nFirstMonth: # Requested before the station starts recording
       my_print("Station " +sStation + ":\n\t" + sPeriod +" values: requested year" + \
                " is before the station started to record values", nMessageVerbosity=NORMAL)
-      my_print("\tRequested year: " + timeDate.strftime('%Y'), \
-               nMessageVerbosity=NORMAL)
-      my_print("\tStarting year for this station: " + timeFirstYear.strftime('%Y') + ". Skipping",\
+      my_print("\tRequested year: " + format_month_index(nDate, False), \
                nMessageVerbosity=NORMAL)
+      my_print("\tStarting year for this station: " + format_month_index(nFirstMonth, False) + \
+               ". Skipping", nMessageVerbosity=NORMAL)
       return False
-   elif timeDate > timeLastYear: # Requested after the station ends recording
+   elif nDate > nLastMonth: # Requested after the station ends recording
       my_print("Station " +sStation + ":\n\t" + sPeriod +" values: requested year" + \
                " is after the station started to record values", nMessageVerbosity=NORMAL)
-      my_print("\tRequested year: " + timeDate.strftime('%Y'), \
-               nMessageVerbosity=NORMAL)
-      my_print("\tLast year for this station: " + timeLastYear.strftime('%Y') + ". Skipping",\
+      my_print("\tRequested year: " + format_month_index(nDate, False), \
                nMessageVerbosity=NORMAL)
+      my_print("\tLast year for this station: " + format_month_index(nLastMonth, False) + \
+               ". Skipping", nMessageVerbosity=NORMAL)
       return False
    else:
-      my_print("Station " + sStation + ":\n\trequested date for " +sPeriod + " data is valid. ", \
-               nMessageVerbosity=VERBOSE)
+      if nGlobalVerbosity == VERBOSE:
+         my_print("Station " + sStation + ":\n\trequested date for " +sPeriod + \
+                  " data is valid. ", nMessageVerbosity=VERBOSE)
       return True
 
    
-def check_start_date(sStation, timeStartDate, timeEndDate, timeFirstYear,\
-                     timeLastYear, sLastYear, sPeriod=None):
+def check_start_date(sStation, nStartDate, nEndDate, nFirstMonth, nLastMonth, sPeriod=None):
    """
    When a specific starting date is given, check if it falls between the intervals. 
    Return the interval in a list if it falls between valid dates,  None otherwise.
    """
    
-   if timeStartDate > timeLastYear: # start date is after the last year of recording
+   if nStartDate > nLastMonth: # start date is after the last year of recording
       my_print("Station " + sStation + ":\n\t" +sPeriod +" values: requested year(s)" + \
                " is after the station started to record values", nMessageVerbosity=NORMAL)
-      my_print("\tRequested year: " + timeStartDate.strftime('%Y-'), \
-               nMessageVerbosity=NORMAL)
-      my_print("\tLast year for this station: " + timeLastYear.strftime('%Y') + ". Skipping",\
+      my_print("\tRequested year: " + format_month_index(nStartDate, False) + "-", \
                nMessageVerbosity=NORMAL)
+      my_print("\tLast year for this station: " + format_month_index(nLastMonth, False) + \
+               ". Skipping", nMessageVerbosity=NORMAL)
       return None
-   elif timeEndDate == None : # No ending date, covers the whole period after valid start date
-      sStartYearRequested = datetime.datetime.strftime(timeStartDate, "%Y-%m")
-      my_print("Station " + sStation + ":", nMessageVerbosity=VERBOSE)
-      if timeStartDate < timeFirstYear:
-         sFirstYear = datetime.datetime.strftime(timeFirstYear, "%Y-%m")
-         my_print("\tRequested start date before first year for this station. Changing " +\
-               sStartYearRequested +" with " +sFirstYear, nMessageVerbosity=VERBOSE)
-         sStartYearRequested = datetime.datetime.strftime(timeFirstYear, "%Y-%m")
-      my_print("\tgetting " +sPeriod + " values for period: [" +\
-               sStartYearRequested + "," + sLastYear + "]" , nMessageVerbosity=VERBOSE)
-      return [sStartYearRequested, sLastYear]
-   elif timeEndDate < timeFirstYear: # Requested period is before observations started
+   elif nEndDate == None : # No ending date, covers the whole period after valid start date
+      nStartRequested = max(nStartDate, nFirstMonth)
+      if nGlobalVerbosity == VERBOSE:
+         my_print("Station " + sStation + ":", nMessageVerbosity=VERBOSE)
+         if nStartDate < nFirstMonth:
+            my_print("\tRequested start date before first year for this station. Changing " +\
+                     format_month_index(nStartDate) +" with " + format_month_index(nFirstMonth), \
+                     nMessageVerbosity=VERBOSE)
+         my_print("\tgetting " +sPeriod + " values for period: [" +\
+                  format_month_index(nStartRequested) + "," + format_month_index(nLastMonth) + \
+                  "]" , nMessageVerbosity=VERBOSE)
+      return [nStartRequested, nLastMonth]
+   elif nEndDate < nFirstMonth: # Requested period is before observations started
       my_print("Station " + sStation + ":\n\t" +sPeriod + " values: requested year" + \
                " is before the station started to record values", nMessageVerbosity=NORMAL)
-      my_print("\tLast year requested: " + timeEndDate.strftime('%Y'), \
-               nMessageVerbosity=NORMAL)
-      my_print("\tStarting year for this station: " + timeFirstYear.strftime('%Y') + ". Skipping",\
+      my_print("\tLast year requested: " + format_month_index(nEndDate, False), \
                nMessageVerbosity=NORMAL)
+      my_print("\tStarting year for this station: " + format_month_index(nFirstMonth, False) + \
+               ". Skipping", nMessageVerbosity=NORMAL)
       return None
    else: # Period is covered
-      sStartYearRequested = datetime.datetime.strftime(timeStartDate, "%Y-%m")
-      sEndYearRequested = datetime.datetime.strftime(timeEndDate, "%Y-%m")
-      my_print("Station " + sStation + ":\n\tgetting " +sPeriod +" values for period: [" +\
-               sStartYearRequested + "," + sEndYearRequested + "]" , nMessageVerbosity=VERBOSE)
-      return [sStartYearRequested, sEndYearRequested]
+      if nGlobalVerbosity == VERBOSE:
+         my_print("Station " + sStation + ":\n\tgetting " +sPeriod +" values for period: [" +\
+                  format_month_index(nStartDate) + "," + format_month_index(nEndDate) + "]", \
+                  nMessageVerbosity=VERBOSE)
+      return [nStartDate, nEndDate]
 
    
-def check_end_date(sStation, timeStartDate, timeEndDate, timeFirstYear,\
-                     timeLastYear, sFirstYear, sPeriod=None):
+def check_end_date(sStation, nStartDate, nEndDate, nFirstMonth, nLastMonth, sPeriod=None):
    """
    When a specific ending date is given, check if it falls between the intervals. 
    Return the interval in a list if it falls between valid dates,  None otherwise.
    """
    
-   if timeEndDate < timeFirstYear: # Requested period is before observations started
+   if nEndDate < nFirstMonth: # Requested period is before observations started
       my_print("Station " + sStation + ":\n\t" +sPeriod + " values: requested year(s)" + \
                " is before the station started to record values", nMessageVerbosity=NORMAL)
-      my_print("\tLast year requested: " + timeEndDate.strftime('%Y'), \
+      my_print("\tLast year requested: " + format_month_index(nEndDate, False), \
                nMessageVerbosity=NORMAL)
-      my_print("\tStarting year for this station: " + timeFirstYear.strftime('%Y'),\
+      my_print("\tStarting year for this station: " + format_month_index(nFirstMonth, False),\
                nMessageVerbosity=NORMAL)
       my_print("\tSkipping", nMessageVerbosity=NORMAL)
       return None
-   elif timeStartDate == None:
-      if timeEndDate >  timeLastYear: # end-date is after last year
-         sEndYearRequested = datetime.datetime.strftime(timeLastYear, "%Y-%m")
+   elif nStartDate == None:
+      if nEndDate > nLastMonth: # end-date is after last year
          my_print("Station " + sStation + ":\n\tLast year after the valid station period. " + \
                      "Using the last year for station instead of requested date")
-         my_print("\tgetting " +sPeriod +" values for period: [" +\
-                     sFirstYear + "," + sEndYearRequested + "]" , nMessageVerbosity=VERBOSE)
-         return [sFirstYear, sEndYearRequested]
+         nEndRequested = nLastMonth
       else:
-         sEndYearRequested = datetime.datetime.strftime(timeEndDate, "%Y-%m")
-         my_print("Station " + sStation + ":\n\tgetting " +sPeriod +" values for period: [" +\
-                  sFirstYear + "," + sEndYearRequested + "]" , nMessageVerbosity=VERBOSE)
-         return [sFirstYear, sEndYearRequested]
+         if nGlobalVerbosity == VERBOSE:
+            my_print("Station " + sStation + ":", nMessageVerbosity=VERBOSE)
+         nEndRequested = nEndDate
+      if nGlobalVerbosity == VERBOSE:
+         my_print("\tgetting " +sPeriod +" values for period: [" + \
+                  format_month_index(nFirstMonth) + "," + format_month_index(nEndRequested) + \
+                  "]" , nMessageVerbosity=VERBOSE)
+      return [nFirstMonth, nEndRequested]
 
 
-def check_period(sStation, lDateRequested, sFirstYear, sLastYear, sPeriod):
+def check_period(sStation, lMonthRequested, nFirstMonth, nLastMonth, sPeriod):
    """
    INPUT
    sStation: Station ID for logging purpose
-   lDateRequested: List of requested dates in strptime format. In order:
+   lMonthRequested: List of requested dates as month indexes (see get_requested_months), 
+    None if not requested. In order:
      1- Specific date
      2- Start date
      3- End date
-   sFirstYear: String in format YYYY for the first year of recording of the station
-   sEndYear: String in format YYYY for the last year of recording of the station
+   nFirstMonth: month index of January of the first year of recording of the station,
+    0 if the station does not record this period
+   nLastMonth: month index of December of the last year of recording of the station
    sPeriod: String for the period: monthly/daily/hourly
    
    OUTPUT
-   Return the interval to download [YYYY-MM, YYYY-MM]. Since there is only one file per month, 
-   only the months are needed to identify the download period.
+   Return the interval to download [first month index, last month index]. Since there is 
+   only one file per month, only the months are needed to identify the download period.
    """
-   [timeDate, timeStartDate, timeEndDate] = lDateRequested
+   [nDate, nStartDate, nEndDate] = lMonthRequested
    
    # Check if the station records monthly value (one file per station covers the whole period)
-   if len(sFirstYear) == 0: 
+   if nFirstMonth <= 0: 
       my_print("Station " + sStation + " does not have " +sPeriod +" value. Skipping.",
                nMessageVerbosity=NORMAL)
       return None
-   # Since there is no information for starting/ending month, assumed January for start and
-   # December for the last year.
-   else:
-      sFirstYear = sFirstYear + "-01"
-      sLastYear = sLastYear + "-12"
 
    # If no date provided, download the data
-   if timeDate == None and timeStartDate == None and timeEndDate == None :
-      my_print("\tgetting " +sPeriod +" values for the whole period: ["\
-               +sFirstYear +"," +sLastYear  +"]", nMessageVerbosity=VERBOSE)
-      return [sFirstYear, sLastYear]
-
-         
-   timeFirstYear = datetime.datetime.strptime(sFirstYear, '%Y-%m')
-   timeLastYear = datetime.datetime.strptime(sLastYear, '%Y-%m')
+   if nDate == None and nStartDate == None and nEndDate == None :
+      if nGlobalVerbosity == VERBOSE:
+         my_print("\tgetting " +sPeriod +" values for the whole period: [" + \
+                  format_month_index(nFirstMonth) + "," + format_month_index(nLastMonth) + "]", \
+                  nMessageVerbosity=VERBOSE)
+      return [nFirstMonth, nLastMonth]
 
    # If a specific date is required
-   if timeDate != None:
-      bInterval = check_specific_date(sStation, timeDate, \
-                                      timeFirstYear, timeLastYear, sPeriod=sPeriod)
+   if nDate != None:
+      bInterval = check_specific_date(sStation, nDate, nFirstMonth, nLastMonth, sPeriod=sPeriod)
       if bInterval :
-         sRequestedYear = datetime.datetime.strftime(timeDate, "%Y-%m")
-         my_print("\tgetting " +sPeriod  +" values for period: [" +\
-                  sRequestedYear + "," + sRequestedYear + "]" , nMessageVerbosity=VERBOSE)
-         lInterval = [sRequestedYear, sRequestedYear]
+         if nGlobalVerbosity == VERBOSE:
+            my_print("\tgetting " +sPeriod  +" values for period: [" + \
+                     format_month_index(nDate) + "," + format_month_index(nDate) + "]", \
+                     nMessageVerbosity=VERBOSE)
+         lInterval = [nDate, nDate]
       else:
          return None
    # If the start date is specified
-   elif timeStartDate != None:
-      lInterval = check_start_date(sStation, timeStartDate, timeEndDate, \
-                                   timeFirstYear, timeLastYear, sLastYear, sPeriod=sPeriod)
+   elif nStartDate != None:
+      lInterval = check_start_date(sStation, nStartDate, nEndDate, nFirstMonth, nLastMonth, \
+                                   sPeriod=sPeriod)
       
    # If only the end date is specified
    else:
-      lInterval = check_end_date(sStation, timeStartDate, timeEndDate, \
-                                   timeFirstYear, timeLastYear, sFirstYear, sPeriod=sPeriod)
+      lInterval = check_end_date(sStation, nStartDate, nEndDate, nFirstMonth, nLastMonth, \
+                                 sPeriod=sPeriod)
 
 
    return lInterval
 
 
   
-def set_interval_date(lStationRequested, dObsPeriod, lDateRequested):
+def set_interval_date(catalog, lStationRequested, dObsPeriod, lDateRequested):
    """
    Check if the interval requested on command line are available for each station requested.
+   The periods of the stations are read in the month indexes precomputed by the StationTable
+   of the catalog.
 
    INPUT
+   catalog: StationCatalog containing the requested stations.
    lStationRequested: List of Station ID of requested stations.
    dObsPeriod: Dictionnary linking the hourly/daily/monthly/climate obs period request to a boolean.
    lDateRequested: List of requested dates in strptime format. In order:
@@ -575,17 +1327,19 @@ def set_interval_date(lStationRequested, dObsPeriod, lDateRequested):
    OUTPUT
    dStationStartEndDates: dictionnary with station ID as key. Each station is linked to a 
    dictionnary with keys: "monthly" "daily" "hourly" "climate"
-   "monthly" only needs a boolean, since one file covers the whole period. You download the file, or you don't.
-   "daily" is a list of years [YYYY, YYYY]
-   "hourly" is a list of year and month [YYYY-MM, YYYY-MM]
+   "monthly" only needs a value that is not None, since one file covers the whole period. You download the file, or you don't.
+   "daily" is a list of month indexes [first, last], only the years are used
+   "hourly" is a list of month indexes [first, last] (see get_month_index)
    "climate" only needs a boolean, since one file covers the whole period. You download the file, or you don't.
    
  
    """
    dStationStartEndDates = {}
+   lMonthRequested = get_requested_months(lDateRequested)
+   stationTable = catalog.get_station_table()
 
    for sStation in lStationRequested:
-      dStation = dStationList[sStation]      
+      nStation = stationTable.dIndex[sStation]
 
       # Initialisation of the start/end date dictionnary
       dStationStartEndDates[sStation] = { "monthly" : None , \
@@ -593,349 +1347,3205 @@ def set_interval_date(lStationRequested, dObsPeriod, lDateRequested):
                                           "hourly" :  None ,\
                                           "climate" : None }
 
-      if dObsPeriod["monthly"]: # Check for monthly values
-         sFirstYear = dStation["MLY First Year"]
-         sLastYear = dStation["MLY Last Year"]
-
-         dStationStartEndDates[sStation]["monthly"] = \
-                                                    check_period(sStation, lDateRequested, sFirstYear, sLastYear, "monthly")
+      for sPeriod in ["monthly", "daily", "hourly"]:
+         if dObsPeriod[sPeriod]: # Check for monthly, daily and hourly values
+            [arrayFirstMonth, arrayLastMonth] = stationTable.dMonths[sPeriod]
+            dStationStartEndDates[sStation][sPeriod] = \
+               check_period(sStation, lMonthRequested, arrayFirstMonth[nStation], \
+                            arrayLastMonth[nStation], sPeriod)
+                
+      if dObsPeriod["climate"]: # Check for climate values
+         # Since we can't use the Station inventory to know if the file exists, we download it if requested.
+         dStationStartEndDates[sStation]["climate"] = True
+         
+
+      # Remove item from the dictionnaries if there is no valid interval
+      if dStationStartEndDates[sStation]["monthly"] == None and \
+         dStationStartEndDates[sStation]["daily"] == None and \
+         dStationStartEndDates[sStation]["hourly"] == None and \
+         dStationStartEndDates[sStation]["climate"] == None :
+         my_print("\tStation does not have any valid data to download.",\
+                  nMessageVerbosity=VERBOSE)
+         del dStationStartEndDates[sStation]
+         
+   return dStationStartEndDates
+
+def get_output_directory(sDirectory):
+   """
+   Return the output directory. If it is not given, use the path where the script is located.
+   """
+
+   if sDirectory == None:
+      sDirectory = os.path.dirname(os.path.realpath(__file__))
+   return sDirectory
+
+def index_existing_files(sDirectory):
+   """
+   Scan sDirectory once and build an index of the observation files it contains, so 
+   --no-clobber can check if a file has already been downloaded without looking at the disk.
+
+   Both the current naming of ECCC files (i.e. en_climate_hourly_NT_2203095_001-1990_P1H.csv,
+   en_climate_daily_NT_2203095_1993_P1D.csv) and the former one 
+   (i.e. eng-hourly-01012014-01312014.csv) are recognized. The former one does not contain
+   the climate ID, which is then set to None. The files added to the columnar archive 
+   without being saved (see --stream-archive) are also indexed.
+
+   INPUT
+   sDirectory: directory to scan
+
+   OUTPUT
+   dExistingFiles: dictionnary with tuples (language, format, climate ID, timeframe, year, month)
+    as keys and the modification time of the file as value. year and month are None when
+    they do not apply to the timeframe.
+   """
+
+   dExistingFiles = {}
+   if not os.path.isdir(sDirectory):
+      return dExistingFiles
+
+   for entry in os.scandir(sDirectory):
+      tKey = parse_filename(entry.name)
+      if tKey is not None:
+         dExistingFiles[tKey] = max(entry.stat().st_mtime, dExistingFiles.get(tKey, 0))
+      elif entry.name == ARCHIVE_DIRECTORY and entry.is_dir():
+         for entryPartition in os.scandir(entry.path):
+            if not entryPartition.name.endswith(".parquet"):
+               continue
+            dSources = read_archive_sources(entryPartition.path)
+            for sFilename in dSources:
+               tKey = parse_filename(sFilename)
+               fModificationTime = dSources[sFilename][1] / 1e9
+               dExistingFiles[tKey] = max(fModificationTime, dExistingFiles.get(tKey, 0))
+
+   my_print("Files already downloaded in " + sDirectory + ": " + str(len(dExistingFiles)), \
+            nMessageVerbosity=VERBOSE)
+   return dExistingFiles
+
+def parse_filename(sFilename):
+   """
+   Return the tuple (language, format, climate ID, timeframe, year, month) corresponding to
+   an observation file name provided by ECCC, or None if the name is not recognized.
+   """
+
+   matchFile = FILENAME_REGEX.match(sFilename)
+   if matchFile is not None:
+      sTimeframe = dPeriodTimeframe[matchFile.group("period").upper()]
+      nYear = matchFile.group("year")
+      nMonth = matchFile.group("month")
+      if nYear is not None:
+         nYear = int(nYear)
+      if nMonth is not None:
+         nMonth = int(nMonth)
+      return (matchFile.group("lang"), matchFile.group("format").lower(), \
+              matchFile.group("climateid"), sTimeframe, nYear, nMonth)
+
+   matchFile = FORMER_FILENAME_REGEX.match(sFilename)
+   if matchFile is not None:
+      sTimeframe = matchFile.group("timeframe")
+      nYear = None
+      nMonth = None
+      if sTimeframe == "almanac":
+         sTimeframe = "climate"
+      elif sTimeframe == "daily":
+         nYear = int(matchFile.group("period")[4:8])
+      elif sTimeframe == "hourly":
+         nYear = int(matchFile.group("period")[4:8])
+         nMonth = int(matchFile.group("period")[0:2])
+      return (matchFile.group("lang"), matchFile.group("format").lower(), \
+              None, sTimeframe, nYear, nMonth)
+
+   return None
+
+def is_already_downloaded(dExistingFiles, sLang, sFormat, sClimateID, sTimeframe, \
+                          nYear=None, nMonth=None, bSync=False, bNoTree=False):
+   """
+   Check in the index built by index_existing_files if a file is already on the disk.
+   Files with the former naming do not have a climate ID: in the tree, they match the 
+   station of their directory. With --no-tree (bNoTree True), the directory is shared by 
+   all the stations, so they are ignored.
+
+   In --sync mode, a file is considered as downloaded only if it has been written after
+   the end of its period: past periods do not change anymore, while the file of the 
+   current year or month (and the monthly and almanac files) must be downloaded again.
+   """
+
+   if dExistingFiles is None:
+      return False
+
+   sFormat = sFormat.lower()
+   fModificationTime = dExistingFiles.get((sLang, sFormat, sClimateID, sTimeframe, nYear, nMonth))
+   if fModificationTime is None and not bNoTree:
+      fModificationTime = dExistingFiles.get((sLang, sFormat, None, sTimeframe, nYear, nMonth))
+   if fModificationTime is None:
+      return False
+   elif not bSync:
+      return True
+
+   # Since when the period is closed
+   timePeriodEnd = get_period_end(sTimeframe, nYear, nMonth)
+   if timePeriodEnd is None:
+      return False
+
+   return datetime.datetime.fromtimestamp(fModificationTime) >= timePeriodEnd
+
+def get_period_end(sTimeframe, nYear, nMonth=None):
+   """
+   Return the datetime at which the period of a daily (year) or hourly (month) file is 
+   over. Monthly and almanac files cover the whole period of the station: return None.
+   """
+
+   if sTimeframe == "daily":
+      return datetime.datetime(nYear + 1, 1, 1)
+   elif sTimeframe == "hourly":
+      return datetime.datetime(nYear + nMonth // 12, nMonth % 12 + 1, 1)
+   return None
+
+class DownloadTask:
+   """
+   File to download, kept as the few values from which its URL and local directory are 
+   derived. All the tasks of a run share the same language, format and output directory
+   strings, so a planned file only costs a small object instead of a long URL and path.
+
+   The task can be unpacked as [URL, localpath], and serialised with get_values.
+   """
+
+   __slots__ = ("sStation", "nTimeframe", "nYear", "nMonth", "sLang", "sFormat", \
+                "sDirectory", "bNoTree")
+
+   def __init__(self, sStation, nTimeframe, nYear, nMonth, sLang, sFormat, sDirectory, \
+                bNoTree=False):
+      """
+      INPUT
+      sStation: station ID
+      nTimeframe: code of the timeframe on the ECCC website, see TIMEFRAME_CODES
+      nYear, nMonth: period of the file. None for the files covering the whole period of
+       the station.
+      sLang: language in which to dowload the data
+      sFormat: CSV or XML
+      sDirectory: output directory of the run
+      bNoTree: if True, the file is saved directly in sDirectory
+      """
+      self.sStation = sStation
+      self.nTimeframe = nTimeframe
+      self.nYear = nYear
+      self.nMonth = nMonth
+      self.sLang = sLang
+      self.sFormat = sFormat
+      self.sDirectory = sDirectory
+      self.bNoTree = bNoTree
+
+   def get_url(self):
+      """
+      Return the URL of the file on the ECCC website.
+      """
+      if self.sLang == "fr":
+         sStartURL = ECCC_WEBSITE_URL_FR
+      else:
+         sStartURL = ECCC_WEBSITE_URL_EN
+
+      # 'year' and 'month' have to be set, but any value will do if they are not used
+      sYear = "2000" if self.nYear is None else "%04d" % (self.nYear)
+      sMonth = "01" if self.nMonth is None else "%02d" % (self.nMonth)
+      return sStartURL.format(station=self.sStation, format=self.sFormat, \
+                              timeframe=str(self.nTimeframe), year=sYear, month=sMonth)
+
+   def get_local_directory(self):
+      """
+      Return the directory where the file is saved.
+      """
+      if self.bNoTree:
+         return self.sDirectory
+      return self.sDirectory + "/" + self.sStation + "/" + \
+         TIMEFRAME_CODES[self.nTimeframe - 1]
+
+   def get_values(self):
+      """
+      Return the task as a list of JSON values. See from_values.
+      """
+      return [self.sStation, self.nTimeframe, self.nYear, self.nMonth, self.sLang, \
+              self.sFormat, self.sDirectory, self.bNoTree]
+
+   @classmethod
+   def from_values(cls, lValues):
+      """
+      Create a task from the list returned by get_values.
+      """
+      return cls(*lValues)
+
+   def __iter__(self):
+      return iter([self.get_url(), self.get_local_directory()])
+
+   def __eq__(self, other):
+      return isinstance(other, DownloadTask) and self.get_values() == other.get_values()
+
+   def __hash__(self):
+      return hash(tuple(self.get_values()))
+
+   def __repr__(self):
+      return "DownloadTask(" + ", ".join(repr(value) for value in self.get_values()) + ")"
+
+def create_url(catalog, dStationDates, sDirectory, bNoTree, sLang, sFormat, bNoClobber, bSync=False, \
+               coverage=None, dCoveredPeriods=None):
+   """
+   INPUT
+   catalog: StationCatalog containing the requested stations.
+   dStationDates: dictionnary containing the station number as the key, and a dictionnary as the value.
+     The dictionnary contains the start/end dates for monthly/daily/hourly request.
+   sDirectory: string for the local path where the files should be saved. In case it is not given, the path where the file
+     is executed is chosen. 
+   sLang: English or French
+   sFormat: CSV or XML
+   bNoClobber: if True, do not return the URL of the files already in the directories.
+   bSync: if True, do not return the URL of the files of past periods already in the
+    directories. Files of the current periods are downloaded again.
+   coverage: CoverageMap of the output directory. The periods without observation it 
+    contains are not returned.
+   dCoveredPeriods: dictionnary with the station ID as key and the periods provided by 
+    another member of a composite station as value (see CompositeStation). These periods 
+    are not returned.
+
+   OUTPUT
+   lUrlPath : an iterator of DownloadTask, which unpack as [URL, localpath], for every file 
+    to download. They are created as the iterator is consumed, so the download can start 
+    with the first file and the whole list is never kept in memory.
+   """
+
+   my_print("Creating the path for the files to download", nMessageVerbosity=VERBOSE)
+   
+   sDirectory = get_output_directory(sDirectory)
+
+   # Check if the directory can be written by the user
+   if not os.access(sDirectory, os.W_OK):
+      my_print("ERROR: you do not have permission to write on the output directory:\n\t" +sDirectory +\
+               "\nPlease change the permission or change the output directory", nMessageVerbosity=NORMAL)
+      return iter([])
+
+   return iter_url_path(catalog, dStationDates, sDirectory, bNoTree, sLang, sFormat, \
+                        bNoClobber, bSync, coverage, dCoveredPeriods)
+
+def iter_url_path(catalog, dStationDates, sDirectory, bNoTree, sLang, sFormat, bNoClobber, \
+                  bSync=False, coverage=None, dCoveredPeriods=None):
+   """
+   Generator of the DownloadTask of the files to download, station by station.
+   See create_url.
+   """
+
+   # Index of the files already downloaded, one scan per directory. The directories of a 
+   # station are not needed anymore once its files are planned.
+   dDirectoryIndex = {}
+   def get_existing_files(sDirectoryStation):
+      if not bNoClobber and not bSync:
+         return None
+      if sDirectoryStation not in dDirectoryIndex:
+         dDirectoryIndex[sDirectoryStation] = index_existing_files(sDirectoryStation)
+      return dDirectoryIndex[sDirectoryStation]
+
+   nUrlPath = 0
+   for sStation in dStationDates.keys():
+      if not bNoTree:
+         dDirectoryIndex.clear()
+      sClimateID = catalog.get_station(sStation)["Climate ID"]
+      setEmptyPeriods = None
+      if coverage is not None:
+         setEmptyPeriods = coverage.get_empty_periods(sStation)
+      dStationCoveredPeriods = None
+      if dCoveredPeriods is not None:
+         dStationCoveredPeriods = dCoveredPeriods.get(sStation)
+
+      for sTimeframe in ["monthly", "daily", "hourly", "climate"]:
+         if dStationDates[sStation][sTimeframe] == None:
+            continue
+         nTimeframe = TIMEFRAME_CODES.index(sTimeframe) + 1
+         sDirectoryStation = DownloadTask(sStation, nTimeframe, None, None, sLang, sFormat, \
+                                          sDirectory, bNoTree).get_local_directory()
+         dExistingFiles = get_existing_files(sDirectoryStation)
+
+         if sTimeframe == "daily":
+            iterTask = get_daily_tasks(sStation, sLang, sFormat, dStationDates[sStation]["daily"], \
+                                       sClimateID, dExistingFiles, bSync, sDirectory, bNoTree, \
+                                       setEmptyPeriods, dStationCoveredPeriods)
+         elif sTimeframe == "hourly":
+            iterTask = get_hourly_tasks(sStation, sLang, sFormat, \
+                                        dStationDates[sStation]["hourly"], sClimateID, \
+                                        dExistingFiles, bSync, sDirectory, bNoTree, \
+                                        setEmptyPeriods, dStationCoveredPeriods)
+         elif is_already_downloaded(dExistingFiles, sLang, sFormat, sClimateID, sTimeframe, \
+                                    bSync=bSync, bNoTree=bNoTree):
+            sName = "almanac" if sTimeframe == "climate" else sTimeframe
+            my_print("Station " + sStation + ": " + sName + " file already exists in:\n\t" + \
+                     sDirectoryStation + "\n\tSkipping", nMessageVerbosity=NORMAL)
+            continue
+         else:
+            iterTask = [DownloadTask(sStation, nTimeframe, None, None, sLang, sFormat, \
+                                     sDirectory, bNoTree)]
+
+         for task in iterTask:
+            nUrlPath = nUrlPath + 1
+            yield task
+
+   my_print("Number of files planned: " + str(nUrlPath), nMessageVerbosity=VERBOSE)
+
+def get_daily_tasks(sStation, sLang, sFormat, lStartEndTime, sClimateID=None, dExistingFiles=None, \
+                    bSync=False, sDirectory=".", bNoTree=False, setEmptyPeriods=None, \
+                    dCoveredPeriods=None):
+   """
+   INPUT
+   sStation: station ID
+   sLang: language in which to dowload the data
+   sFormat: CSV or XML:
+   lStartEndTime: list containing the month indexes of start and end for the period
+   sClimateID: climate ID of the station, used in the name of the files
+   dExistingFiles: index of the files already downloaded (see index_existing_files). 
+    None if the existing files should be overwritten.
+   bSync: if True, only skip the files downloaded after the end of their period.
+   sDirectory: output directory of the run
+   bNoTree: if True, the files are saved directly in sDirectory
+   setEmptyPeriods: periods without observation of the station, see CoverageMap. They 
+    are skipped.
+   dCoveredPeriods: periods provided by another member of a composite station, with this
+    station as value (see CompositeStation). They are skipped.
+
+   OUTPUT
+   Generator of the DownloadTask of the daily data for the period
+   """
+
+   # In --sync mode, most of the files are skipped
+   nSkipVerbosity = VERBOSE if bSync else NORMAL
+
+   [nStart, nEnd] = lStartEndTime
+   for nYear in range(nStart // 12, nEnd // 12 + 1):
+      if setEmptyPeriods and ("daily", nYear, None) in setEmptyPeriods:
+         my_print("Station " + sStation + ": no daily observation in " + str(nYear) + \
+                  "\n\tSkipping", nMessageVerbosity=VERBOSE)
+      elif dCoveredPeriods and ("daily", nYear, None) in dCoveredPeriods:
+         my_print("Station " + sStation + ": daily observations of " + str(nYear) + \
+                  " provided by station " + dCoveredPeriods[("daily", nYear, None)] + \
+                  "\n\tSkipping", nMessageVerbosity=VERBOSE)
+      elif is_already_downloaded(dExistingFiles, sLang, sFormat, sClimateID, "daily", nYear, \
+                               bSync=bSync, bNoTree=bNoTree):
+         my_print("Station " + sStation + ": daily file already exists for " + str(nYear) + \
+                  "\n\tSkipping", nMessageVerbosity=nSkipVerbosity)
+      else:
+         yield DownloadTask(sStation, 2, nYear, None, sLang, sFormat, sDirectory, bNoTree)
+
+def get_hourly_tasks(sStation, sLang, sFormat, lStartEndTime, sClimateID=None, dExistingFiles=None, \
+                     bSync=False, sDirectory=".", bNoTree=False, setEmptyPeriods=None, \
+                     dCoveredPeriods=None):
+   """
+   INPUT
+   sStation: station ID
+   sLang: language in which to dowload the data
+   sFormat: CSV or XML:
+   lStartEndTime: list containing the month indexes of start and end for the period
+   sClimateID: climate ID of the station, used in the name of the files
+   dExistingFiles: index of the files already downloaded (see index_existing_files). 
+    None if the existing files should be overwritten.
+   bSync: if True, only skip the files downloaded after the end of their period.
+   sDirectory: output directory of the run
+   bNoTree: if True, the files are saved directly in sDirectory
+   setEmptyPeriods: periods without observation of the station, see CoverageMap. They 
+    are skipped.
+   dCoveredPeriods: periods provided by another member of a composite station, with this
+    station as value (see CompositeStation). They are skipped.
+
+   OUTPUT
+   Generator of the DownloadTask of the hourly data for the period
+   """
+
+   # In --sync mode, most of the files are skipped
+   nSkipVerbosity = VERBOSE if bSync else NORMAL
+
+   [nStart, nEnd] = lStartEndTime
+   for nYear in range(nStart // 12, nEnd // 12 + 1):
+      # The 12 tasks of a year share the same year object
+      for nMonth in range(max(nStart, nYear * 12) % 12 + 1, min(nEnd, nYear * 12 + 11) % 12 + 2):
+         if setEmptyPeriods and ("hourly", nYear, nMonth) in setEmptyPeriods:
+            my_print("Station " + sStation + ": no hourly observation in " + \
+                     "%04d-%02d" % (nYear, nMonth) + "\n\tSkipping", nMessageVerbosity=VERBOSE)
+         elif dCoveredPeriods and ("hourly", nYear, nMonth) in dCoveredPeriods:
+            my_print("Station " + sStation + ": hourly observations of " + \
+                     "%04d-%02d" % (nYear, nMonth) + " provided by station " + \
+                     dCoveredPeriods[("hourly", nYear, nMonth)] + "\n\tSkipping", \
+                     nMessageVerbosity=VERBOSE)
+         elif is_already_downloaded(dExistingFiles, sLang, sFormat, sClimateID, "hourly", \
+                                  nYear, nMonth, bSync, bNoTree):
+            my_print("Station " + sStation + ": hourly file already exists for " + \
+                     "%04d-%02d" % (nYear, nMonth) + "\n\tSkipping", \
+                     nMessageVerbosity=nSkipVerbosity)
+         else:
+            yield DownloadTask(sStation, 1, nYear, nMonth, sLang, sFormat, sDirectory, bNoTree)
+
+
+
+class DownloadManifest:
+   """
+   Record of the files downloaded in an output directory, stored as JSON lines in
+   MANIFEST_FILENAME. Each line describes the last download of an URL: filename, directory,
+   size, SHA-256 checksum, ETag and Last-Modified headers and UTC timestamp.
+
+   The manifest is used to send conditional requests: a file that did not change on the
+   server since the last download costs a '304 Not Modified' instead of a full transfer.
+   Lines are only appended while downloading and the latest line for an URL wins. 
+   The file is compacted when it is loaded.
+   """
+
+   def __init__(self, sPath):
+      self.sPath = sPath
+      self.dEntries = {}
+      self.lock = threading.Lock()
+      self.fichier = None
+
+      if os.path.exists(sPath):
+         nLines = 0
+         with open(sPath, "r", encoding="utf-8") as fichier:
+            for sLine in fichier:
+               nLines = nLines + 1
+               try:
+                  dEntry = json.loads(sLine)
+                  self.dEntries[dEntry["url"]] = dEntry
+               except (ValueError, KeyError, TypeError):
+                  my_print("WARNING: invalid line in download manifest " + sPath + \
+                           ": " + sLine, nMessageVerbosity=VERBOSE)
+         if nLines > len(self.dEntries):
+            self.compact()
+
+   def compact(self):
+      """
+      Rewrite the manifest with only one line per URL.
+      """
+      with self.lock:
+         sTemporaryPath = self.sPath + ".part"
+         with open(sTemporaryPath, "w", encoding="utf-8") as fichier:
+            for dEntry in self.dEntries.values():
+               fichier.write(json.dumps(dEntry) + "\n")
+         os.replace(sTemporaryPath, self.sPath)
+
+   def get(self, sURL):
+      """
+      Return the last entry recorded for this URL, or None.
+      """
+      with self.lock:
+         return self.dEntries.get(sURL)
+
+   def get_conditional_headers(self, sURL, sDirectory, sCompression=None):
+      """
+      Return the headers for a conditional request of sURL, if the file downloaded 
+      the last time is still in sDirectory with the same size and the same compression 
+      sCompression, or if the partition of the archive it was added to still exists. 
+      Return None otherwise.
+      """
+      dEntry = self.get(sURL)
+      if dEntry is None:
+         return None
+      if dEntry.get("archive"):
+         if not os.path.isfile(sDirectory + "/" + dEntry["archive"]):
+            return None
+      else:
+         # A file saved with another compression is downloaded again to be compressed
+         sSavedSuffix = ""
+         for sSuffix in dCompressionSuffix.values():
+            if dEntry["filename"].endswith(sSuffix):
+               sSavedSuffix = sSuffix
+         if sSavedSuffix != dCompressionSuffix.get(sCompression, ""):
+            return None
+         sPath = sDirectory + "/" + dEntry["filename"]
+         if not os.path.isfile(sPath) or os.path.getsize(sPath) != dEntry["size"]:
+            return None
+
+      dHeaders = {}
+      if dEntry.get("etag"):
+         dHeaders["If-None-Match"] = dEntry["etag"]
+      if dEntry.get("last_modified"):
+         dHeaders["If-Modified-Since"] = dEntry["last_modified"]
+      if len(dHeaders) == 0:
+         return None
+      return dHeaders
+
+   def record(self, sURL, sDirectory, sFilename, nSize, sChecksum, sETag, sLastModified, \
+              sArchivePath=None):
+      """
+      Add or update the entry of sURL. Called by the download threads. sArchivePath is the
+      partition of the archive, relative to sDirectory, when the file was not saved.
+      """
+      dEntry = { "url" : sURL, \
+                 "directory" : sDirectory, \
+                 "filename" : sFilename, \
+                 "size" : nSize, \
+                 "sha256" : sChecksum, \
+                 "etag" : sETag, \
+                 "last_modified" : sLastModified, \
+                 "timestamp" : datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ") }
+      if sArchivePath is not None:
+         dEntry["archive"] = sArchivePath
+      with self.lock:
+         if self.fichier is None:
+            self.fichier = open(self.sPath, "a", encoding="utf-8")
+         self.fichier.write(json.dumps(dEntry) + "\n")
+         self.fichier.flush()
+         self.dEntries[sURL] = dEntry
+
+   def touch(self, sURL):
+      """
+      Update the timestamp of sURL when the server answered that it did not change.
+      """
+      dEntry = self.get(sURL)
+      if dEntry is not None:
+         self.record(sURL, dEntry["directory"], dEntry["filename"], dEntry["size"], \
+                     dEntry["sha256"], dEntry["etag"], dEntry["last_modified"], \
+                     dEntry.get("archive"))
+
+   def close(self):
+      with self.lock:
+         if self.fichier is not None:
+            self.fichier.close()
+            self.fichier = None
+
+
+class DownloadJournal:
+   """
+   Journal of a run, stored as JSON lines in JOURNAL_FILENAME in the output directory. 
+   Each file is written when it is planned, then when it is completed or failed. The end of
+   the planning is also written. A DownloadTask is written as its values, any other file
+   as its URL and local path. If the run is interrupted, --resume reads the journal and 
+   only downloads the files that were not completed, without planning again.
+   """
+
+   def __init__(self, sPath):
+      self.sPath = sPath
+      self.lock = threading.Lock()
+      self.fichier = None
+
+   def start(self):
+      """
+      Begin a new journal.
+      """
+      with self.lock:
+         if self.fichier is not None:
+            self.fichier.close()
+         self.fichier = open(self.sPath, "w", encoding="utf-8")
+
+   @staticmethod
+   def get_event(lUrlPath, sEvent):
+      """
+      Return the event of a DownloadTask or a [URL, localpath].
+      """
+      if isinstance(lUrlPath, DownloadTask):
+         return { "event" : sEvent, "task" : lUrlPath.get_values() }
+      [sURL, sDirectory] = lUrlPath
+      return { "event" : sEvent, "url" : sURL, "directory" : sDirectory }
+
+   def plan(self, lUrlPath):
+      """
+      Append a file to download, a DownloadTask or a [URL, localpath]. It is written on the 
+      disk with the next result.
+      """
+      with self.lock:
+         if self.fichier is None:
+            self.fichier = open(self.sPath, "a", encoding="utf-8")
+         self.fichier.write(json.dumps(self.get_event(lUrlPath, "planned")) + "\n")
+
+   def end_plan(self):
+      """
+      Write that all the files of the run have been planned.
+      """
+      with self.lock:
+         if self.fichier is None:
+            self.fichier = open(self.sPath, "a", encoding="utf-8")
+         self.fichier.write(json.dumps({ "event" : "planned_all" }) + "\n")
+         self.fichier.flush()
+
+   def load_outstanding(self):
+      """
+      Return the list of DownloadTask, or [URL, localpath], planned in the journal and not 
+      completed yet, in the order they were planned. The journal is then continued. If the last run was 
+      interrupted before the end of its planning, the files it did not plan are not known.
+      """
+      dOutstanding = {}
+      bPlannedAll = True
+      if os.path.exists(self.sPath):
+         with open(self.sPath, "r", encoding="utf-8") as fichier:
+            for sLine in fichier:
+               try:
+                  dEvent = json.loads(sLine)
+                  if dEvent["event"] == "planned_all":
+                     bPlannedAll = True
+                     continue
+                  if "task" in dEvent:
+                     lUrlPath = DownloadTask.from_values(dEvent["task"])
+                  else:
+                     lUrlPath = [dEvent["url"], dEvent["directory"]]
+                  tKey = json.dumps(self.get_event(lUrlPath, ""))
+                  if dEvent["event"] == "planned":
+                     bPlannedAll = False
+                     dOutstanding[tKey] = lUrlPath
+                  elif dEvent["event"] == "completed":
+                     dOutstanding.pop(tKey, None)
+               except (ValueError, KeyError, TypeError):
+                  # Last line may be truncated if the process was killed
+                  my_print("WARNING: invalid line in download journal " + self.sPath + \
+                           ": " + sLine, nMessageVerbosity=VERBOSE)
+      if not bPlannedAll:
+         my_print("WARNING: the last run was interrupted while planning its files. Only the " + \
+                  "files already planned are resumed: run the same request again with " + \
+                  "--no-clobber or --sync to get the others.", nMessageVerbosity=NORMAL)
+
+      with self.lock:
+         if self.fichier is None:
+            self.fichier = open(self.sPath, "a", encoding="utf-8")
+      return list(dOutstanding.values())
+
+   def record(self, lUrlPath, sEvent, sError=None):
+      """
+      Append the result of the download of a DownloadTask or a [URL, localpath]: sEvent is 
+      'completed' or 'failed'.
+      """
+      dEvent = self.get_event(lUrlPath, sEvent)
+      if sError is not None:
+         dEvent["error"] = sError
+      with self.lock:
+         if self.fichier is None:
+            self.fichier = open(self.sPath, "a", encoding="utf-8")
+         self.fichier.write(json.dumps(dEvent) + "\n")
+         self.fichier.flush()
+
+   def close(self):
+      with self.lock:
+         if self.fichier is not None:
+            self.fichier.close()
+            self.fichier = None
+
+
+class CoverageMap:
+   """
+   Periods of the stations for which ECCC sent a file without any observation, stored as
+   JSON lines in COVERAGE_FILENAME in the output directory. These periods are skipped by 
+   the planning of the following runs (see --retry-empty). Only the daily and hourly 
+   periods that were over when they were downloaded are recorded: the current period
+   may still get observations.
+
+   Lines are only appended and the latest line for a period wins: a period found empty
+   and downloaded again with observations is removed from the map.
+   """
+
+   def __init__(self, sPath):
+      self.sPath = sPath
+      self.dStations = {}
+      self.lock = threading.Lock()
+      self.fichier = None
+
+      if os.path.exists(sPath):
+         with open(sPath, "r", encoding="utf-8") as fichier:
+            for sLine in fichier:
+               try:
+                  dEntry = json.loads(sLine)
+                  tPeriod = (dEntry["timeframe"], dEntry["year"], dEntry["month"])
+                  setPeriods = self.dStations.setdefault(dEntry["station"], set())
+                  if dEntry["empty"]:
+                     setPeriods.add(tPeriod)
+                  else:
+                     setPeriods.discard(tPeriod)
+               except (ValueError, KeyError, TypeError):
+                  my_print("WARNING: invalid line in coverage map " + sPath + \
+                           ": " + sLine, nMessageVerbosity=VERBOSE)
+
+   def get_empty_periods(self, sStation):
+      """
+      Return the set of the periods (timeframe, year, month) without observation of the 
+      station. month is None for the daily files.
+      """
+      with self.lock:
+         return set(self.dStations.get(sStation, ()))
+
+   def record(self, sStation, sTimeframe, nYear, nMonth, bEmpty):
+      """
+      Record if the file of a period contains observations. Called by the download threads.
+      """
+      tPeriod = (sTimeframe, nYear, nMonth)
+      with self.lock:
+         setPeriods = self.dStations.setdefault(sStation, set())
+         if (tPeriod in setPeriods) == bEmpty:
+            return
+         if bEmpty:
+            setPeriods.add(tPeriod)
+         else:
+            setPeriods.discard(tPeriod)
+         if self.fichier is None:
+            self.fichier = open(self.sPath, "a", encoding="utf-8")
+         self.fichier.write(json.dumps({ "station" : sStation, "timeframe" : sTimeframe, \
+                                         "year" : nYear, "month" : nMonth, \
+                                         "empty" : bEmpty }) + "\n")
+         self.fichier.flush()
+
+   def close(self):
+      with self.lock:
+         if self.fichier is not None:
+            self.fichier.close()
+            self.fichier = None
+
+class EmptyFileDetector:
+   """
+   Find out, while an observation file is received, if it contains any observation. ECCC 
+   sends a file for every period requested, even when the station did not report anything:
+   its rows only contain the station and the date, with empty values or flags.
+
+   The chunks are read until the first observation, the rest of the file is not looked at.
+   """
+
+   def __init__(self):
+      self.lDataColumns = None
+      self.bEmpty = True
+      self.bRemaining = b""
+
+   def update(self, bChunk):
+      """
+      Read the next chunk of the file.
+      """
+      if not self.bEmpty:
+         return
+      lLines = (self.bRemaining + bChunk).split(b"\n")
+      self.bRemaining = lLines.pop()
+      for bLine in lLines:
+         self.read_line(bLine)
+         if not self.bEmpty:
+            break
+
+   def read_line(self, bLine):
+      lValues = next(csv.reader([bLine.decode("utf-8-sig", "replace").rstrip("\r")]), [])
+      if self.lDataColumns is None:
+         # Station, climate ID and date are the first 5 columns
+         self.lDataColumns = [nColumn for nColumn, sColumn in enumerate(lValues) \
+                              if nColumn >= 5 and sColumn not in ARCHIVE_INTEGER_COLUMNS and \
+                              not EMPTY_IGNORED_COLUMN_REGEX.search(sColumn)]
+         if len(lValues) < 5: # Not an observation file
+            self.bEmpty = False
+         return
+      for nColumn in self.lDataColumns:
+         if nColumn < len(lValues) and lValues[nColumn] not in lEmptyValues:
+            self.bEmpty = False
+            return
+
+   def is_empty(self):
+      """
+      Return True if the whole file has been read without finding any observation.
+      """
+      if self.bEmpty and len(self.bRemaining) > 0:
+         self.read_line(self.bRemaining)
+         self.bRemaining = b""
+      return self.bEmpty and self.lDataColumns is not None
+
+class ChecksumReader(io.RawIOBase):
+   """
+   Read a file object and compute the size and the sha256 of what has been read. The data
+   is also given to detector, an EmptyFileDetector, if provided.
+   """
+
+   def __init__(self, fichier, detector=None):
+      io.RawIOBase.__init__(self)
+      self.fichier = fichier
+      self.checksum = hashlib.sha256()
+      self.nSize = 0
+      self.detector = detector
+
+   def readable(self):
+      return True
+
+   def readinto(self, buffer):
+      nRead = self.fichier.readinto(buffer)
+      if nRead:
+         self.checksum.update(memoryview(buffer)[:nRead])
+         self.nSize = self.nSize + nRead
+         if self.detector is not None:
+            self.detector.update(bytes(memoryview(buffer)[:nRead]))
+      return nRead
+
+def import_zstandard():
+   """
+   Import zstandard, only needed for the files compressed with zstd. Raise CompressionError
+   if it is not installed.
+   """
+
+   try:
+      # From zstandard: https://pypi.org/project/zstandard/
+      import zstandard
+   except ImportError:
+      raise CompressionError("ERROR: zstandard is needed for the zstd compression. " + \
+                             "Install it with 'pip install zstandard'.", 20)
+   return zstandard
+
+def get_compression(sPath):
+   """
+   Return the compression of an observation file from the suffix of its name ('gzip' or
+   'zstd'), or None if it is not compressed.
+   """
+
+   for sCompression, sSuffix in dCompressionSuffix.items():
+      if sPath.endswith(sSuffix):
+         return sCompression
+   return None
+
+def open_observation_file(sPath, sMode="rb", sCompression=None):
+   """
+   Open an observation file, compressed or not. The file is compressed or decompressed 
+   while it is written or read, it is never kept in memory.
+
+   INPUT
+   sPath: path of the file
+   sMode: 'rb' or 'wb' for binary data, 'r' to read text
+   sCompression: 'gzip', 'zstd' or None. If not provided, it is given by the suffix of 
+    sPath when reading (see get_compression).
+
+   OUTPUT
+   File object
+   """
+
+   if sCompression is None and "r" in sMode:
+      sCompression = get_compression(sPath)
+   sBinaryMode = sMode.replace("t", "").rstrip("b") + "b"
+
+   if sCompression == "gzip":
+      fichier = gzip.open(sPath, sBinaryMode, compresslevel=dCompressionLevel["gzip"])
+   elif sCompression == "zstd":
+      zstandard = import_zstandard()
+      fichier = open(sPath, sBinaryMode)
+      if "r" in sMode:
+         fichier = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(fichier))
+      else:
+         fichier = zstandard.ZstdCompressor(level=dCompressionLevel["zstd"]).\
+                   stream_writer(fichier)
+   else:
+      fichier = open(sPath, sBinaryMode)
+
+   if "b" not in sMode:
+      # ECCC files start with a byte order mark
+      return io.TextIOWrapper(fichier, encoding="utf-8-sig")
+   return fichier
+
+def download_file(sURL, sDirectory, httpPool=None, nChunkSize=DEFAULT_CHUNK_SIZE, \
+                  manifest=None, bStreamArchive=False, sCompression=None, coverage=None, \
+                  bDiscardEmpty=False):
+   """
+   Download the file at sURL and save it in sDirectory, using the filename provided by the
+   ECCC web site. This function is called concurrently by the worker threads of download_files.
+
+   The file is streamed by chunks of nChunkSize bytes in a temporary file in sDirectory, 
+   which is renamed to its final name only once the whole file has been received. 
+   An interrupted transfer never leaves a truncated file with a valid name.
+
+   INPUT:
+   sURL: URL of the file to download
+   sDirectory: local directory where the file should be saved
+   httpPool: HTTPConnectionPool used to download the file
+   nChunkSize: size in bytes of the chunks read from the network
+   manifest: DownloadManifest of the output directory. If provided, a conditional request
+    is sent for a file already downloaded and the download is recorded.
+   bStreamArchive: if True, a CSV observation file is not saved: it is parsed while it is 
+    received and appended to the columnar archive of sDirectory.
+   sCompression: 'gzip' or 'zstd' to compress the file while it is written. Its name gets
+    the suffix of the compression (see dCompressionSuffix). The size in the manifest is the 
+    size of the compressed file, the checksum is the one of the data received.
+   coverage: CoverageMap in which the daily and hourly files without observation are 
+    recorded.
+   bDiscardEmpty: if True, a daily or hourly file without observation is not saved.
+
+   OUTPUT:
+   sPath: local path of the downloaded file, or of the partition of the archive. None if
+    the file was discarded.
+   """
+
+   dHeaders = None
+   if manifest is not None:
+      dHeaders = manifest.get_conditional_headers(sURL, sDirectory, sCompression)
+
+   try:
+      httpResponse = open_url(sURL, httpPool, dHeaders)
+   except urllib.error.HTTPError as e:
+      if e.code != 304:
+         raise
+      httpResponse = e
+   if httpResponse.status == 304: # File did not change since the last download
+      httpResponse.close()
+      dEntry = manifest.get(sURL)
+      sPath = sDirectory + "/" + dEntry.get("archive", dEntry["filename"])
+      my_print("File not modified since last download:\n\t" + sPath, \
+               nMessageVerbosity=VERBOSE)
+      manifest.touch(sURL)
+      if not dEntry.get("archive"):
+         # --sync compares the modification time with the end of the period of the file
+         os.utime(sPath)
+      return sPath
+
+   try:
+      # Extract the provided filename
+      _,params = cgi.parse_header(httpResponse.headers.get('Content-Disposition', ''))
+      sFilename = params['filename']
+      my_print("Downloading file:\n\t" + sFilename, nMessageVerbosity=VERBOSE)
+      my_print("and saving on local directory:\n\t" + sDirectory, \
+               nMessageVerbosity=VERBOSE)
+      sSavedFilename = sFilename + dCompressionSuffix.get(sCompression, "")
+      sPath = sDirectory + "/" + sSavedFilename
+
+      tKey = parse_filename(sFilename)
+      # Only the periods of the daily and hourly CSV files can be empty
+      detector = None
+      if (coverage is not None or bDiscardEmpty) and tKey is not None and \
+         tKey[1] == "csv" and tKey[3] in ["daily", "hourly"]:
+         detector = EmptyFileDetector()
+
+      if bStreamArchive and tKey is not None and tKey[1] == "csv" and \
+         tKey[2] is not None and tKey[3] in ARCHIVE_TIMEFRAMES:
+         (sLang, sFormat, sClimateID, sTimeframe, nYear, nMonth) = tKey
+         reader = ChecksumReader(httpResponse, detector)
+         table = parse_observation_csv(io.BufferedReader(reader, nChunkSize))
+         nSize = reader.nSize
+         checksum = reader.checksum
+         check_content_length(httpResponse, nSize)
+         if record_coverage(coverage, sURL, tKey, detector) and bDiscardEmpty:
+            my_print("No observation in file, not archived:\n\t" + sFilename, \
+                     nMessageVerbosity=VERBOSE)
+            return None
+         sArchivePath = get_archive_path(sDirectory, sLang, sTimeframe, sClimateID, nYear)
+         append_archive_partition(sArchivePath, sTimeframe, [table], \
+                                  { sFilename : [nSize, time.time_ns()] })
+         if manifest is not None:
+            manifest.record(sURL, sDirectory, sFilename, nSize, checksum.hexdigest(), \
+                            httpResponse.headers.get('ETag'), \
+                            httpResponse.headers.get('Last-Modified'), \
+                            os.path.relpath(sArchivePath, sDirectory))
+         return sArchivePath
+
+      # Temporary file name is unique for each process and thread
+      sTemporaryPath = sDirectory + "/." + sSavedFilename + "." + str(os.getpid()) + "-" + \
+                       str(threading.get_ident()) + ".part"
+      try:
+         nSize = 0
+         checksum = hashlib.sha256()
+         with open_observation_file(sTemporaryPath, "wb", sCompression) as fichier:
+            while True:
+               sChunk = httpResponse.read(nChunkSize)
+               if not sChunk:
+                  break
+               fichier.write(sChunk)
+               checksum.update(sChunk)
+               nSize = nSize + len(sChunk)
+               if detector is not None:
+                  detector.update(sChunk)
+
+         check_content_length(httpResponse, nSize)
+         if record_coverage(coverage, sURL, tKey, detector) and bDiscardEmpty:
+            my_print("No observation in file, not saved:\n\t" + sFilename, \
+                     nMessageVerbosity=VERBOSE)
+            os.remove(sTemporaryPath)
+            return None
+         os.replace(sTemporaryPath, sPath)
+      except BaseException:
+         if os.path.exists(sTemporaryPath):
+            os.remove(sTemporaryPath)
+         raise
+   finally:
+      httpResponse.close()
+
+   # The same file saved before with another compression would be read twice
+   for sSuffix in [""] + list(dCompressionSuffix.values()):
+      if sFilename + sSuffix != sSavedFilename and \
+         os.path.exists(sDirectory + "/" + sFilename + sSuffix):
+         os.remove(sDirectory + "/" + sFilename + sSuffix)
+
+   if manifest is not None:
+      manifest.record(sURL, sDirectory, sSavedFilename, os.path.getsize(sPath), \
+                      checksum.hexdigest(), httpResponse.headers.get('ETag'), \
+                      httpResponse.headers.get('Last-Modified'))
+
+   return sPath
+
+def record_coverage(coverage, sURL, tKey, detector):
+   """
+   Record in coverage if the file of sURL, with the key tKey (see parse_filename), contains
+   observations according to detector. The periods that are not over are not recorded.
+   Return True if the file has no observation.
+   """
+
+   if detector is None:
+      return False
+   bEmpty = detector.is_empty()
+
+   (sLang, sFormat, sClimateID, sTimeframe, nYear, nMonth) = tKey
+   sStation = urllib.parse.parse_qs(urllib.parse.urlparse(sURL).query).get("stationID", [None])[0]
+   if coverage is not None and sStation is not None and \
+      (not bEmpty or datetime.datetime.now() >= get_period_end(sTimeframe, nYear, nMonth)):
+      coverage.record(sStation, sTimeframe, nYear, nMonth, bEmpty)
+   return bEmpty
+
+def check_content_length(httpResponse, nSize):
+   """
+   Raise IncompleteRead if nSize bytes have been received while the server announced 
+   another size.
+   """
+
+   sContentLength = httpResponse.headers.get('Content-Length')
+   if sContentLength is not None and sContentLength.isdigit() and \
+      int(sContentLength) != nSize:
+      raise http.client.IncompleteRead(b"", int(sContentLength) - nSize)
+
+class RateLimiter:
+   """
+   Token bucket shared by the download threads to limit the number of requests per second
+   sent to the ECCC web site. When the server asks to slow down (Retry-After header), all the
+   threads are paused. If fRate is None, only the pauses asked by the server are applied.
+   """
+
+   def __init__(self, fRate=None, nBurst=1):
+      self.fRate = fRate
+      self.fCapacity = float(max(1, nBurst))
+      self.fTokens = self.fCapacity
+      self.fLastTime = time.monotonic()
+      self.fPausedUntil = 0.0
+      self.lock = threading.Lock()
+
+   def acquire(self):
+      """
+      Wait until a request can be sent.
+      """
+      while True:
+         with self.lock:
+            fNow = time.monotonic()
+            if fNow < self.fPausedUntil:
+               fWait = self.fPausedUntil - fNow
+            elif self.fRate is None:
+               return
+            else:
+               self.fTokens = min(self.fCapacity, \
+                                  self.fTokens + (fNow - self.fLastTime) * self.fRate)
+               self.fLastTime = fNow
+               if self.fTokens >= 1:
+                  self.fTokens = self.fTokens - 1
+                  return
+               fWait = (1 - self.fTokens) / self.fRate
+         time.sleep(fWait)
+
+   def pause(self, fSeconds):
+      """
+      Do not send any request for the next fSeconds.
+      """
+      with self.lock:
+         self.fPausedUntil = max(self.fPausedUntil, time.monotonic() + fSeconds)
+
+def get_retry_after(error):
+   """
+   Return the delay in seconds asked by the server in the Retry-After header of an HTTP error,
+   or None if not provided.
+   """
+
+   if not isinstance(error, urllib.error.HTTPError) or error.headers is None:
+      return None
+   sRetryAfter = error.headers.get("Retry-After")
+   if sRetryAfter is None:
+      return None
+   sRetryAfter = sRetryAfter.strip()
+   if sRetryAfter.isdigit():
+      fDelay = float(sRetryAfter)
+   else:
+      try:
+         timeRetry = email.utils.parsedate_to_datetime(sRetryAfter)
+      except (TypeError, ValueError):
+         return None
+      if timeRetry.tzinfo is None:
+         timeRetry = timeRetry.replace(tzinfo=datetime.timezone.utc)
+      fDelay = (timeRetry - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+   return min(max(fDelay, 0.0), MAX_RETRY_AFTER)
+
+def is_retryable(error):
+   """
+   Return True if the download can be tried again after this error: network errors, 
+   timeouts, truncated transfers and HTTP errors 408, 429, 500, 502, 503 and 504. 
+   The other errors, such as a full disk or a file that cannot be written, are not 
+   retried.
+   """
+
+   if isinstance(error, urllib.error.HTTPError):
+      return error.code in [408, 429, 500, 502, 503, 504]
+   return isinstance(error, (urllib.error.URLError, ConnectionError, TimeoutError, \
+                             socket.timeout, http.client.HTTPException))
+
+def download_file_with_retry(sURL, sDirectory, httpPool=None, nChunkSize=DEFAULT_CHUNK_SIZE, \
+                             manifest=None, nRetries=0, fRetryDelay=DEFAULT_RETRY_DELAY, \
+                             rateLimiter=None, bStreamArchive=False, sCompression=None, \
+                             coverage=None, bDiscardEmpty=False):
+   """
+   Call download_file, waiting for rateLimiter before each request. If the download fails
+   with a transient error, try again up to nRetries times. The delay between the attempts
+   grows exponentially from fRetryDelay seconds, with random jitter so the threads do not 
+   retry all at the same time. A Retry-After header sent by the server is honored and 
+   pauses all the threads sharing rateLimiter.
+   """
+
+   nAttempt = 0
+   while True:
+      if rateLimiter is not None:
+         rateLimiter.acquire()
+      try:
+         return download_file(sURL, sDirectory, httpPool, nChunkSize, manifest, \
+                              bStreamArchive, sCompression, coverage, bDiscardEmpty)
+      except (OSError, http.client.HTTPException) as e:
+         if nAttempt >= nRetries or not is_retryable(e):
+            raise
+         # Exponential backoff with full jitter
+         fDelay = random.uniform(0, min(MAX_RETRY_DELAY, fRetryDelay * 2 ** nAttempt))
+         fRetryAfter = get_retry_after(e)
+         if fRetryAfter is not None:
+            fDelay = max(fDelay, fRetryAfter)
+            if rateLimiter is not None:
+               rateLimiter.pause(fRetryAfter)
+         nAttempt = nAttempt + 1
+         my_print("\nWARNING: cannot download file, attempt " + str(nAttempt) + " of " + \
+                  str(nRetries + 1) + ":\n\t" + sURL + "\n\t" + repr(e) + \
+                  "\n\tTrying again in %.1f s" % (fDelay), nMessageVerbosity=VERBOSE)
+         time.sleep(fDelay)
+
+def download_files(lUrlAndPath, bDryRun, nJobs=1, httpPool=None, \
+                   nChunkSize=DEFAULT_CHUNK_SIZE, manifest=None, nRetries=0, \
+                   fRetryDelay=DEFAULT_RETRY_DELAY, rateLimiter=None, journal=None, \
+                   bStreamArchive=False, sCompression=None, coverage=None, bDiscardEmpty=False):
+   """
+   INPUT:
+   lUrlAndPath: a list, or an iterator, of DownloadTask or of lists containing two values: 
+    the URL to download and the path where the file should be copied on the local computer. An iterator is 
+    consumed as the downloads progress: only a few files per job are planned in advance.
+   bDryRun: if set to True, do not download or create directory.
+   nJobs: number of files downloaded concurrently.
+   httpPool: HTTPConnectionPool used for the downloads. If not provided, a pool of nJobs 
+    connections is created for this call.
+   nChunkSize: size in bytes of the chunks written on disk.
+   manifest: DownloadManifest recording the downloads and used for conditional requests.
+   nRetries: number of times a download is tried again after a transient error.
+   fRetryDelay: delay in seconds before the first retry, doubled at each attempt.
+   rateLimiter: RateLimiter shared by the threads. If not provided, only the delays asked
+    by the server are honored.
+   journal: DownloadJournal in which the planned, completed and failed files are recorded.
+   bStreamArchive: if True, the CSV observation files are appended to the columnar archive
+    while they are received instead of being saved.
+   sCompression: 'gzip' or 'zstd' to save the files compressed, None otherwise.
+   coverage: CoverageMap in which the periods without observation are recorded.
+   bDiscardEmpty: if True, the daily and hourly files without observation are not saved.
+
+   OUTPUT:
+   lFailed: a list of list containing two values: the URL that could not be downloaded
+    and the error message.
+   """
+
+   # Directories are created when their first file is planned
+   setDirectories = set()
+   def check_directory(sDirectory):
+      if sDirectory not in setDirectories:
+         create_directories([sDirectory], bDryRun)
+         setDirectories.add(sDirectory)
+
+   if bDryRun:
+      for [sURL, sDirectory] in lUrlAndPath:
+         check_directory(sDirectory)
+         my_print("--dry-run mode: file not downloaded:\n\t" + sURL, \
+                  nMessageVerbosity=NORMAL)
+      return []
+   
+   # Set the progress bar when the first file is planned. Its maximum grows with the planning.
+   columns = shutil.get_terminal_size()[0]
+   nWidth = int(columns) - 32
+   bar = None
+
+   bClosePool = httpPool is None
+   if bClosePool:
+      httpPool = HTTPConnectionPool(nJobs)
+   if rateLimiter is None:
+      rateLimiter = RateLimiter()
+
+   # Keep nJobs requests in flight, and a few more files planned so the jobs never wait for 
+   # the planning. The progress bar is only updated by this thread.
+   lFailed = []
+   nPlanned = 0
+   nMaxPending = nJobs * PENDING_DOWNLOADS_PER_JOB
+   iterUrlAndPath = iter(lUrlAndPath)
+   bPlannedAll = False
+   with ThreadPoolExecutor(max_workers=nJobs) as executor:
+      dFutureUrl = {}
+      while True:
+         while not bPlannedAll and len(dFutureUrl) < nMaxPending:
+            lItem = next(iterUrlAndPath, None)
+            if lItem is None:
+               bPlannedAll = True
+               if journal is not None:
+                  journal.end_plan()
+               break
+            [sURL, sDirectory] = lItem
+            check_directory(sDirectory)
+            if journal is not None:
+               journal.plan(lItem)
+            dFutureUrl[executor.submit(download_file_with_retry, sURL, sDirectory, \
+                                       httpPool, nChunkSize, manifest, nRetries, \
+                                       fRetryDelay, rateLimiter, bStreamArchive, \
+                                       sCompression, coverage, bDiscardEmpty)] = \
+                                       [sURL, lItem]
+            nPlanned = nPlanned + 1
+            if bar is None:
+               bar = Bar('Downloading', max=nPlanned, width=int(nWidth))
+            bar.max = nPlanned
+         if len(dFutureUrl) == 0:
+            break
+
+         setDone, _ = wait(dFutureUrl, return_when=FIRST_COMPLETED)
+         for future in setDone:
+            [sURL, lItem] = dFutureUrl.pop(future)
+            try:
+               future.result()
+               if journal is not None:
+                  journal.record(lItem, "completed")
+            except Exception as e: # Report the error without stopping the other downloads
+               my_print("\nERROR: cannot download file:\n\t" + sURL + "\n\t" + repr(e), \
+                        nMessageVerbosity=VERBOSE)
+               lFailed.append([sURL, repr(e)])
+               if journal is not None:
+                  journal.record(lItem, "failed", repr(e))
+            bar.next()
+            
+   if bar is not None:
+      bar.finish()
+   if bClosePool:
+      httpPool.close()
+
+   if len(lFailed) > 0:
+      my_print("WARNING: " + str(len(lFailed)) + " file(s) out of " + str(nPlanned) + \
+               " could not be downloaded:", nMessageVerbosity=NORMAL)
+      for [sURL, sError] in lFailed:
+         my_print("\t" + sURL + "\n\t\t" + sError, nMessageVerbosity=NORMAL)
+
+   return lFailed
+
+      
+def create_directories(lDirectories, bDryRun):
+      """
+      Check if directories exists in the list lDirectories. If not, create it, unless we are in 
+      --dry-run mode.
+      """
+
+      lDirectoryCreated =[]
+      
+      for sDirectory in lDirectories:
+         # Check if the directory has not been created and does not exists
+         if sDirectory not in lDirectoryCreated and \
+            not os.path.isdir(sDirectory):
+            my_print("Directory does not exists \n\t" + sDirectory, nMessageVerbosity=NORMAL)
+            if bDryRun:
+               my_print("\t--dry-run mode: directory is not created", nMessageVerbosity=NORMAL)
+            else:
+               my_print("\tCreating directory", nMessageVerbosity=NORMAL)
+               os.makedirs(sDirectory)
+            lDirectoryCreated.append(sDirectory)
+      
+############################################################
+# Columnar archive of the observation files
+#
+
+def import_pyarrow():
+   """
+   Import pyarrow, only needed for the columnar archive. Raise ArchiveError if it is not 
+   installed.
+   """
+
+   try:
+      # From pyarrow: https://pypi.org/project/pyarrow/
+      import pyarrow
+      import pyarrow.compute
+      import pyarrow.parquet
+   except ImportError:
+      raise ArchiveError("ERROR: pyarrow is needed for the columnar archive. " + \
+                         "Install it with 'pip install pyarrow'.", 16)
+   return pyarrow
+
+def get_archive_path(sDirectory, sLang, sTimeframe, sClimateID, nYear=None):
+   """
+   Return the path of the partition of the columnar archive for the observation files of 
+   sDirectory with this language, timeframe, climate ID and year, 
+   i.e. sDirectory/archive/en_hourly_2203095_1990.parquet. Monthly files have no year.
+   """
+
+   sName = sLang + "_" + sTimeframe + "_" + sClimateID
+   if nYear is not None:
+      sName = sName + "_" + str(nYear)
+   return os.path.join(sDirectory, ARCHIVE_DIRECTORY, sName + ".parquet")
+
+def parse_observation_csv(fichier, lColumns=None):
+   """
+   Parse the content of an observation file provided by ECCC in a typed pyarrow Table:
+   the date is a timestamp, year, month and day are integers, the flags and the texts 
+   are strings and the values are floats. A column with values that are not numbers
+   (i.e. '<31' for the gusts) is kept as strings. The rows of the periods without 
+   observation, where ECCC only writes the station and the date, are skipped.
+
+   INPUT
+   fichier: binary file object of the CSV file, read sequentially: a local file or
+    the response of the ECCC web site
+   lColumns: names of the columns to convert, the others are skipped. The date is always
+    kept. All the columns if None.
+
+   OUTPUT
+   Typed pyarrow Table with the columns of the file
+   """
+
+   pyarrow = import_pyarrow()
+   import pyarrow.csv
+
+   # All the columns are read as text, then converted according to their name
+   sHeader = fichier.readline().decode("utf-8-sig")
+   lHeader = next(csv.reader([sHeader]), [])
+   if len(lHeader) < 5:
+      raise ValueError("Not an observation file, header is: " + sHeader[:100])
+   lIncludedColumns = lHeader
+   if lColumns is not None:
+      lIncludedColumns = [sColumn for sColumn in lHeader \
+                          if sColumn in lColumns or sColumn == lHeader[4]]
+   readOptions = pyarrow.csv.ReadOptions(column_names=lHeader, use_threads=False)
+   parseOptions = pyarrow.csv.ParseOptions(invalid_row_handler=lambda row: "skip")
+   convertOptions = pyarrow.csv.ConvertOptions(\
+      column_types=dict((sColumn, pyarrow.string()) for sColumn in lHeader), \
+      include_columns=lIncludedColumns, \
+      null_values=[""], strings_can_be_null=True, quoted_strings_can_be_null=True)
+   table = pyarrow.csv.read_csv(fichier, read_options=readOptions, \
+                                parse_options=parseOptions, convert_options=convertOptions)
+
+   # Station name and climate ID are the 3rd and 4th columns, the date the 5th
+   lArrays = []
+   for nColumn, sColumn in enumerate(table.column_names):
+      array = table.column(nColumn)
+      if sColumn in lHeader[2:4] or ARCHIVE_TEXT_COLUMN_REGEX.search(sColumn):
+         pass
+      elif sColumn == lHeader[4]:
+         array = parse_observation_date(array)
+      elif sColumn in ARCHIVE_INTEGER_COLUMNS:
+         array = pyarrow.compute.cast(array, pyarrow.int16())
+      else:
+         # French files use a decimal comma
+         arrayNumber = pyarrow.compute.replace_substring(array, ",", ".")
+         try:
+            array = pyarrow.compute.cast(arrayNumber, pyarrow.float64())
+         except pyarrow.ArrowInvalid:
+            pass
+      lArrays.append(array)
+
+   return pyarrow.table(lArrays, names=table.column_names)
+
+def parse_observation_date(array):
+   """
+   Convert the column Date/Time of an observation file to timestamps. The format
+   depends on the timeframe: '2014-08-01 00:00', '2014-08-01' or '2014-08'.
+   """
+
+   pyarrow = import_pyarrow()
+
+   arrayValid = array.drop_null()
+   if len(arrayValid) == 0:
+      return pyarrow.compute.cast(array, pyarrow.timestamp("ms"))
+   nLength = len(arrayValid[0].as_py())
+   if nLength > 10:
+      sFormat = "%Y-%m-%d %H:%M"
+   elif nLength > 7:
+      sFormat = "%Y-%m-%d"
+   else:
+      sFormat = "%Y-%m"
+   return pyarrow.compute.strptime(array, format=sFormat, unit="ms", error_is_null=True)
+
+def concat_observation_tables(lTables):
+   """
+   Concatenate the tables of several observation files. A column that is a number in a 
+   table and a string in another one is converted to string. Timestamps keep the unit of 
+   the first table.
+   """
+
+   pyarrow = import_pyarrow()
+
+   lColumns = []
+   dTypes = {}
+   for table in lTables:
+      for field in table.schema:
+         if field.name not in dTypes:
+            lColumns.append(field.name)
+            dTypes[field.name] = field.type
+         elif dTypes[field.name] != field.type and \
+              not (pyarrow.types.is_timestamp(dTypes[field.name]) and \
+                   pyarrow.types.is_timestamp(field.type)):
+            dTypes[field.name] = pyarrow.string()
+   schema = pyarrow.schema([(sColumn, dTypes[sColumn]) for sColumn in lColumns])
+
+   lCastTables = []
+   for table in lTables:
+      lArrays = []
+      for field in schema:
+         if field.name in table.column_names:
+            lArrays.append(pyarrow.compute.cast(table.column(field.name), field.type))
+         else:
+            lArrays.append(pyarrow.nulls(table.num_rows, field.type))
+      lCastTables.append(pyarrow.table(lArrays, schema=schema))
+   return pyarrow.concat_tables(lCastTables)
+
+def read_archive_sources(sPath):
+   """
+   Return the dictionary of the observation files stored in a partition of the archive,
+   with their name as key and [size, modification time] as value.
+   """
+
+   pyarrow = import_pyarrow()
+
+   if not os.path.exists(sPath):
+      return {}
+   try:
+      dMetadata = pyarrow.parquet.read_schema(sPath).metadata or {}
+      return json.loads(dMetadata.get(ARCHIVE_SOURCES_KEY, b"{}"))
+   except (pyarrow.ArrowException, OSError, ValueError):
+      my_print("WARNING: invalid partition of the archive, it will be created again: " + \
+               sPath, nMessageVerbosity=NORMAL)
+      return {}
+
+def write_archive_partition(sPath, table, dSources, sCompression=ARCHIVE_COMPRESSION):
+   """
+   Write a partition of the archive, sorted by date, with the list of the observation files
+   it contains in its metadata. The file is replaced in one step, so a reader never sees a 
+   partial partition.
+   """
+
+   pyarrow = import_pyarrow()
+
+   if table.num_columns > 4:
+      table = table.sort_by(table.column_names[4])
+   dMetadata = dict(table.schema.metadata or {})
+   dMetadata[ARCHIVE_SOURCES_KEY] = json.dumps(dSources, sort_keys=True).encode("utf-8")
+   table = table.replace_schema_metadata(dMetadata)
+
+   os.makedirs(os.path.dirname(sPath), exist_ok=True)
+   sTemporaryPath = sPath + "." + str(os.getpid()) + "-" + str(threading.get_ident()) + ".part"
+   try:
+      pyarrow.parquet.write_table(table, sTemporaryPath, compression=sCompression)
+      os.replace(sTemporaryPath, sPath)
+   except BaseException:
+      if os.path.exists(sTemporaryPath):
+         os.remove(sTemporaryPath)
+      raise
+
+def get_archive_lock(sPath):
+   """
+   Return the lock of a partition of the archive, so the threads do not update it at the 
+   same time.
+   """
+
+   with lockArchiveLocks:
+      return dArchiveLocks.setdefault(sPath, threading.Lock())
+
+def append_archive_partition(sPath, sTimeframe, lTables, dNewSources, \
+                             sCompression=ARCHIVE_COMPRESSION):
+   """
+   Add the tables of new observation files to a partition of the archive. For an hourly 
+   partition, the months already archived are kept, unless they are in the new files. 
+   The other partitions only hold one file, which is replaced.
+
+   INPUT
+   sPath: path of the partition
+   sTimeframe: 'hourly', 'daily' or 'monthly'
+   lTables: pyarrow Tables of the new observation files (see parse_observation_csv)
+   dNewSources: dictionary with the name of the new observation files as key and 
+    [size, modification time in ns] as value
+   """
+
+   pyarrow = import_pyarrow()
+
+   with get_archive_lock(sPath):
+      dSources = read_archive_sources(sPath)
+      lPartitionTables = []
+      if sTimeframe == "hourly" and len(dSources) > 0:
+         table = pyarrow.parquet.read_table(sPath)
+         lNewMonths = [parse_filename(sFilename)[5] for sFilename in dNewSources]
+         maskKept = pyarrow.compute.invert(pyarrow.compute.is_in(\
+            table.column(ARCHIVE_MONTH_COLUMN), \
+            value_set=pyarrow.array(lNewMonths, pyarrow.int16())))
+         lPartitionTables.append(table.filter(maskKept).replace_schema_metadata(None))
+      else:
+         dSources = {}
+      dSources.update(dNewSources)
+
+      write_archive_partition(sPath, concat_observation_tables(lPartitionTables + lTables), \
+                              dSources, sCompression)
+   my_print("Archive " + sPath + ": " + str(len(dNewSources)) + " file(s) added", \
+            nMessageVerbosity=VERBOSE)
+
+def update_archive_partition(sPath, sTimeframe, dFiles, sCompression=ARCHIVE_COMPRESSION):
+   """
+   Bring a partition of the archive up to date with its observation files. Only the files 
+   added or modified since the last update are parsed and appended. The observations of 
+   a file removed from the disk are kept in the archive.
+
+   INPUT
+   sPath: path of the partition
+   sTimeframe: 'hourly', 'daily' or 'monthly'
+   dFiles: dictionary with the name of the observation files as key and their path as value
+
+   OUTPUT
+   True if the partition has been written, False if it was already up to date.
+   """
+
+   dSources = {}
+   for sFilename in dFiles:
+      stat = os.stat(dFiles[sFilename])
+      dSources[sFilename] = [stat.st_size, stat.st_mtime_ns]
+
+   dArchivedSources = read_archive_sources(sPath)
+   dNewSources = dict((sFilename, dSources[sFilename]) for sFilename in sorted(dSources) \
+                      if dArchivedSources.get(sFilename) != dSources[sFilename])
+   if len(dNewSources) == 0:
+      return False
+
+   lTables = []
+   for sFilename in dNewSources:
+      with open_observation_file(dFiles[sFilename]) as fichier:
+         lTables.append(parse_observation_csv(fichier))
+   append_archive_partition(sPath, sTimeframe, lTables, dNewSources, sCompression)
+   return True
+
+def consolidate_directory(sDirectory, sCompression=ARCHIVE_COMPRESSION):
+   """
+   Update the columnar archive of the CSV observation files of sDirectory, with one 
+   partition per language, timeframe, climate ID and year (see get_archive_path).
+   Files with the former naming, without climate ID, are not archived.
+
+   OUTPUT
+   Number of partitions written
+   """
+
+   dPartitions = {}
+   for entry in os.scandir(sDirectory):
+      tKey = parse_filename(entry.name)
+      if tKey is None:
+         continue
+      (sLang, sFormat, sClimateID, sTimeframe, nYear, nMonth) = tKey
+      if sFormat != "csv" or sClimateID is None or sTimeframe not in ARCHIVE_TIMEFRAMES:
+         continue
+      sPath = get_archive_path(sDirectory, sLang, sTimeframe, sClimateID, nYear)
+      dPartitions.setdefault((sPath, sTimeframe), {})[entry.name] = entry.path
+
+   nWritten = 0
+   for (sPath, sTimeframe) in sorted(dPartitions):
+      if update_archive_partition(sPath, sTimeframe, dPartitions[(sPath, sTimeframe)], \
+                                  sCompression):
+         nWritten = nWritten + 1
+   return nWritten
+
+def consolidate_archive(sDirectory, nJobs=1, sCompression=ARCHIVE_COMPRESSION):
+   """
+   Update the columnar archive of all the directories of observation files under sDirectory
+   (i.e. <station>/daily, <station>/hourly, or sDirectory itself with --no-tree).
+   Directories are processed concurrently with nJobs threads.
+
+   OUTPUT
+   Number of partitions written
+   """
+
+   import_pyarrow()
+
+   lDirectories = []
+   for (sRoot, lSubDirectories, lFiles) in os.walk(sDirectory):
+      lSubDirectories[:] = [sName for sName in lSubDirectories if sName != ARCHIVE_DIRECTORY]
+      if any(FILENAME_REGEX.match(sFilename) for sFilename in lFiles):
+         lDirectories.append(sRoot)
+   my_print("Directories to archive: " + str(len(lDirectories)), nMessageVerbosity=VERBOSE)
+
+   nWritten = 0
+   with ThreadPoolExecutor(max_workers=nJobs) as executor:
+      for nDirectoryWritten in executor.map(lambda sRoot: \
+                                            consolidate_directory(sRoot, sCompression), \
+                                            lDirectories):
+         nWritten = nWritten + nDirectoryWritten
+   my_print("Partitions of the archive updated: " + str(nWritten), nMessageVerbosity=NORMAL)
+   return nWritten
+
+def get_expected_rows(sTimeframe, nYear, nMonth=None):
+   """
+   Return the number of rows of the observation file of a period: one per hour of the 
+   month for the hourly files, one per day of the year for the daily files. None for the 
+   monthly and almanac files, whose length depends on the station.
+   """
+
+   if sTimeframe == "hourly":
+      return calendar.monthrange(nYear, nMonth)[1] * 24
+   elif sTimeframe == "daily":
+      return 366 if calendar.isleap(nYear) else 365
+   return None
+
+def check_observation_file(sPath):
+   """
+   Check the integrity of an observation file downloaded from ECCC, compressed or not:
+   UTF-8 encoding with a byte order mark, header of the observations and one row per hour 
+   or day of the period given by the filename. XML files are only checked to be well formed.
+   This function is called concurrently by the processes of scan_observation_files.
+
+   OUTPUT
+   Description of the problem found, or None if the file is valid
+   """
+
+   (sLang, sFormat, sClimateID, sTimeframe, nYear, nMonth) = \
+      parse_filename(os.path.basename(sPath))
+   try:
+      with open_observation_file(sPath) as fichier:
+         bContent = fichier.read()
+   except Exception as e: # Invalid compressed data raises errors specific to each library
+      return "cannot be read: " + repr(e)
+   if len(bContent) == 0:
+      return "empty file"
+
+   if sFormat == "xml":
+      try:
+         xml.etree.ElementTree.fromstring(bContent)
+      except xml.etree.ElementTree.ParseError as e:
+         return "invalid XML: " + str(e)
+      return None
+
+   try:
+      sContent = bContent.decode("utf-8-sig")
+   except UnicodeDecodeError as e:
+      return "invalid UTF-8 encoding: " + str(e)
+   sHeader = sContent.split("\n", 1)[0]
+   lHeader = next(csv.reader([sHeader]), [])
+   # The 5th column is 'Date/Time', 'Date/Time (LST)', 'Date/Heure', ...
+   if len(lHeader) < 5 or not lHeader[4].startswith("Date"):
+      return "invalid header: " + sHeader[:80]
+   if not bContent.startswith(codecs.BOM_UTF8):
+      return "no byte order mark"
+
+   nRows = sContent.count("\n") - 1
+   if not sContent.endswith("\n"):
+      nRows = nRows + 1
+   nExpectedRows = get_expected_rows(sTimeframe, nYear, nMonth)
+   if nExpectedRows is not None and nRows != nExpectedRows:
+      return str(nRows) + " rows instead of " + str(nExpectedRows)
+   return None
+
+def scan_observation_files(sDirectory, nJobs=None):
+   """
+   Check all the observation files under sDirectory (see check_observation_file), with
+   nJobs processes. All the processors are used if nJobs is None.
+
+   OUTPUT
+   lBadFiles: list of [path, problem] of the invalid files
+   nFiles: number of files checked
+   """
+
+   lPaths = []
+   for (sRoot, lSubDirectories, lFiles) in os.walk(sDirectory):
+      lSubDirectories[:] = [sName for sName in lSubDirectories if sName != ARCHIVE_DIRECTORY]
+      for sFilename in lFiles:
+         if parse_filename(sFilename) is not None:
+            lPaths.append(os.path.join(sRoot, sFilename))
+   my_print("Files to verify: " + str(len(lPaths)), nMessageVerbosity=VERBOSE)
+   if len(lPaths) == 0:
+      return [], 0
+
+   lBadFiles = []
+   with ProcessPoolExecutor(max_workers=nJobs) as executor:
+      for sPath, sError in zip(lPaths, executor.map(check_observation_file, lPaths, \
+                                                    chunksize=VERIFY_CHUNK_SIZE)):
+         if sError is not None:
+            my_print("Invalid file: " + sPath + "\n\t" + sError, nMessageVerbosity=VERBOSE)
+            lBadFiles.append([sPath, sError])
+   return lBadFiles, len(lPaths)
+
+def get_verify_requests(lBadFiles, catalog):
+   """
+   Return the requests to download again the periods of the invalid files, in the syntax
+   of the --batch files, i.e. '--hourly --start-date 1995-03 --end-date 1995-05 10091'.
+   The consecutive periods of a station are merged. The station is found with the climate
+   ID of the filename, or the directory of the file if several stations share it.
+
+   OUTPUT
+   dRequests: dictionnary with the (language, format) of the files as keys and the list of
+    the requests as values. The files whose station is not found are not requested.
+   """
+
+   dClimateStations = {}
+   for sStation, dStation in catalog.dStationList.items():
+      dClimateStations.setdefault(dStation["Climate ID"], []).append(sStation)
+
+   # Periods to download again, as month indexes
+   dPeriods = {}
+   for sPath, sError in lBadFiles:
+      (sLang, sFormat, sClimateID, sTimeframe, nYear, nMonth) = \
+         parse_filename(os.path.basename(sPath))
+      lStations = dClimateStations.get(sClimateID, [])
+      if len(lStations) == 0:
+         my_print("WARNING: station of the file not found, it is not requested again: " + \
+                  sPath, nMessageVerbosity=NORMAL)
+         continue
+      # Directory tree is <station>/<timeframe>, unless --no-tree was used
+      sStation = os.path.basename(os.path.dirname(os.path.dirname(os.path.abspath(sPath))))
+      if sStation not in lStations:
+         sStation = lStations[0]
+      nMonthIndex = None
+      if sTimeframe == "hourly":
+         nMonthIndex = get_month_index(nYear, nMonth)
+      elif sTimeframe == "daily":
+         nMonthIndex = get_month_index(nYear, 1)
+      dPeriods.setdefault((sLang, sFormat, sStation, sTimeframe), set()).add(nMonthIndex)
+
+   dRequests = {}
+   for (sLang, sFormat, sStation, sTimeframe) in sorted(dPeriods):
+      lRequests = dRequests.setdefault((sLang, sFormat), [])
+      setPeriods = dPeriods[(sLang, sFormat, sStation, sTimeframe)]
+      sOption = "--" + sTimeframe
+      if None in setPeriods: # Monthly and almanac files
+         lRequests.append(sOption + " " + sStation)
+         continue
+      # A month for the hourly files, a year for the daily files
+      bMonth = sTimeframe == "hourly"
+      nStep = 1 if bMonth else 12
+      lPeriods = sorted(setPeriods)
+      nStart = lPeriods[0]
+      for nPosition, nPeriod in enumerate(lPeriods):
+         if nPosition + 1 < len(lPeriods) and lPeriods[nPosition + 1] == nPeriod + nStep:
+            continue
+         lRequests.append(sOption + " --start-date " + format_month_index(nStart, bMonth) + \
+                          " --end-date " + format_month_index(nPeriod, bMonth) + " " + sStation)
+         if nPosition + 1 < len(lPeriods):
+            nStart = lPeriods[nPosition + 1]
+   return dRequests
+
+def write_verify_requests(dRequests, sDirectory):
+   """
+   Write the requests of get_verify_requests in batch files in sDirectory, one per language
+   and format (see VERIFY_FILENAME). Return the list of the files written.
+   """
+
+   lPaths = []
+   for (sLang, sFormat), lRequests in sorted(dRequests.items()):
+      sPath = os.path.join(sDirectory, VERIFY_FILENAME.format(lang=sLang, format=sFormat))
+      with open(sPath, "w", encoding="utf-8") as fichier:
+         fichier.write("# Periods of the invalid files found by --verify. Download them " + \
+                       "again with:\n# get_canadian_weather_observations.py --lang " + \
+                       sLang + " --format " + sFormat + " -o " + sDirectory + \
+                       " --batch " + sPath + "\n")
+         for sRequest in lRequests:
+            fichier.write(sRequest + "\n")
+      lPaths.append(sPath)
+   return lPaths
+
+def get_period_bounds(sStart=None, sEnd=None):
+   """
+   Return the period [timeStart, timeEnd[ covered by the dates sStart and sEnd, of format 
+   YYYY[-MM[-DD]]. The end date is included: '2019' ends on 2020-01-01 00:00. A bound is
+   None if its date is not provided.
+   """
+
+   lBounds = []
+   for sDate, bEnd in [(sStart, False), (sEnd, True)]:
+      if sDate is None:
+         lBounds.append(None)
+         continue
+      try:
+         if len(sDate) == 4:
+            timeDate = datetime.datetime.strptime(sDate, "%Y")
+            if bEnd:
+               timeDate = timeDate.replace(year=timeDate.year + 1)
+         elif len(sDate) == 7:
+            timeDate = datetime.datetime.strptime(sDate, "%Y-%m")
+            if bEnd:
+               timeDate = (timeDate + datetime.timedelta(days=31)).replace(day=1)
+         elif len(sDate) == 10:
+            timeDate = datetime.datetime.strptime(sDate, "%Y-%m-%d")
+            if bEnd:
+               timeDate = timeDate + datetime.timedelta(days=1)
+         else:
+            raise ValueError(sDate)
+      except ValueError:
+         raise DateFormatError("Date must be of format 'YYYY', 'YYYY-MM' or 'YYYY-MM-DD'.\n" + \
+                               "Provided value: '" + sDate + "'", 5)
+      lBounds.append(timeDate)
+   return lBounds
+
+def is_in_period(nYear, nMonth, timeStart, timeEnd, lMonths=None):
+   """
+   Check if the file of the year nYear and month nMonth (None for a whole year or for a
+   monthly file with nYear None) overlaps the period [timeStart, timeEnd[ and the months
+   lMonths.
+   """
+
+   if nYear is None:
+      return True
+   if nMonth is None:
+      timeFileStart = datetime.datetime(nYear, 1, 1)
+      timeFileEnd = datetime.datetime(nYear + 1, 1, 1)
+   else:
+      if lMonths is not None and nMonth not in lMonths:
+         return False
+      timeFileStart = datetime.datetime(nYear, nMonth, 1)
+      timeFileEnd = datetime.datetime(nYear + nMonth // 12, nMonth % 12 + 1, 1)
+   if timeStart is not None and timeFileEnd <= timeStart:
+      return False
+   if timeEnd is not None and timeFileStart >= timeEnd:
+      return False
+   return True
+
+def get_date_column(table):
+   """
+   Return the name of the date column of an observation table: the only timestamp column.
+   """
+
+   pyarrow = import_pyarrow()
+
+   for field in table.schema:
+      if pyarrow.types.is_timestamp(field.type):
+         return field.name
+   raise ArchiveError("ERROR: no date in the observations: " + str(table.column_names), 16)
+
+def filter_observation_table(table, timeStart, timeEnd, lMonths=None):
+   """
+   Keep the rows of an observation table in the period [timeStart, timeEnd[ and the 
+   months lMonths.
+   """
+
+   pyarrow = import_pyarrow()
+
+   if table.num_rows == 0 or (timeStart is None and timeEnd is None and lMonths is None):
+      return table
+   arrayDate = table.column(get_date_column(table))
+   lMasks = []
+   if timeStart is not None:
+      lMasks.append(pyarrow.compute.greater_equal(arrayDate, \
+                    pyarrow.scalar(timeStart, arrayDate.type)))
+   if timeEnd is not None:
+      lMasks.append(pyarrow.compute.less(arrayDate, pyarrow.scalar(timeEnd, arrayDate.type)))
+   if lMonths is not None:
+      lMasks.append(pyarrow.compute.is_in(pyarrow.compute.month(arrayDate), \
+                    value_set=pyarrow.array(lMonths, pyarrow.int64())))
+   mask = lMasks[0]
+   for maskOther in lMasks[1:]:
+      mask = pyarrow.compute.and_(mask, maskOther)
+   return table.filter(mask)
+
+def load_directory_observations(sDirectory, sTimeframe, timeStart=None, timeEnd=None, \
+                                lColumns=None, sLang="en", lMonths=None):
+   """
+   Read the observations of a directory of observation files for the period 
+   [timeStart, timeEnd[. Only the files overlapping the period are opened. A partition of 
+   the archive is used when it holds the current version of all the CSV files of its year,
+   otherwise the CSV files are parsed.
+
+   OUTPUT
+   List of the pyarrow Tables read
+   """
+
+   pyarrow = import_pyarrow()
+
+   # Files on the disk and partitions of the archive, by climate ID and year
+   dFiles = {}
+   dPartitions = {}
+   if os.path.isdir(sDirectory):
+      for entry in os.scandir(sDirectory):
+         tKey = parse_filename(entry.name)
+         if tKey is not None and tKey[0] == sLang and tKey[1] == "csv" and \
+            tKey[3] == sTimeframe:
+            dFiles.setdefault((tKey[2], tKey[4]), {})[entry.name] = entry
+   sArchiveDirectory = os.path.join(sDirectory, ARCHIVE_DIRECTORY)
+   if os.path.isdir(sArchiveDirectory):
+      for entry in os.scandir(sArchiveDirectory):
+         matchPartition = ARCHIVE_FILENAME_REGEX.match(entry.name)
+         if matchPartition is not None and matchPartition.group("lang") == sLang and \
+            matchPartition.group("timeframe") == sTimeframe:
+            nYear = matchPartition.group("year")
+            if nYear is not None:
+               nYear = int(nYear)
+            dPartitions[(matchPartition.group("climateid"), nYear)] = entry.path
+
+   lTables = []
+   for tKey in sorted(set(dFiles) | set(dPartitions), key=str):
+      (sClimateID, nYear) = tKey
+      if not is_in_period(nYear, None, timeStart, timeEnd):
+         continue
+      dYearFiles = dFiles.get(tKey, {})
+
+      sPartitionPath = dPartitions.get(tKey)
+      if sPartitionPath is not None:
+         dSources = read_archive_sources(sPartitionPath)
+         if all(dSources.get(sFilename) == [entry.stat().st_size, entry.stat().st_mtime_ns] \
+                for (sFilename, entry) in dYearFiles.items()):
+            lSchemaColumns = pyarrow.parquet.read_schema(sPartitionPath).names
+            lReadColumns = None
+            if lColumns is not None:
+               lReadColumns = [sColumn for sColumn in lSchemaColumns \
+                               if sColumn in lColumns or sColumn == lSchemaColumns[4]]
+            table = pyarrow.parquet.read_table(sPartitionPath, columns=lReadColumns)
+            lTables.append(filter_observation_table(table.replace_schema_metadata(None), \
+                                                    timeStart, timeEnd, lMonths))
+            continue
+
+      for sFilename in sorted(dYearFiles):
+         nMonth = parse_filename(sFilename)[5]
+         if not is_in_period(nYear, nMonth, timeStart, timeEnd, lMonths):
+            continue
+         with open_observation_file(dYearFiles[sFilename].path) as fichier:
+            table = parse_observation_csv(fichier, lColumns)
+         lTables.append(filter_observation_table(table, timeStart, timeEnd, lMonths))
+
+   return lTables
+
+def load_observations(lStations, sTimeframe, sStart=None, sEnd=None, lColumns=None, \
+                      sDirectory=None, sLang="en", lMonths=None, nJobs=1):
+   """
+   Read the observations downloaded in the tree sDirectory/<station>/<timeframe>, from the
+   columnar archive when it is up to date, or from the CSV files.
+
+   Only the files overlapping the period are opened and only the requested columns are 
+   parsed. The stations are read concurrently with nJobs threads.
+
+   INPUT
+   lStations: list of station IDs
+   sTimeframe: 'hourly', 'daily' or 'monthly'
+   sStart, sEnd: first and last date of the period, of format YYYY[-MM[-DD]], both included.
+    The whole period available if None.
+   lColumns: names of the columns to read, i.e. ['Mean Temp (°C)']. All if None.
+   sDirectory: root of the tree. Default is the directory of this script, like the 
+    downloads.
+   sLang: language of the files, 'en' or 'fr'
+   lMonths: only keep these months, i.e. [5, 6, 7, 8, 9, 10]
+
+   OUTPUT
+   pandas DataFrame indexed by date, with the column 'Station ID' and the requested 
+   columns, typed: the values are floats, the flags strings.
+   """
+
+   pandas = import_pandas()
+   pyarrow = import_pyarrow()
+
+   sDirectory = get_output_directory(sDirectory)
+   [timeStart, timeEnd] = get_period_bounds(sStart, sEnd)
+   if lColumns is not None:
+      lColumns = list(lColumns)
+
+   def load_station(sStation):
+      lTables = load_directory_observations(os.path.join(sDirectory, str(sStation), sTimeframe), \
+                                            sTimeframe, timeStart, timeEnd, lColumns, sLang, \
+                                            lMonths)
+      lTables = [table for table in lTables if table.num_rows > 0]
+      if len(lTables) == 0:
+         return None
+      table = concat_observation_tables(lTables)
+      return table.append_column("Station ID", \
+                                 pyarrow.array([str(sStation)] * table.num_rows, pyarrow.string()))
+
+   with ThreadPoolExecutor(max_workers=nJobs) as executor:
+      lTables = [table for table in executor.map(load_station, lStations) if table is not None]
+   my_print("Stations with observations: " + str(len(lTables)) + " out of " + \
+            str(len(lStations)), nMessageVerbosity=VERBOSE)
+
+   if len(lTables) == 0:
+      return pandas.DataFrame(columns=["Station ID"] + (lColumns or []))
+   table = concat_observation_tables(lTables)
+   dataFrame = table.to_pandas().set_index(get_date_column(table))
+   if lColumns is not None:
+      dataFrame = dataFrame[["Station ID"] + [sColumn for sColumn in lColumns \
+                                              if sColumn in dataFrame.columns]]
+   return dataFrame
+
+def import_pandas():
+   """
+   Import pandas, only needed to read the observations in a DataFrame. Raise ArchiveError
+   if it is not installed.
+   """
+
+   try:
+      # From pandas: https://pypi.org/project/pandas/
+      import pandas
+   except ImportError:
+      raise ArchiveError("ERROR: pandas is needed to read the observations. " + \
+                         "Install it with 'pip install pandas'.", 16)
+   return pandas
+
+def import_numpy():
+   """
+   Import numpy, only needed for the matrix of observations. Raise ArchiveError if it is
+   not installed.
+   """
+
+   try:
+      # From numpy: https://pypi.org/project/numpy/
+      import numpy
+   except ImportError:
+      raise ArchiveError("ERROR: numpy is needed for the matrix of observations. " + \
+                         "Install it with 'pip install numpy'.", 16)
+   return numpy
+
+def get_matrix_path(sDirectory, sLang, sTimeframe, sVariable):
+   """
+   Return the path of the matrix of a variable for the observation files of the tree
+   sDirectory/<station>/<timeframe>, i.e. sDirectory/matrix/en_hourly_Temp_C.npy for the
+   hourly 'Temp (°C)'.
+   """
+
+   sName = re.sub(r"\W+", "_", sVariable).strip("_")
+   return os.path.join(sDirectory, MATRIX_DIRECTORY, sLang + "_" + sTimeframe + "_" + \
+                       sName + ".npy")
+
+class ObservationMatrix:
+   """
+   Matrix station x time of one variable of the observation files, i.e. the hourly 
+   'Temp (°C)' or the daily 'Mean Temp (°C)', in a NumPy file read as a memory map: the 
+   analysis of several stations does not load their observations in memory. A row is a 
+   station, a column an hour, a day or a month, and NaN is a missing value.
+
+   The sidecar index, with the same name and the suffix .json, holds the stations of the 
+   rows, the date of the first column and the observation files already written in the 
+   matrix, so update() only reads the files added or modified since.
+   """
+
+   def __init__(self, sDirectory=None, sVariable="Temp (°C)", sTimeframe="hourly", sLang="en"):
+      if sTimeframe not in dMatrixTimeUnit:
+         raise ValueError("Timeframe must be 'hourly', 'daily' or 'monthly': " + str(sTimeframe))
+      self.sDirectory = get_output_directory(sDirectory)
+      self.sVariable = sVariable
+      self.sTimeframe = sTimeframe
+      self.sLang = sLang
+      self.sUnit = dMatrixTimeUnit[sTimeframe]
+      self.sPath = get_matrix_path(self.sDirectory, sLang, sTimeframe, sVariable)
+      self.sIndexPath = os.path.splitext(self.sPath)[0] + ".json"
+
+   def read_index(self):
+      """
+      Return the index of the matrix, or None if the matrix does not exist or does not 
+      match its index, i.e. after an interrupted update that changed its shape.
+      """
+
+      numpy = import_numpy()
+
+      if not os.path.exists(self.sIndexPath):
+         return None
+      try:
+         with open(self.sIndexPath, encoding="utf-8") as fichier:
+            dIndex = json.load(fichier)
+         tShape = numpy.load(self.sPath, mmap_mode="r").shape
+      except (OSError, ValueError):
+         tShape = None
+         dIndex = {}
+      if dIndex.get("version") != MATRIX_VERSION or \
+         tShape != (len(dIndex["stations"]), dIndex["times"]):
+         my_print("WARNING: invalid matrix, it will be created again: " + self.sPath, \
+                  nMessageVerbosity=NORMAL)
+         return None
+      return dIndex
+
+   def write_index(self, dIndex):
+      """
+      Replace the index of the matrix in one step.
+      """
+
+      sTemporaryPath = self.sIndexPath + ".part"
+      with open(sTemporaryPath, "w", encoding="utf-8") as fichier:
+         json.dump(dIndex, fichier, ensure_ascii=False, sort_keys=True)
+      os.replace(sTemporaryPath, self.sIndexPath)
+
+   def load_index(self):
+      """
+      Return the index of the matrix. Raise ArchiveError if it does not exist.
+      """
+
+      dIndex = self.read_index()
+      if dIndex is None:
+         raise ArchiveError("ERROR: no matrix of '" + self.sVariable + "' for the " + \
+                            self.sTimeframe + " files of " + self.sDirectory + \
+                            ", create it with --matrix.", 16)
+      return dIndex
+
+   def get_values(self, bWrite=False):
+      """
+      Return the matrix as a NumPy memory map, read-only unless bWrite is True.
+      """
+
+      numpy = import_numpy()
+      return numpy.load(self.sPath, mmap_mode="r+" if bWrite else "r")
+
+   def get_stations(self):
+      """
+      Return the list of the station IDs of the rows of the matrix.
+      """
+
+      return self.load_index()["stations"]
+
+   def get_times(self, dIndex=None):
+      """
+      Return the dates of the columns of the matrix, as a NumPy array of datetime64.
+      """
+
+      numpy = import_numpy()
+
+      if dIndex is None:
+         dIndex = self.load_index()
+      return numpy.datetime64(dIndex["start"], self.sUnit) + \
+         numpy.arange(dIndex["times"], dtype="int64")
+
+   def get_file_period(self, nYear, nMonth):
+      """
+      Return the columns [start, end[ covered by an observation file of the year nYear and 
+      month nMonth, in units of the time axis since 1970. None for a monthly file, which
+      covers the whole period of the station.
+      """
+
+      numpy = import_numpy()
+
+      if nYear is None:
+         return None
+      if nMonth is None:
+         timeStart = numpy.datetime64(str(nYear), "Y")
+         timeEnd = timeStart + 1
+      else:
+         timeStart = numpy.datetime64("%04d-%02d" % (nYear, nMonth), "M")
+         timeEnd = timeStart + 1
+      return (int(timeStart.astype("datetime64[" + self.sUnit + "]").astype("int64")), \
+              int(timeEnd.astype("datetime64[" + self.sUnit + "]").astype("int64")))
+
+   def find_files(self):
+      """
+      Return the CSV observation files of the tree, in a dictionary with the station IDs as
+      keys and a dictionary {filename: [path, size, modification time in ns]} as values.
+      """
+
+      dStationFiles = {}
+      if not os.path.isdir(self.sDirectory):
+         return dStationFiles
+      for entryStation in os.scandir(self.sDirectory):
+         if entryStation.name in [ARCHIVE_DIRECTORY, MATRIX_DIRECTORY] or \
+            not entryStation.is_dir():
+            continue
+         sTimeframeDirectory = os.path.join(entryStation.path, self.sTimeframe)
+         if not os.path.isdir(sTimeframeDirectory):
+            continue
+         for entry in os.scandir(sTimeframeDirectory):
+            tKey = parse_filename(entry.name)
+            if tKey is None or tKey[0] != self.sLang or tKey[1] != "csv" or \
+               tKey[3] != self.sTimeframe:
+               continue
+            stat = entry.stat()
+            dStationFiles.setdefault(entryStation.name, {})[entry.name] = \
+               [entry.path, stat.st_size, stat.st_mtime_ns]
+      return dStationFiles
+
+   def has_variable(self, sPath):
+      """
+      Check if the header of an observation file has the variable of the matrix.
+      """
+
+      with open_observation_file(sPath, "r") as fichier:
+         lHeader = next(csv.reader([fichier.readline()]), [])
+      return self.sVariable in lHeader
+
+   def read_file(self, sPath):
+      """
+      Read the variable of an observation file. Values that are not numbers (i.e. '<31' for 
+      the gusts) are missing.
+
+      OUTPUT
+      arrayTime: dates of the values, in units of the time axis since 1970
+      arrayValue: values of the variable
+      """
+
+      numpy = import_numpy()
+      pyarrow = import_pyarrow()
+
+      with open_observation_file(sPath) as fichier:
+         table = parse_observation_csv(fichier, [self.sVariable])
+      if self.sVariable not in table.column_names:
+         return numpy.empty(0, "int64"), numpy.empty(0, MATRIX_DTYPE)
+      array = table.column(self.sVariable)
+      if not pyarrow.types.is_floating(array.type):
+         array = pyarrow.compute.replace_substring(array.cast(pyarrow.string()), ",", ".")
+         array = pyarrow.compute.if_else(\
+            pyarrow.compute.match_substring_regex(array, r"^\s*[-+]?\d+(\.\d*)?\s*$"), \
+            array, pyarrow.scalar(None, pyarrow.string()))
+         array = pyarrow.compute.cast(array, pyarrow.float64())
+      arrayValue = array.to_numpy().astype(MATRIX_DTYPE)
+      arrayTime = table.column(get_date_column(table)).to_numpy()
+      maskValid = ~numpy.isnat(arrayTime) & ~numpy.isnan(arrayValue)
+      arrayTime = arrayTime[maskValid].astype("datetime64[" + self.sUnit + "]").astype("int64")
+      return arrayTime, arrayValue[maskValid]
+
+   def resize(self, dIndex, lStations, nStart, nTimes):
+      """
+      Write the matrix again with the rows lStations and nTimes columns from nStart, in 
+      units of the time axis since 1970, keeping the values already written. The new 
+      matrix replaces the former one in one step.
+      """
+
+      numpy = import_numpy()
+
+      os.makedirs(os.path.dirname(self.sPath), exist_ok=True)
+      sTemporaryPath = self.sPath + "." + str(os.getpid()) + ".part"
+      try:
+         values = numpy.lib.format.open_memmap(sTemporaryPath, mode="w+", dtype=MATRIX_DTYPE, \
+                                               shape=(len(lStations), nTimes))
+         values[:] = numpy.nan
+         if dIndex["times"] > 0 and len(dIndex["stations"]) > 0:
+            valuesFormer = self.get_values()
+            nOffset = int(numpy.datetime64(dIndex["start"], self.sUnit).astype("int64")) - nStart
+            for nRow in range(len(dIndex["stations"])):
+               values[nRow, nOffset:nOffset + dIndex["times"]] = valuesFormer[nRow]
+            del valuesFormer
+         values.flush()
+         del values
+         os.replace(sTemporaryPath, self.sPath)
+      except BaseException:
+         if os.path.exists(sTemporaryPath):
+            os.remove(sTemporaryPath)
+         raise
+
+      dIndex["stations"] = lStations
+      dIndex["start"] = str(numpy.datetime64(nStart, self.sUnit))
+      dIndex["times"] = nTimes
+
+   def update(self, nJobs=1):
+      """
+      Write in the matrix the values of the observation files added or modified since the 
+      last update, with nJobs threads. The time axis is extended by whole years and a row 
+      is added for each new station. The values of a file removed from the disk are kept.
+
+      OUTPUT
+      Number of files written in the matrix
+      """
+
+      numpy = import_numpy()
+      import_pyarrow()
+
+      dIndex = self.read_index()
+      if dIndex is None:
+         dIndex = { "version" : MATRIX_VERSION, "variable" : self.sVariable, \
+                    "timeframe" : self.sTimeframe, "lang" : self.sLang, "dtype" : MATRIX_DTYPE, \
+                    "start" : None, "times" : 0, "stations" : [], "sources" : {} }
+
+      # Files added or modified, and those with the variable
+      dStationFiles = self.find_files()
+      lNewFiles = []
+      for sStation in sorted(dStationFiles):
+         dSources = dIndex["sources"].get(sStation, {})
+         for sFilename, lFile in sorted(dStationFiles[sStation].items()):
+            if dSources.get(sFilename) != lFile[1:]:
+               lNewFiles.append((sStation, sFilename, lFile))
+      if len(lNewFiles) == 0:
+         return 0
+      with ThreadPoolExecutor(max_workers=nJobs) as executor:
+         lHasVariable = list(executor.map(lambda tFile: self.has_variable(tFile[2][0]), \
+                                          lNewFiles))
+      if len(dIndex["stations"]) == 0 and not any(lHasVariable):
+         my_print("WARNING: no " + self.sTimeframe + " file with the column '" + \
+                  self.sVariable + "', the matrix is not created.", nMessageVerbosity=NORMAL)
+         return 0
+
+      # Monthly files cover the whole period of the station: they are read first to know it
+      dValues = {}
+      lPeriods = []
+      for (sStation, sFilename, lFile), bHasVariable in zip(lNewFiles, lHasVariable):
+         if not bHasVariable:
+            continue
+         (sLang, sFormat, sClimateID, sTimeframe, nYear, nMonth) = parse_filename(sFilename)
+         tPeriod = self.get_file_period(nYear, nMonth)
+         if tPeriod is None:
+            dValues[(sStation, sFilename)] = self.read_file(lFile[0])
+            arrayTime = dValues[(sStation, sFilename)][0]
+            if len(arrayTime) > 0:
+               tPeriod = (int(arrayTime.min()), int(arrayTime.max()) + 1)
+         if tPeriod is not None:
+            lPeriods.append(tPeriod)
+
+      # New stations and new years
+      lStations = dIndex["stations"] + sorted(set(tFile[0] for tFile, bHasVariable \
+                                                  in zip(lNewFiles, lHasVariable) \
+                                                  if bHasVariable) - set(dIndex["stations"]))
+      if dIndex["times"] > 0:
+         nStart = int(numpy.datetime64(dIndex["start"], self.sUnit).astype("int64"))
+         lPeriods.append((nStart, nStart + dIndex["times"]))
+      if len(lPeriods) > 0:
+         sTimeUnit = "datetime64[" + self.sUnit + "]"
+         timeStart = numpy.datetime64(min(tPeriod[0] for tPeriod in lPeriods), self.sUnit)
+         timeEnd = numpy.datetime64(max(tPeriod[1] for tPeriod in lPeriods) - 1, self.sUnit)
+         nStart = int(timeStart.astype("datetime64[Y]").astype(sTimeUnit).astype("int64"))
+         nEnd = int((timeEnd.astype("datetime64[Y]") + 1).astype(sTimeUnit).astype("int64"))
+      else:
+         nStart = nEnd = 0
+      if lStations != dIndex["stations"] or nEnd - nStart != dIndex["times"]:
+         my_print("Matrix " + self.sPath + ": " + str(len(lStations)) + " station(s), " + \
+                  str(nEnd - nStart) + " " + self.sTimeframe + " values", \
+                  nMessageVerbosity=VERBOSE)
+         self.resize(dIndex, lStations, nStart, nEnd - nStart)
+      dRows = dict((sStation, nRow) for nRow, sStation in enumerate(lStations))
+
+      # The stations are written concurrently, each one in its own row
+      def write_file(values, tFile, bHasVariable):
+         (sStation, sFilename, lFile) = tFile
+         if sStation not in dRows:
+            return
+         # The values of a file downloaded again replace those of its period
+         (sLang, sFormat, sClimateID, sTimeframe, nYear, nMonth) = parse_filename(sFilename)
+         row = values[dRows[sStation]]
+         tPeriod = self.get_file_period(nYear, nMonth)
+         if tPeriod is None:
+            row[:] = numpy.nan
+         else:
+            row[max(tPeriod[0] - nStart, 0):max(tPeriod[1] - nStart, 0)] = numpy.nan
+         if not bHasVariable:
+            return
+         (arrayTime, arrayValue) = dValues.pop((sStation, sFilename), None) or \
+            self.read_file(lFile[0])
+         arrayPosition = arrayTime - nStart
+         maskInside = (arrayPosition >= 0) & (arrayPosition < len(row))
+         row[arrayPosition[maskInside]] = arrayValue[maskInside]
+
+      def write_station(values, lStationFiles):
+         for tFile, bHasVariable in lStationFiles:
+            write_file(values, tFile, bHasVariable)
+
+      dStationNewFiles = {}
+      for tFile, bHasVariable in zip(lNewFiles, lHasVariable):
+         dStationNewFiles.setdefault(tFile[0], []).append((tFile, bHasVariable))
+      values = self.get_values(bWrite=True)
+      with ThreadPoolExecutor(max_workers=nJobs) as executor:
+         list(executor.map(functools.partial(write_station, values), dStationNewFiles.values()))
+      values.flush()
+      del values
+
+      # The files are recorded once their values are on the disk
+      for (sStation, sFilename, lFile) in lNewFiles:
+         dIndex["sources"].setdefault(sStation, {})[sFilename] = lFile[1:]
+      self.write_index(dIndex)
+      my_print("Matrix " + self.sPath + ": " + str(len(lNewFiles)) + " file(s) added", \
+               nMessageVerbosity=VERBOSE)
+      return len(lNewFiles)
+
+   def get_period(self, sStart=None, sEnd=None):
+      """
+      Return the index of the matrix, the dates of its columns and the columns 
+      [nFirst, nLast[ of the period from sStart to sEnd, of format YYYY[-MM[-DD]], both 
+      included. The whole matrix if None.
+      """
+
+      numpy = import_numpy()
+
+      dIndex = self.load_index()
+      arrayTime = self.get_times(dIndex)
+      [timeStart, timeEnd] = get_period_bounds(sStart, sEnd)
+      nFirst = 0
+      nLast = len(arrayTime)
+      if timeStart is not None:
+         nFirst = int(numpy.searchsorted(arrayTime, numpy.datetime64(timeStart, "ms")))
+      if timeEnd is not None:
+         nLast = int(numpy.searchsorted(arrayTime, numpy.datetime64(timeEnd, "ms")))
+      return dIndex, arrayTime, nFirst, nLast
+
+   def to_pandas(self, sStart=None, sEnd=None, lStations=None, lComposites=None):
+      """
+      Return the values of the matrix in a pandas DataFrame indexed by date, with a column 
+      per station. Only the period and the stations requested are read from the disk.
+
+      INPUT
+      sStart, sEnd: first and last date of the period, of format YYYY[-MM[-DD]], both 
+       included. The whole matrix if None.
+      lStations: list of station IDs. All the stations of the matrix if None.
+      lComposites: list of CompositeStation, whose merged series are added as columns 
+       named after them.
+      """
+
+      pandas = import_pandas()
+
+      (dIndex, arrayTime, nFirst, nLast) = self.get_period(sStart, sEnd)
+      values = self.get_values()
+      lRowStations = dIndex["stations"]
+      if lStations is None:
+         values = values[:, nFirst:nLast]
+      else:
+         lRowStations = [str(sStation) for sStation in lStations \
+                         if str(sStation) in dIndex["stations"]]
+         lRows = [dIndex["stations"].index(sStation) for sStation in lRowStations]
+         values = values[lRows, nFirst:nLast]
+      dataFrame = pandas.DataFrame(values.T, index=pandas.DatetimeIndex(arrayTime[nFirst:nLast]), \
+                                   columns=lRowStations)
+      for composite in lComposites or []:
+         dataFrame[composite.sName] = composite.get_values(self, dIndex, nFirst, nLast)[0]
+      return dataFrame
+
+def update_matrices(sDirectory, sVariable, lTimeframes=None, sLang="en", nJobs=1):
+   """
+   Update the matrices of the variable sVariable for the timeframes lTimeframes (hourly,
+   daily and monthly if None) of the observation files of the tree 
+   sDirectory/<station>/<timeframe>. See ObservationMatrix.
+
+   OUTPUT
+   Number of files written in the matrices
+   """
+
+   if lTimeframes is None:
+      lTimeframes = list(dMatrixTimeUnit)
+   nWritten = 0
+   for sTimeframe in lTimeframes:
+      nWritten = nWritten + ObservationMatrix(sDirectory, sVariable, sTimeframe, \
+                                              sLang).update(nJobs)
+   my_print("Files added to the matrices of '" + sVariable + "': " + str(nWritten), \
+            nMessageVerbosity=NORMAL)
+   return nWritten
+
+def merge_station_values(values):
+   """
+   Merge the rows of values, the members of a composite station by priority, in a single 
+   pass: the value of a column is the one of the first row that is not NaN.
+
+   OUTPUT
+   arrayValue: merged values, NaN where no row has a value
+   arrayMember: row of each merged value, -1 where no row has a value
+   """
+
+   numpy = import_numpy()
+
+   if values.shape[0] == 0:
+      return numpy.full(values.shape[1], numpy.nan, values.dtype), \
+         numpy.full(values.shape[1], -1, "int64")
+   maskValid = ~numpy.isnan(values)
+   arrayMember = maskValid.argmax(axis=0)
+   arrayValue = numpy.take_along_axis(values, arrayMember[numpy.newaxis, :], axis=0)[0]
+   arrayMember[~maskValid[arrayMember, numpy.arange(values.shape[1])]] = -1
+   return arrayValue, arrayMember
+
+class CompositeStation:
+   """
+   Station made of stations that replaced each other at about the same place, listed by 
+   priority, i.e. 41883, then 1669, then 31470. The value of a date is the one of the first
+   member that has an observation, so the record is continuous.
+
+   When the files are planned, a member does not download the years inside the record of 
+   a member of higher priority, according to the station list. The first and last years of
+   a record are downloaded for both members, to cover the transition, and so are the 
+   periods where the member of higher priority has no observation (see CoverageMap).
+   """
+
+   def __init__(self, lStations, sName=None):
+      self.lStations = [str(sStation) for sStation in lStations]
+      if sName is None:
+         sName = "+".join(self.lStations)
+      self.sName = sName
+
+   @classmethod
+   def parse(cls, sComposite):
+      """
+      Return the CompositeStation of a value of --composite: station IDs separated by 
+      commas, by priority, i.e. '41883,1669,31470'. Raise RequestError if it is not valid.
+      """
+
+      lStations = [sStation.strip() for sStation in sComposite.split(",")]
+      if len(lStations) < 2 or not all(sStation.isdigit() for sStation in lStations) or \
+         len(set(lStations)) != len(lStations):
+         raise RequestError("ERROR: value provided in '--composite' must be 2 different " + \
+                            "station IDs or more, separated by commas: " + sComposite, 22)
+      return cls(lStations)
+
+   def __str__(self):
+      return ",".join(self.lStations)
+
+   def get_covered_periods(self, catalog, coverage=None):
+      """
+      Return the daily and hourly periods of each member provided by a member of higher 
+      priority: a dictionnary with the station ID as key and a dictionnary 
+      {(timeframe, year, month): station ID of the member of higher priority} as value.
+      The month is None for the daily files. See get_daily_tasks and get_hourly_tasks.
+      """
+
+      stationTable = catalog.get_station_table()
+      dCoveredPeriods = {}
+      for nMember, sStation in enumerate(self.lStations):
+         dStationPeriods = {}
+         for sHigher in self.lStations[:nMember]:
+            if sHigher not in stationTable.dIndex:
+               continue
+            nHigher = stationTable.dIndex[sHigher]
+            setEmptyPeriods = set()
+            if coverage is not None:
+               setEmptyPeriods = coverage.get_empty_periods(sHigher)
+            for sTimeframe in ["daily", "hourly"]:
+               sPrefix = dTimeframePrefix[sTimeframe]
+               nFirstYear = stationTable.dColumns[sPrefix + "First Year"][nHigher]
+               nLastYear = stationTable.dColumns[sPrefix + "Last Year"][nHigher]
+               if nFirstYear <= 0:
+                  continue
+               lMonths = [None] if sTimeframe == "daily" else range(1, 13)
+               for nYear in range(nFirstYear + 1, nLastYear):
+                  for nMonth in lMonths:
+                     tPeriod = (sTimeframe, nYear, nMonth)
+                     if tPeriod not in setEmptyPeriods:
+                        dStationPeriods.setdefault(tPeriod, sHigher)
+         if len(dStationPeriods) > 0:
+            dCoveredPeriods[sStation] = dStationPeriods
+      return dCoveredPeriods
+
+   def get_values(self, matrix, dIndex, nFirst, nLast):
+      """
+      Merge the values of the members in the columns [nFirst, nLast[ of an 
+      ObservationMatrix with the index dIndex. Only the rows of the members are read.
+
+      OUTPUT
+      arrayValue: merged values, NaN where no member has a value
+      arrayStation: station ID of each value, None where no member has a value
+      """
+
+      numpy = import_numpy()
+
+      lMembers = [sStation for sStation in self.lStations if sStation in dIndex["stations"]]
+      lRows = [dIndex["stations"].index(sStation) for sStation in lMembers]
+      arrayValue, arrayMember = merge_station_values(matrix.get_values()[lRows, nFirst:nLast])
+      # The last item is for the values without member (-1)
+      arrayStation = numpy.array(lMembers + [None], dtype=object)[arrayMember]
+      return arrayValue, arrayStation
+
+   def merge(self, matrix, sStart=None, sEnd=None):
+      """
+      Return the merged series of the composite station for the variable of an 
+      ObservationMatrix, in a pandas DataFrame indexed by date with the columns of the 
+      variable and 'Station ID', the member that provided the value.
 
-      if dObsPeriod["daily"]: # Check for daily values
-         sFirstYear = dStation["DLY First Year"]
-         sLastYear = dStation["DLY Last Year"]
+      INPUT
+      sStart, sEnd: first and last date of the period, of format YYYY[-MM[-DD]], both 
+       included. The whole matrix if None.
+      """
 
-         dStationStartEndDates[sStation]["daily"] = \
-                                                  check_period(sStation, lDateRequested, sFirstYear, sLastYear, "daily")
-         
-      if dObsPeriod["hourly"]: # Check for hourly values
-         sFirstYear = dStation["HLY First Year"]
-         sLastYear = dStation["HLY Last Year"]
+      pandas = import_pandas()
 
-         dStationStartEndDates[sStation]["hourly"] = \
-                                                   check_period(sStation, lDateRequested, sFirstYear, sLastYear, "hourly")
-                
-      if dObsPeriod["climate"]: # Check for climate values
-         # Since we can't use the Station inventory to know if the file exists, we download it if requested.
-         dStationStartEndDates[sStation]["climate"] = True
-         
+      (dIndex, arrayTime, nFirst, nLast) = matrix.get_period(sStart, sEnd)
+      arrayValue, arrayStation = self.get_values(matrix, dIndex, nFirst, nLast)
+      return pandas.DataFrame({ matrix.sVariable : arrayValue, "Station ID" : arrayStation }, \
+                              index=pandas.DatetimeIndex(arrayTime[nFirst:nLast]))
 
-      # Remove item from the dictionnaries if there is no valid interval
-      if dStationStartEndDates[sStation]["monthly"] == None and \
-         dStationStartEndDates[sStation]["daily"] == None and \
-         dStationStartEndDates[sStation]["hourly"] == None and \
-         dStationStartEndDates[sStation]["climate"] == None :
-         my_print("\tStation does not have any valid data to download.",\
-                  nMessageVerbosity=VERBOSE)
-         del dStationStartEndDates[sStation]
-         
-   return dStationStartEndDates
+def get_station_position(row):
+   """
+   Return [latitude, longitude] of a line of the station list, None if it has no 
+   coordinates.
+   """
+
+   try:
+      return [float(row["Latitude (Decimal Degrees)"].replace(",", ".")), \
+              float(row["Longitude (Decimal Degrees)"].replace(",", "."))]
+   except (ValueError, AttributeError, KeyError):
+      return None
 
-def create_url(dStationDates, sDirectory, bNoTree, sLang, sFormat, bNoClobber):
+def suggest_composites(catalog, lStations=None, sTimeframe=None, fRadius=COMPOSITE_RADIUS, \
+                       nOverlap=COMPOSITE_OVERLAP, nMaxGap=COMPOSITE_MAX_GAP):
    """
+   Suggest composite stations from the station list: chains of stations that replaced each
+   other, each one within fRadius km of the next one and ending its record at most nOverlap
+   years after the next one starts, and at most nMaxGap years before. A chain starts with
+   the station whose record ends last, and the predecessor whose record ends last is chosen,
+   the nearest one if several. A station is in one chain only.
+
    INPUT
-   dStationDates: dictionnary containing the station number as the key, and a dictionnary as the value.
-     The dictionnary contains the start/end dates for monthly/daily/hourly request.
-   sDirectory: string for the local path where the files should be saved. In case it is not given, the path where the file
-     is executed is chosen. 
-   sLang: English or French
-   sFormat: CSV or XML
+   catalog: loaded StationCatalog
+   lStations: stations that can be members, all the stations of the catalog if None
+   sTimeframe: 'hourly', 'daily' or 'monthly' to use the years of this timeframe, the whole
+    record of the stations if None
 
    OUTPUT
-   lUrlPath : a list of lists. The contained lists are [URL, localpath] for every file to download.
+   List of CompositeStation
    """
 
-   my_print("Creating the path for the files to download", nMessageVerbosity=VERBOSE)
-   
-   # If output directory is not given, use the default
-   if sDirectory == None:
-      sDirectory = os.path.dirname(os.path.realpath(__file__))
+   stationTable = catalog.get_station_table()
+   spatialIndex = catalog.get_spatial_index()
+   sPrefix = dTimeframePrefix.get(sTimeframe, "")
+   arrayFirstYear = stationTable.dColumns[sPrefix + "First Year"]
+   arrayLastYear = stationTable.dColumns[sPrefix + "Last Year"]
 
-   # Check if the directory can be written by the user
-   if not os.access(sDirectory, os.W_OK):
-      my_print("ERROR: you do not have permission to write on the output directory:\n\t" +sDirectory +\
-               "\nPlease change the permission or change the output directory", nMessageVerbosity=NORMAL)
-      return
+   if lStations is None:
+      lStations = stationTable.lStation
+   dPosition = {}
+   for sStation in lStations:
+      nStation = stationTable.dIndex.get(sStation)
+      if nStation is None or arrayFirstYear[nStation] <= 0:
+         continue
+      lPosition = get_station_position(catalog.get_station(sStation))
+      if lPosition is not None:
+         dPosition[sStation] = lPosition
+   def get_years(sStation):
+      nStation = stationTable.dIndex[sStation]
+      return (arrayFirstYear[nStation], arrayLastYear[nStation])
 
-   lUrlPath = []
-   for sStation in dStationDates.keys():
-      sDirectoryStation = sDirectory + "/" +sStation
-      
-      # Check monthly
-      if dStationDates[sStation]["monthly"] != None:
-         if bNoTree:
-            sDirectoryStationMonth = sDirectory
-         else:
-            sDirectoryStationMonth = sDirectoryStation + "/monthly"
+   lComposites = []
+   setUsed = set()
+   for sHead in sorted(dPosition, key=lambda sStation: get_years(sStation)[::-1], reverse=True):
+      if sHead in setUsed:
+         continue
+      lChain = [sHead]
+      while True:
+         nFirstYear = get_years(lChain[-1])[0]
+         lPredecessors = [(sStation, fDistance) for (sStation, fDistance) \
+                          in spatialIndex.within(*dPosition[lChain[-1]], fRadius) \
+                          if sStation in dPosition and sStation not in setUsed and \
+                          sStation not in lChain and get_years(sStation)[0] < nFirstYear and \
+                          nFirstYear - nMaxGap - 1 <= get_years(sStation)[1] <= \
+                          nFirstYear + nOverlap]
+         if len(lPredecessors) == 0:
+            break
+         lChain.append(max(lPredecessors, key=lambda tStation: \
+                           (get_years(tStation[0])[1], -tStation[1]))[0])
+      if len(lChain) > 1:
+         setUsed.update(lChain)
+         lComposites.append(CompositeStation(lChain))
+   my_print("Composite stations suggested: " + str(len(lComposites)), \
+            nMessageVerbosity=VERBOSE)
+   return lComposites
 
-         sPathWildCard = sDirectoryStationMonth + "/" + sLang + "*-monthly-??????-??????." + sFormat
-         if bNoClobber and glob.glob(sPathWildCard) :
-            my_print("File already exists:\n\t" + sPathWildCard + "\n\tSkipping",\
-                     nMessageVerbosity=NORMAL)
-         else:
-            sMonthlyURL = get_simple_url(sStation, sLang, sFormat, "3")
-            lUrlPath.append([sMonthlyURL,sDirectoryStationMonth])
+def read_batch_file(sPath):
+   """
+   Return the requests written in the batch file, one per line. Empty lines and lines 
+   starting with '#' are ignored.
+   """
 
-      # Check daily
-      if dStationDates[sStation]["daily"] != None:
-         if bNoTree:
-            sDirectoryStationDay = sDirectory
-         else:
-            sDirectoryStationDay = sDirectoryStation + "/daily"
-
-         lStartEnd = dStationDates[sStation]["daily"]
-         lDailyURL = get_daily_url(sStation, sLang, sFormat, lStartEnd, \
-                                   sDirectoryStationDay, bNoClobber)
-         for sDailyURL in lDailyURL:           
-            lUrlPath.append([sDailyURL,sDirectoryStationDay])
-
-      # Check hourly
-      if dStationDates[sStation]["hourly"] != None:
-         if bNoTree:
-            sDirectoryStationHour = sDirectory
-         else:
-            sDirectoryStationHour = sDirectoryStation + "/hourly"
-         lStartEnd = dStationDates[sStation]["hourly"]
-         lHourlyURL = get_hourly_url(sStation, sLang, sFormat, lStartEnd, \
-                                     sDirectoryStationHour, bNoClobber)
-         for sHourlyURL in lHourlyURL:           
-            lUrlPath.append([sHourlyURL,sDirectoryStationHour])
-
-      # Check Climate
-      if dStationDates[sStation]["climate"] != None:
-         if bNoTree:
-            sDirectoryStationClimate = sDirectory
-         else:
-            sDirectoryStationClimate = sDirectoryStation + "/climate"
+   lRequests = []
+   with open(sPath, "r", encoding="utf-8") as fichier:
+      for sLine in fichier:
+         sLine = sLine.strip()
+         if len(sLine) > 0 and not sLine.startswith("#"):
+            lRequests.append(sLine)
+   my_print("Number of requests in batch file " + sPath + ": " + str(len(lRequests)), \
+            nMessageVerbosity=VERBOSE)
+   return lRequests
 
-         sPathWildCard = sDirectoryStationClimate + "/" + sLang + "*-almanac-????-????." + sFormat
-         if bNoClobber and glob.glob(sPathWildCard) :
-            my_print("File already exists:\n\t" + sPathWildCard + "\n\tSkipping",\
-                     nMessageVerbosity=NORMAL)
-         else:
-            sClimateURL = get_simple_url(sStation, sLang, sFormat, "4")
-            lUrlPath.append([sClimateURL,sDirectoryStationClimate])
+def check_near_arguments(tRequest):
+   """
+   Verify the values of --near, --radius and --nearest of a request. Raise RequestError if
+   they are not valid.
+   """
 
-   my_print("Number of files to download: " + str(len(lUrlPath)), \
-            nMessageVerbosity=VERBOSE)
-   return lUrlPath
+   if tRequest.Near is None:
+      if tRequest.Radius is not None or tRequest.Nearest is not None:
+         raise RequestError("ERROR: '--radius' and '--nearest' must be used with '--near'.", 18)
+      return
+   parse_coordinates(tRequest.Near)
+   if tRequest.Radius is None and tRequest.Nearest is None:
+      raise RequestError("ERROR: '--near' must be used with '--radius' and/or '--nearest'.", 18)
+   if tRequest.Radius is not None and tRequest.Radius < 0:
+      raise RequestError("ERROR: value provided in '--radius' must be 0 or more: " + \
+                         str(tRequest.Radius), 18)
+   if tRequest.Nearest is not None and tRequest.Nearest < 1:
+      raise RequestError("ERROR: value provided in '--nearest' must be 1 or more: " + \
+                         str(tRequest.Nearest), 18)
 
-def get_simple_url(sStation, sLang, sFormat, sTimeFrame):
+def check_filter_arguments(tRequest):
+   """
+   Verify the values of --min-years and --active-since of a request. Raise RequestError if
+   they are not valid.
    """
-   INPUT
-   sStation: station ID
-   sLang: language in which to dowload the data
-   sFormat: CSV or XML:
 
-   OUTPUT
-   sURL: URL to download the monthly data
+   if tRequest.MinYears is not None and tRequest.MinYears < 1:
+      raise RequestError("ERROR: value provided in '--min-years' must be 1 or more: " + \
+                         str(tRequest.MinYears), 19)
+   if tRequest.ActiveSince is not None and not 1000 <= tRequest.ActiveSince <= 9999:
+      raise RequestError("ERROR: value provided in '--active-since' must be a year YYYY: " + \
+                         str(tRequest.ActiveSince), 19)
+
+def check_composite_arguments(tRequest):
+   """
+   Verify the values of --composite of a request. Raise RequestError if they are not valid.
    """
 
-   
-   if sLang == "en": # value of 'year' and 'month" are dummy value. It has to be set, but any value will do
-      sURL = ECCC_WEBSITE_URL_EN.format(station=sStation, format=sFormat, \
-                                        timeframe=sTimeFrame, year="2000", month="01")
-   elif sLang == "fr":
-      sURL = ECCC_WEBSITE_URL_FR.format(station=sStation, format=sFormat, \
-                                        timeframe=sTimeFrame, year="2000", month="01")
+   for sComposite in tRequest.Composite or []:
+      CompositeStation.parse(sComposite)
+
+class RequestParser(argparse.ArgumentParser):
+   """
+   Parser of the requests of a batch: an invalid argument raises argparse.ArgumentError 
+   instead of exiting the program, so parse_request can report it as a RequestError.
+   """
 
-   return sURL
+   def error(self, sMessage):
+      raise argparse.ArgumentError(None, sMessage)
 
-def get_daily_url(sStation, sLang, sFormat, lStartEndTime, sDirectory, bNoClobber):
+def parse_request(request, tOptions):
    """
-   INPUT
-   sStation: station ID
-   sLang: language in which to dowload the data
-   sFormat: CSV or XML:
-   lStartEndTime: list containing the string for start and end for the period
+   Parse one request of a batch: a string with the same syntax as the command line 
+   (i.e. '--hourly --start-date 1990-01 10091') or a list of these arguments.
+   The periods and dates not provided are taken from tOptions.
 
-   OUTPUT
-   lURL: URLs to download the daily data for the period
+   Return a Namespace with the attributes Input, Near, Radius, Nearest, MinYears, Has, 
+   ActiveSince, Composite, RequestedDate, StartDate, EndDate, Hourly, Daily, Monthly and 
+   Climate.
    """
 
-   
-   if sLang == "en":
-      sStartURL = ECCC_WEBSITE_URL_EN
-   elif sLang == "fr":
-      sStartURL = ECCC_WEBSITE_URL_FR
-
-   lUrl = []
-   [sStart, sEnd] = lStartEndTime
-   for nYear in range(int(sStart[0:4]),int(sEnd[0:4])+1):
-      sYear = str(nYear)
-      sPathWildCard = sDirectory + "/" + sLang + "*-daily-0101" + sYear +\
-                      "-1231" + sYear + "." + sFormat
-      if bNoClobber and glob.glob(sPathWildCard) :
-         my_print("File already exists:\n\t" + sPathWildCard + "\n\tSkipping",\
-                  nMessageVerbosity=NORMAL)
-      else: # value of 'month' can be set to anything
-         sURL  = sStartURL.format(station=sStation, format=sFormat, \
-                                  timeframe="2", year=sYear, month="01")
-         lUrl.append(sURL)
+   if isinstance(request, str):
+      lArguments = shlex.split(request)
+   else:
+      lArguments = [str(sArgument) for sArgument in request]
+
+   parser = RequestParser(prog="--batch", add_help=False)
+   add_request_arguments(parser)
+   try:
+      tRequest, lUnknown = parser.parse_known_args(lArguments)
+   except argparse.ArgumentError as e:
+      lUnknown = [str(e)]
+   if len(lUnknown) > 0:
+      raise RequestError("ERROR: invalid argument(s) in request '" + " ".join(lArguments) + \
+                         "': " + " ".join(lUnknown) + "\n" +\
+                         "Only the stations, --near --radius --nearest, --min-years --has " +\
+                         "--active-since, --composite, the dates and " +\
+                         "--hourly --daily --monthly --climate can be given in a request.", 13)
+   check_near_arguments(tRequest)
+   check_filter_arguments(tRequest)
+   check_composite_arguments(tRequest)
 
-   return lUrl
+   # Use the values of the command line when they are not provided
+   if not (tRequest.Hourly or tRequest.Daily or tRequest.Monthly or tRequest.Climate):
+      tRequest.Hourly = tOptions.Hourly
+      tRequest.Daily = tOptions.Daily
+      tRequest.Monthly = tOptions.Monthly
+      tRequest.Climate = tOptions.Climate
+   if tRequest.RequestedDate is None and tRequest.StartDate is None and tRequest.EndDate is None:
+      tRequest.RequestedDate = tOptions.RequestedDate
+      tRequest.StartDate = tOptions.StartDate
+      tRequest.EndDate = tOptions.EndDate
 
-def get_hourly_url(sStation, sLang, sFormat, lStartEndTime, sDirectory, bNoClobber):
+   return tRequest
+
+class Downloader:
    """
-   INPUT
-   sStation: station ID
-   sLang: language in which to dowload the data
-   sFormat: CSV or XML:
-   lStartEndTime: list containing the string for start and end for the period
+   Plan and download the observation files for requests on the stations of a StationCatalog,
+   with the same options as the command line. The persistent connections and the download
+   manifest are kept between the requests: call close(), or use a 'with' statement, when done.
 
-   OUTPUT
-   lURL: URLs to download the hourly data for the period
+   Errors are raised as ObservationsError instead of exiting the program.
    """
 
-   if sLang == "en":
-      sStartURL =  ECCC_WEBSITE_URL_EN
-   elif sLang == "fr":
-      sStartURL = ECCC_WEBSITE_URL_FR
+   def __init__(self, catalog, sOutputDirectory=None, nJobs=1, bNoTree=False, sFormat="csv", \
+                bNoClobber=False, bSync=False, bDryRun=False, bManifest=True, \
+                nChunkSize=DEFAULT_CHUNK_SIZE, httpPool=None, nRetries=DEFAULT_RETRIES, \
+                fRetryDelay=DEFAULT_RETRY_DELAY, fRate=None, bJournal=True, \
+                bStreamArchive=False, sCompression=None, bRetryEmpty=False, \
+                bDiscardEmpty=False):
+      if sCompression is not None and sCompression not in dCompressionSuffix:
+         raise ValueError("Compression must be 'gzip' or 'zstd': " + str(sCompression))
+      if sCompression == "zstd":
+         import_zstandard()
+      self.catalog = catalog
+      self.sOutputDirectory = get_output_directory(sOutputDirectory)
+      self.nJobs = nJobs
+      self.bNoTree = bNoTree
+      self.sFormat = sFormat
+      self.bNoClobber = bNoClobber
+      self.bSync = bSync
+      self.bDryRun = bDryRun
+      self.bManifest = bManifest and not bDryRun
+      self.nChunkSize = nChunkSize
+      if httpPool is None:
+         httpPool = HTTPConnectionPool(nJobs)
+      self.httpPool = httpPool
+      self.manifest = None
+      self.nRetries = nRetries
+      self.fRetryDelay = fRetryDelay
+      self.rateLimiter = RateLimiter(fRate)
+      self.bStreamArchive = bStreamArchive
+      self.sCompression = sCompression
+      self.bRetryEmpty = bRetryEmpty
+      self.bDiscardEmpty = bDiscardEmpty
+      self.coverage = None
+      self.journal = None
+      if bJournal and not bDryRun:
+         self.journal = DownloadJournal(self.sOutputDirectory + "/" + JOURNAL_FILENAME)
 
-   lUrl = []
-   [sStart, sEnd] = lStartEndTime
-   timeStart = datetime.datetime.strptime(sStart, "%Y-%m")
-   timeEnd = datetime.datetime.strptime(sEnd, "%Y-%m")
-   
-   for time1 in rrule.rrule(rrule.MONTHLY, dtstart=timeStart, until=timeEnd):
-      sYear = datetime.datetime.strftime(time1, "%Y")
-      sMonth = datetime.datetime.strftime(time1, "%m")
-
-      sPathWildCard = sDirectory + "/" + sLang + "*-hourly-" + sMonth + "??" +sYear +\
-                      "-" + sMonth + "??" +sYear + "." + sFormat
-      if bNoClobber and glob.glob(sPathWildCard) :
-         my_print("File already exists:\n\t" + sPathWildCard + "\n\tSkipping",\
-                  nMessageVerbosity=NORMAL)
-      else:
-         sURL = sStartURL.format(station=sStation, format=sFormat, \
-                                 timeframe="1", year=sYear, month=sMonth)
-         lUrl.append(sURL)
+   def __enter__(self):
+      return self
 
-   return lUrl
+   def __exit__(self, excType, excValue, traceback):
+      self.close()
 
+   def check_connexion(self):
+      """
+      Raise ECCCConnexionError if the ECCC Climate web site cannot be reached.
+      """
+      check_eccc_climate_connexion(self.httpPool)
 
+   def plan(self, lInput, bHourly=False, bDaily=False, bMonthly=False, bClimate=False, \
+            sDate=None, sStartDate=None, sEndDate=None, sNear=None, fRadius=None, nNearest=None, \
+            nMinYears=None, lHas=None, nActiveSince=None, lComposites=None):
+      """
+      Return an iterator of the DownloadTask of the files to download for one request.
+      The stations and their periods are checked immediately, the URL are created while 
+      the iterator is consumed.
 
-def download_files(lUrlAndPath, bDryRun):
-   """
-   INPUT:
-   lUrlAndPath: a list of list containing two values: the URL to download 
-    and the path where the file should be copied on the local computer.
-   bDryRun: if set to True, do not download or create directory.
-   """
+      INPUT
+      lInput: stations requested: station ID, airport code, province code or 'all'
+      bHourly, bDaily, bMonthly, bClimate: periods of observation requested
+      sDate, sStartDate, sEndDate: requested dates in format YYYY or YYYY-MM, as --date,
+       --start-date and --end-date
+      sNear, fRadius, nNearest: stations near a position 'LAT,LON', as --near, --radius
+       and --nearest
+      nMinYears, lHas, nActiveSince: filters on the years of observation of the stations,
+       as --min-years, --has and --active-since
+      lComposites: composite stations, CompositeStation or their value of --composite. 
+       Their members are requested, without the periods provided by a member of higher 
+       priority.
+      """
 
-   # Create directories
-   lDirectories = [item[1] for item in lUrlAndPath]
-   create_directories(lDirectories, bDryRun)
-   
-   # Set the progress bar
-   columns = shutil.get_terminal_size()[0]
-   nWidth = int(columns) - 32
-   bar = Bar('Downloading', max=len(lUrlAndPath), width=int(nWidth))
-
-   for lList in lUrlAndPath:
-      [sURL, sDirectory] = lList
-      if not bDryRun:
-         # Download the file
-         httpResponse = urllib.request.urlopen(sURL)
-         # Extract the provided filename
-         _,params = cgi.parse_header(httpResponse.headers.get('Content-Disposition', ''))
-         sFilename = params['filename']
-         bar.next()
-         my_print("Downloading file:\n\t" + sFilename, nMessageVerbosity=VERBOSE)
-         my_print("and saving on local directory:\n\t" + sDirectory, \
-                  nMessageVerbosity=VERBOSE)
-         sPath = sDirectory + "/" + sFilename
-         fichier = open(sPath,  "wb")
-         fichier.write(httpResponse.read())
-         fichier.close()
-      else:
-         my_print("--dry-run mode: file not downloaded:\n\t" + sURL, \
-                  nMessageVerbosity=NORMAL)
-            
-            
-   bar.finish()
+      # If dates are provided, check if the string format is fine.
+      lRequestedDate = check_input_dates([sDate, sStartDate, sEndDate])
+
+      # The members of the composite stations are requested
+      lComposites = [composite if isinstance(composite, CompositeStation) else \
+                     CompositeStation.parse(composite) for composite in lComposites or []]
+      lInput = list(lInput) + [sStation for composite in lComposites \
+                               for sStation in composite.lStations if sStation not in lInput]
+
+      # Fetch the requested stations
+      lStationList = self.catalog.fetch_requested_stations(lInput, sNear, fRadius, nNearest, \
+                                                           nMinYears, lHas, nActiveSince)
+      if len(lStationList) == 0: # If nothing fits.
+         my_print ("No station found corresponding to input: ", \
+                   nMessageVerbosity=NORMAL)
+         my_print (lInput, nMessageVerbosity=NORMAL)
+         return []
 
+      # Check if the requested dates are available for each station
+      dObsPeriod = { "hourly"  : bHourly,\
+                     "daily"   : bDaily, \
+                     "monthly" : bMonthly, \
+                     "climate" : bClimate }
       
-def create_directories(lDirectories, bDryRun):
+      dStationStartEndDates = set_interval_date(self.catalog, lStationList, dObsPeriod, \
+                                                lRequestedDate)
+
+      if len(dStationStartEndDates.keys()) == 0: # If nothing fits.
+         my_print ("No station found corresponding to date arguments. " + \
+                   "Please check the input stations or the date arguments.", \
+                   nMessageVerbosity=NORMAL)
+         return []
+
+      # Create the URL for all the files requested, as they are downloaded
+      coverage = None
+      if not self.bRetryEmpty:
+         coverage = self.get_coverage()
+      dCoveredPeriods = None
+      if len(lComposites) > 0:
+         dCoveredPeriods = {}
+         for composite in lComposites:
+            for sStation, dPeriods in composite.get_covered_periods(self.catalog, \
+                                                                    self.get_coverage()).items():
+               dStationPeriods = dCoveredPeriods.setdefault(sStation, {})
+               for tPeriod in dPeriods:
+                  dStationPeriods.setdefault(tPeriod, dPeriods[tPeriod])
+      return create_url(self.catalog, dStationStartEndDates, self.sOutputDirectory, \
+                        self.bNoTree, self.catalog.sLang, self.sFormat, self.bNoClobber, \
+                        self.bSync, coverage, dCoveredPeriods)
+
+   def get_coverage(self):
       """
-      Check if directories exists in the list lDirectories. If not, create it, unless we are in 
-      --dry-run mode.
+      Return the CoverageMap of the output directory, loaded on the first call.
       """
+      if self.coverage is None:
+         self.coverage = CoverageMap(self.sOutputDirectory + "/" + COVERAGE_FILENAME)
+      return self.coverage
 
-      lDirectoryCreated =[]
-      
-      for sDirectory in lDirectories:
-         # Check if the directory has not been created and does not exists
-         if sDirectory not in lDirectoryCreated and \
-            not os.path.isdir(sDirectory):
-            my_print("Directory does not exists \n\t" + sDirectory, nMessageVerbosity=NORMAL)
-            if bDryRun:
-               my_print("\t--dry-run mode: directory is not created", nMessageVerbosity=NORMAL)
-            else:
-               my_print("\tCreating directory", nMessageVerbosity=NORMAL)
-               os.makedirs(sDirectory)
-            lDirectoryCreated.append(sDirectory)
-      
-def get_canadian_weather_observations(tOptions):
+   def download(self, lUrlPath, bResume=False):
+      """
+      Download the files planned by plan(), a list or an iterator. Return the list of 
+      [URL, error] that failed. A new journal is started, unless bResume is True.
+      """
+
+      if self.bManifest and self.manifest is None:
+         self.manifest = DownloadManifest(self.sOutputDirectory + "/" + MANIFEST_FILENAME)
+      if self.journal is not None and not bResume:
+         self.journal.start()
+      return download_files(lUrlPath, self.bDryRun, self.nJobs, self.httpPool, \
+                            self.nChunkSize, self.manifest, self.nRetries, \
+                            self.fRetryDelay, self.rateLimiter, self.journal, \
+                            self.bStreamArchive, self.sCompression, self.get_coverage(), \
+                            self.bDiscardEmpty)
+
+   def resume(self):
+      """
+      Download the files of the last run that were not completed, according to the journal
+      of the output directory. Return the list of [URL, error] that failed.
+      """
+
+      if self.journal is None:
+         return []
+      lUrlPath = self.journal.load_outstanding()
+      my_print("Files left to download from the last run: " + str(len(lUrlPath)), \
+               nMessageVerbosity=NORMAL)
+      if len(lUrlPath) == 0:
+         return []
+      return self.download(lUrlPath, bResume=True)
+
+   def get_observations(self, lInput, **dRequest):
+      """
+      Plan and download the files for one request. See plan() for the arguments.
+      """
+      return self.download(self.plan(lInput, **dRequest))
+
+   def close(self):
+      """
+      Close the persistent connections and the download manifest.
+      """
+      self.httpPool.close()
+      if self.manifest is not None:
+         self.manifest.close()
+         self.manifest = None
+      if self.journal is not None:
+         self.journal.close()
+      if self.coverage is not None:
+         self.coverage.close()
+
+   def archive(self):
+      """
+      Update the columnar archive of the observation files of the output directory.
+      Return the number of partitions written.
+      """
+
+      if self.bDryRun:
+         my_print("--dry-run mode: the archive is not updated", nMessageVerbosity=NORMAL)
+         return 0
+      return consolidate_archive(self.sOutputDirectory, self.nJobs)
+
+   def update_matrix(self, sVariable, lTimeframes=None):
+      """
+      Update the matrices of the variable sVariable for the timeframes lTimeframes (all if 
+      None) of the observation files of the output directory (see ObservationMatrix).
+      Return the number of files written in the matrices.
+      """
+
+      if self.bDryRun:
+         my_print("--dry-run mode: the matrix is not updated", nMessageVerbosity=NORMAL)
+         return 0
+      return update_matrices(self.sOutputDirectory, sVariable, lTimeframes, \
+                             self.catalog.sLang, self.nJobs)
+
+   def verify(self, nJobs=None):
+      """
+      Check the observation files of the output directory with nJobs processes (all the
+      processors if None), and write the requests to download again the invalid ones in
+      batch files (see get_verify_requests). The station list must be loaded.
+      Return the list of [path, problem] of the invalid files.
+      """
+
+      lBadFiles, nFiles = scan_observation_files(self.sOutputDirectory, nJobs)
+      my_print("Files verified: " + str(nFiles) + ", invalid: " + str(len(lBadFiles)), \
+               nMessageVerbosity=NORMAL)
+      for sPath, sError in lBadFiles:
+         my_print("\t" + sPath + "\n\t\t" + sError, nMessageVerbosity=NORMAL)
+
+      dRequests = get_verify_requests(lBadFiles, self.catalog)
+      if self.bDryRun:
+         for lRequests in dRequests.values():
+            for sRequest in lRequests:
+               my_print("--dry-run mode: request not written: " + sRequest, \
+                        nMessageVerbosity=NORMAL)
+         return lBadFiles
+      for sPath in write_verify_requests(dRequests, self.sOutputDirectory):
+         my_print("Requests to download the invalid files again written in:\n\t" + sPath, \
+                  nMessageVerbosity=NORMAL)
+      return lBadFiles
+
+def merge_url_lists(llUrlPath):
+   """
+   Generator merging the lists or iterators of DownloadTask of several requests, without 
+   duplicates. The files already planned are only remembered when there are several 
+   requests.
+   """
+
+   if len(llUrlPath) == 1:
+      yield from llUrlPath[0]
+      return
+
+   setPlanned = set()
+   for lRequestUrlPath in llUrlPath:
+      for task in lRequestUrlPath:
+         if task not in setPlanned:
+            setPlanned.add(task)
+            yield task
+
+def get_canadian_weather_observations(tOptions, lRequests=None):
    """
    Download the observation files from Environment and Climate change Canada (ECCC)
    on your local computer.
+
+   lRequests is an optional list of requests, each one a string or a list of arguments with
+   the same syntax as the command line (see parse_request). If not provided, the requests of
+   the --batch file are used, or the request of the command line itself. The station list is
+   loaded once, and the files of all the requests are downloaded in a single queue.
    """
 
-   # Set language
-   set_language(tOptions.Language)
+   # Timeframes of the matrix: those requested, or all
+   lMatrixTimeframes = [sTimeframe for sTimeframe in dMatrixTimeUnit \
+                        if getattr(tOptions, sTimeframe.capitalize())] or None
 
-   # Load the station list
-   load_station_list(tOptions.LocalStationPath)
+   # Load the station list in the requested language
+   catalog = StationCatalog(tOptions.Language)
+   downloader = Downloader(catalog, tOptions.OutputDirectory, tOptions.Jobs, tOptions.NoTree, \
+                           tOptions.Format, tOptions.NoClobber, tOptions.Sync, tOptions.DryRun, \
+                           not tOptions.NoManifest, tOptions.ChunkSize * 1024, None, \
+                           tOptions.Retries, tOptions.RetryDelay, tOptions.Rate, True, \
+                           tOptions.StreamArchive, tOptions.Compress, tOptions.RetryEmpty, \
+                           tOptions.DiscardEmpty)
+   with downloader:
+      # Only download what is left from the last run
+      if tOptions.Resume:
+         downloader.check_connexion()
+         downloader.resume()
+         if tOptions.Archive:
+            downloader.archive()
+         if tOptions.Matrix is not None:
+            downloader.update_matrix(tOptions.Matrix, lMatrixTimeframes)
+         return
 
-   # Fetch the requested stations
-   lStationList = fetch_requested_stations(tOptions.Input)
-   if len(lStationList) == 0: # If nothing fits.
-      my_print ("No station found corresponding to input: ", \
-                nMessageVerbosity=NORMAL)
-      my_print (tOptions.Input, nMessageVerbosity=NORMAL)
-      return
-   elif tOptions.Information: # print the lines of the station dictionnary and exits
-      for sStation in lStationList:
-         my_print("----", nMessageVerbosity=NORMAL)
-         my_print ("Station ID: " + sStation, nMessageVerbosity=NORMAL )
-         row = dStationList[sStation]
-         for sItem in row:
-            my_print (sItem + ":" + row[sItem], nMessageVerbosity=NORMAL)
-      return
+      # Only archive the files already downloaded, or write them in the matrix
+      if (tOptions.Archive or tOptions.Matrix is not None) and len(tOptions.Input) == 0 and \
+         getattr(tOptions, "BatchFile", None) is None and lRequests is None:
+         if tOptions.Archive:
+            downloader.archive()
+         if tOptions.Matrix is not None:
+            downloader.update_matrix(tOptions.Matrix, lMatrixTimeframes)
+         return
 
-   # If dates are provided, check if the string format is fine.
-   lRequestedDate = check_input_dates\
-                    ([tOptions.RequestedDate, tOptions.StartDate, tOptions.EndDate])
+      catalog.load(tOptions.LocalStationPath, downloader.httpPool, not tOptions.NoStationCache, \
+                   tOptions.StationCacheTTL * 3600)
 
-   # Check if we can contact ECCC web site
-   check_eccc_climate_connexion()
+      # Only check the files already downloaded
+      if tOptions.Verify:
+         downloader.verify()
+         return
 
-   # Check if the requested dates are available for each station
-   dObsPeriod = { "hourly"  : tOptions.Hourly,\
-                  "daily"   : tOptions.Daily, \
-                  "monthly" : tOptions.Monthly, \
-                  "climate" : tOptions.Climate }
-   
-   dStationStartEndDates = set_interval_date(lStationList, dObsPeriod, lRequestedDate)
+      # Requests to process
+      if lRequests is None and getattr(tOptions, "BatchFile", None) is not None:
+         lRequests = read_batch_file(tOptions.BatchFile)
+      if lRequests is None:
+         lRequestOptions = [tOptions]
+      else:
+         lRequestOptions = [parse_request(request, tOptions) for request in lRequests]
 
-   if len(dStationStartEndDates.keys()) == 0: # If nothing fits.
-      my_print ("No station found corresponding to date arguments. " + \
-                "Please check the input stations or the date arguments.", \
-                nMessageVerbosity=NORMAL)
-      return
+      if tOptions.Information: # print the lines of the station dictionnary and exits
+         for tRequest in lRequestOptions:
+            lStationList = catalog.fetch_requested_stations(tRequest.Input, tRequest.Near, \
+                                                            tRequest.Radius, tRequest.Nearest, \
+                                                            tRequest.MinYears, tRequest.Has, \
+                                                            tRequest.ActiveSince)
+            if len(lStationList) == 0: # If nothing fits.
+               my_print ("No station found corresponding to input: ", \
+                         nMessageVerbosity=NORMAL)
+               my_print (tRequest.Input, nMessageVerbosity=NORMAL)
+            for sStation in lStationList:
+               my_print("----", nMessageVerbosity=NORMAL)
+               my_print ("Station ID: " + sStation, nMessageVerbosity=NORMAL )
+               row = catalog.get_station(sStation)
+               for sItem in row:
+                  my_print (sItem + ":" + row[sItem], nMessageVerbosity=NORMAL)
+         return
 
-   # Create the URL for all the files requested
-   lUrlPath = create_url(dStationStartEndDates, tOptions.OutputDirectory, \
-                         tOptions.NoTree, tOptions.Language, tOptions.Format, tOptions.NoClobber)
-   
-   download_files(lUrlPath, tOptions.DryRun)
+      if tOptions.SuggestComposites: # print the composite stations suggested and exits
+         for tRequest in lRequestOptions:
+            lStationList = None
+            if len(tRequest.Input) > 0 or tRequest.Near is not None or \
+               tRequest.MinYears is not None or tRequest.Has or tRequest.ActiveSince is not None:
+               lStationList = catalog.fetch_requested_stations(tRequest.Input, tRequest.Near, \
+                                                               tRequest.Radius, tRequest.Nearest, \
+                                                               tRequest.MinYears, tRequest.Has, \
+                                                               tRequest.ActiveSince)
+            lTimeframes = [sTimeframe for sTimeframe in dTimeframePrefix \
+                           if getattr(tRequest, sTimeframe.capitalize())]
+            sTimeframe = lTimeframes[0] if len(lTimeframes) > 0 else None
+            sPrefix = dTimeframePrefix.get(sTimeframe, "")
+            stationTable = catalog.get_station_table()
+            lComposites = suggest_composites(catalog, lStationList, sTimeframe)
+            if len(lComposites) == 0:
+               my_print ("No composite station found for input: ", nMessageVerbosity=NORMAL)
+               my_print (tRequest.Input, nMessageVerbosity=NORMAL)
+            for composite in lComposites:
+               my_print("--composite " + str(composite), nMessageVerbosity=NORMAL)
+               for sStation in composite.lStations:
+                  nStation = stationTable.dIndex[sStation]
+                  my_print("\t" + sStation + ": " + catalog.get_station(sStation)["Name"] + \
+                           " (" + str(stationTable.dColumns[sPrefix + "First Year"][nStation]) + \
+                           "-" + str(stationTable.dColumns[sPrefix + "Last Year"][nStation]) + \
+                           ")", nMessageVerbosity=NORMAL)
+         return
+
+      # Create the URL for all the files requested, without duplicates
+      llUrlPath = []
+      for tRequest in lRequestOptions:
+         llUrlPath.append(downloader.plan(tRequest.Input, tRequest.Hourly, tRequest.Daily, \
+                                          tRequest.Monthly, tRequest.Climate, \
+                                          tRequest.RequestedDate, tRequest.StartDate, \
+                                          tRequest.EndDate, tRequest.Near, tRequest.Radius, \
+                                          tRequest.Nearest, tRequest.MinYears, tRequest.Has, \
+                                          tRequest.ActiveSince, tRequest.Composite))
+      iterUrlPath = merge_url_lists(llUrlPath)
+
+      # Check if we can contact ECCC web site
+      downloader.check_connexion()
+
+      # Files are planned while they are downloaded
+      downloader.download(iterUrlPath)
+
+      if tOptions.Archive:
+         downloader.archive()
+      if tOptions.Matrix is not None:
+         downloader.update_matrix(tOptions.Matrix, lMatrixTimeframes)
 
 ############################################################
 # get_canadian_weather_observations in Command line
 #
 #
 
-import argparse
+def add_request_arguments(parser):
+   """
+   Add to parser the arguments describing a request: the stations, the dates and the periods
+   of observation. They are used by the command line and by each line of a --batch file.
+   """
+
+   parser.add_argument("Input", metavar="Input", nargs="*", \
+                     help="Station(s) for which the observations should be downloaded",\
+                       action="store", type=str, default=None)
+   # Stations near a position
+   parser.add_argument("--near", dest="Near", metavar="LAT,LON", \
+                       help="Add the stations near this position, in decimal degrees (i.e. '--near 45.50,-73.57', or '--near=-45.5,170.5' for a negative latitude). Use with --radius and/or --nearest.",\
+                       action="store", type=str, default=None)
+   parser.add_argument("--radius", dest="Radius", metavar="KM", \
+                       help="With --near, add the stations within KM kilometers of the position.",\
+                       action="store", type=float, default=None)
+   parser.add_argument("--nearest", dest="Nearest", metavar="K", \
+                       help="With --near, add the K stations nearest to the position (within --radius if provided).",\
+                       action="store", type=int, default=None)
+   # Filters on the years of observation
+   parser.add_argument("--min-years", dest="MinYears", metavar="N", \
+                       help="Only keep the stations with at least N years of observation (for each timeframe of --has if provided). Without station, all the stations are filtered.",\
+                       action="store", type=int, default=None)
+   parser.add_argument("--has", dest="Has", metavar="[hourly|daily|monthly]", \
+                       choices=["hourly", "daily", "monthly"], \
+                       help="Only keep the stations with observations for this timeframe. Can be repeated. Without station, all the stations are filtered.",\
+                       action="append", type=str, default=None)
+   parser.add_argument("--active-since", dest="ActiveSince", metavar="YYYY", \
+                       help="Only keep the stations with observations in year YYYY or later (for each timeframe of --has if provided). Without station, all the stations are filtered.",\
+                       action="store", type=int, default=None)
+   # Stations that replaced each other
+   parser.add_argument("--composite", dest="Composite", metavar="ID,ID[,ID...]", \
+                       help="Add a composite station: stations that replaced each other at about the same place, by priority (i.e. '--composite 41883,1669,31470'). Their daily and hourly files are not downloaded for the years inside the record of a station of higher priority in the station list. Can be repeated. See --suggest-composites.",\
+                       action="append", type=str, default=None)
+   # Date stuff
+   parser.add_argument("--date", "-d", dest="RequestedDate", metavar=("YYYY[-MM[-DD]]") ,\
+                       help="Get the observations for this specific date only.  --start-date and  --end-date are ignored if provided. Format is YYYY[-MM[-DD]]",\
+                       action="store", type=str, default=None)
+   parser.add_argument("--start-date", "-e", dest="StartDate", metavar=("YYYY[-MM[-DD]]"), \
+                       help="Get the observations after this date. Stops at --end-date if specified, otherwise download the observations until the last observation available. Format is YYYY[-MM[-DD]]",\
+                       action="store", type=str, default=None)
+   parser.add_argument("--end-date", "-f", dest="EndDate",metavar=("YYYY[-MM[-DD]]"), \
+                       help="Get the observations before this date. Stops at --start-date if specified, otherwise download the observations until the first observation available. Format is YYYY[-MM[-DD]]",\
+                       action="store", type=str, default=None)
+   # hourly, daily, monthly
+   parser.add_argument("--hourly", "-H", dest="Hourly", \
+                     help="Get data values for observations taken on an hourly basis. (1 file per month)",\
+                     action="store_true", default=False)
+   parser.add_argument("--daily", "-D", dest="Daily", \
+                     help="Get data values for observations taken once in a 24-hour period. (1 file per year)",\
+                     action="store_true", default=False)
+   parser.add_argument("--monthly", "-M", dest="Monthly", \
+                     help="Get averages for each month, derived from daily data values (1 file for the whole period)",\
+                     action="store_true", default=False)
+   parser.add_argument("--climate", "-C", dest="Climate", \
+                     help="Get the Almanac Averages and Extremes for this station (1 file for the whole period)",\
+                     action="store_true", default=False)
 
 def get_command_line():
    """
@@ -944,9 +4554,9 @@ def get_command_line():
 
    parser = argparse.ArgumentParser(prog='PROG', prefix_chars='-',\
                                     description="download the observation files from Environment and Climate change Canada (ECCC) on your local computer.")
-   parser.add_argument("Input", metavar="Input", nargs="*", \
-                     help="Station(s) for which the observations should be downloaded",\
-                       action="store", type=str, default=None)
+   parser.add_argument("--batch", "-b", dest="BatchFile", metavar="FILE", \
+                     help="Read the requests in FILE, one per line, with the same syntax as the command line for the stations, the dates and --hourly --daily --monthly --climate (i.e. '--hourly --start-date 1990-01 10091'). Periods and dates given on the command line are used for the lines that do not provide them. All the requests are planned first and their files downloaded together.",\
+                     action="store", type=str, default=None)
    parser.add_argument("--output-directory", "-o", dest="OutputDirectory", \
                      help="Directory where the files will be downloaded, in their corresponding sub-directory or not (see --no-tree option). Default value is where the script get_canadian_weather_observations.py is located.",\
                      action="store", type=str, default=None)
@@ -957,9 +4567,64 @@ def get_command_line():
                      help=" Do not overwrite an existing file",\
                      action="store_true", default=False)
 
+   parser.add_argument("--sync", dest="Sync", \
+                     help="Only download the files missing in the output directory and the files of the periods (year for daily, month for hourly) that were not over when they were downloaded. Monthly and almanac files are always downloaded again.",\
+                     action="store_true", default=False)
+   parser.add_argument("--resume", dest="Resume", \
+                     help="Resume the last run in the output directory: only download the files it planned and did not complete, according to '" + JOURNAL_FILENAME + "'. Stations, dates and periods are not needed.",\
+                     action="store_true", default=False)
+   parser.add_argument("--archive", dest="Archive", \
+                     help="After the download, convert the CSV files of the output directory into a compressed columnar archive (Parquet), one file per station, timeframe and year in the '" + ARCHIVE_DIRECTORY + "' sub-directory of each directory. Only the files added or modified since the last update are read. Without station, only the archive is updated. Needs pyarrow.",\
+                     action="store_true", default=False)
+   parser.add_argument("--stream-archive", dest="StreamArchive", \
+                     help="Do not save the CSV files: parse them while they are downloaded and add them directly to the columnar archive (see --archive). Needs pyarrow.",\
+                     action="store_true", default=False)
+   parser.add_argument("--matrix", dest="Matrix", metavar="VARIABLE", \
+                     help="After the download, write the column VARIABLE of the CSV files of the output directory (i.e. 'Temp (°C)' for hourly, 'Mean Temp (°C)' for daily and monthly) in a matrix station x time, one per timeframe of --hourly --daily --monthly (all if none), in the '" + MATRIX_DIRECTORY + "' sub-directory. It is a NumPy file to open as a memory map, with a JSON index of its stations and dates. Only the files added or modified since the last update are read. Without station, only the matrix is updated. Needs numpy and pyarrow, and the tree of directories.",\
+                     action="store", type=str, default=None)
+   parser.add_argument("--verify", dest="Verify", \
+                     help="Check the observation files of the output directory, with all the processors: encoding, header, and number of rows for the period of the file. The periods of the invalid files are written as requests in '" + VERIFY_FILENAME.format(lang="<lang>", format="<format>") + "' in the output directory, to be downloaded again with --batch.",\
+                     action="store_true", default=False)
+   parser.add_argument("--discard-empty", dest="DiscardEmpty", \
+                     help="Do not save the daily and hourly files without any observation. Their periods are recorded in '" + COVERAGE_FILENAME + "' and are not downloaded again.",\
+                     action="store_true", default=False)
+   parser.add_argument("--retry-empty", dest="RetryEmpty", \
+                     help="Download again the daily and hourly periods recorded without observation in '" + COVERAGE_FILENAME + "'. By default, they are skipped.",\
+                     action="store_true", default=False)
+   parser.add_argument("--compress", dest="Compress", \
+                     help="Compress the files while they are downloaded, with gzip (.gz) or zstd (.zst, needs zstandard). The compressed files are recognized by --no-clobber, --sync and --archive.",\
+                     action="store", choices=["gzip", "zstd"], default=None)
+   parser.add_argument("--jobs", "-j", dest="Jobs", metavar="N", \
+                       help="Download N files concurrently. Default value is 1.",\
+                       action="store", type=int, default=1)
+
+   parser.add_argument("--retries", dest="Retries", metavar="N", \
+                       help="Try again N times to download a file after a network error, a timeout or a server error. Default value is " + str(DEFAULT_RETRIES) + ".",\
+                       action="store", type=int, default=DEFAULT_RETRIES)
+   parser.add_argument("--retry-delay", dest="RetryDelay", metavar="SECONDS", \
+                       help="Wait about SECONDS before trying again to download a file, doubled at each attempt. A delay asked by the server is always honored. Default value is " + str(DEFAULT_RETRY_DELAY) + ".",\
+                       action="store", type=float, default=DEFAULT_RETRY_DELAY)
+   parser.add_argument("--rate", dest="Rate", metavar="N", \
+                       help="Send at most N requests per second to the ECCC web site, for all the concurrent downloads. Default is no limit.",\
+                       action="store", type=float, default=None)
+
+   parser.add_argument("--chunk-size", dest="ChunkSize", metavar="KB", \
+                       help="Size in kilobytes of the chunks written on disk while downloading a file. Default value is " + str(DEFAULT_CHUNK_SIZE // 1024) + ".",\
+                       action="store", type=int, default=DEFAULT_CHUNK_SIZE // 1024)
+
+   parser.add_argument("--no-manifest", dest="NoManifest", \
+                       help="Do not record the downloads in '" + MANIFEST_FILENAME + "' in the output directory and do not send conditional requests for the files already downloaded.",\
+                       action="store_true", default=False)
+
    parser.add_argument("--station-file", "-S", dest="LocalStationPath", \
                      help="Use this local version located at PATH for the station list instead of the online version on the EC Climate web site.",\
                      action="store", type=str, default=None)   
+   parser.add_argument("--no-station-cache", dest="NoStationCache", \
+                     help="Do not use nor write the cache of the parsed station list.",\
+                     action="store_true", default=False)
+   parser.add_argument("--station-cache-ttl", dest="StationCacheTTL", metavar="HOURS", \
+                     help="Download the online station list again if its cached version is older than HOURS. Default value is " + str(STATION_CACHE_TTL // 3600) + ". A local station list is parsed again only when it changes.",\
+                     action="store", type=float, default=STATION_CACHE_TTL / 3600)
    parser.add_argument("--dry-run", "-t", dest="DryRun", \
                      help="Execute the program, print the URL but do not download any file",\
                        action="store_true", default=False)
@@ -970,35 +4635,18 @@ def get_command_line():
    parser.add_argument("--format", "-F", dest="Format", metavar=("[xml|csv]"), \
                        help="Download the files in 'csv' or 'xml' format. Default value is 'csv'.",\
                        action="store", type=str, default="csv")
-   # Date stuff
-   parser.add_argument("--date", "-d", dest="RequestedDate", metavar=("YYYY[-MM[-DD]]") ,\
-                       help="Get the observations for this specific date only.  --start-date and  --end-date are ignored if provided. Format is YYYY[-MM[-DD]]",\
-                       action="store", type=str, default=None)
-   parser.add_argument("--start-date", "-e", dest="StartDate", metavar=("YYYY[-MM[-DD]]"), \
-                       help="Get the observations after this date. Stops at --end-date if specified, otherwise download the observations until the last observation available. Format is YYYY[-MM[-DD]]",\
-                       action="store", type=str, default=None)
-   parser.add_argument("--end-date", "-f", dest="EndDate",metavar=("YYYY[-MM[-DD]]"), \
-                       help="Get the observations before this date. Stops at --start-date if specified, otherwise download the observations until the first observation available. Format is YYYY[-MM[-DD]]",\
-                       action="store", type=str, default=None)
-   # hourly, daily, monthly
-   parser.add_argument("--hourly", "-H", dest="Hourly", \
-                     help="Get data values for observations taken on an hourly basis. (1 file per month)",\
-                     action="store_true", default=False)
-   parser.add_argument("--daily", "-D", dest="Daily", \
-                     help="Get data values for observations taken once in a 24-hour period. (1 file per year)",\
-                     action="store_true", default=False)
-   parser.add_argument("--monthly", "-M", dest="Monthly", \
-                     help="Get averages for each month, derived from daily data values (1 file for the whole period)",\
-                     action="store_true", default=False)
-   parser.add_argument("--climate", "-C", dest="Climate", \
-                     help="Get the Almanac Averages and Extremes for this station (1 file for the whole period)",\
-                     action="store_true", default=False)
+   # Stations, dates and periods of observation
+   add_request_arguments(parser)
    
    
    parser.add_argument("--info", "-I", dest="Information", \
                      help="Get and print the information (lat, lon, code, start/end date, etc.) for the selected station(s) and exit.",\
                      action="store_true", default=False)
 
+   parser.add_argument("--suggest-composites", dest="SuggestComposites", \
+                     help="Print the composite stations suggested for the selected stations (all if none): chains of stations within " + str(COMPOSITE_RADIUS) + " km that replaced each other, according to the first and last years of the timeframe requested (of the whole record if none) in the station list, and exit.",\
+                     action="store_true", default=False)
+
    parser.add_argument("--verbose", "-v", dest="Verbosity", \
                      help="Explain what is being done", action="store_true", default=False)
    parser.add_argument("--version", "-V", dest="bVersion", \
@@ -1022,8 +4670,19 @@ def get_command_line():
       print ("Error: Directory '%s' provided in '--output-directory' does not exist or is not a directory. Please provide a valid output directory. Exiting." % (options.OutputDirectory))
       exit (3)
 
+   # Verify if the batch file exists
+   if options.BatchFile is not None and not os.path.isfile(options.BatchFile):
+      print ("Error: file '%s' provided in '--batch' does not exist. Exiting." % (options.BatchFile))
+      exit (12)
+
    # Verify if at least one period of observation is requested.
-   if options.Hourly is False and \
+   if options.BatchFile is None and \
+      options.Resume is False and \
+      options.Archive is False and \
+      options.Matrix is None and \
+      options.Verify is False and \
+      options.SuggestComposites is False and \
+      options.Hourly is False and \
       options.Daily is False and \
       options.Monthly is False and \
       options.Climate is False and \
@@ -1032,6 +4691,43 @@ def get_command_line():
       print ("Please choose for one or more of these options:")
       print ("--hourly --daily --monthly --climate")
       exit(4)
+
+   # Verify the position and the filters of the stations requested
+   try:
+      check_near_arguments(options)
+      check_filter_arguments(options)
+      check_composite_arguments(options)
+   except RequestError as e:
+      print (str(e) + " Exiting.")
+      exit(e.nExitCode)
+
+   # Verify if the files can be streamed in the archive
+   if options.StreamArchive and options.Format != "csv":
+      print ("Error: '--stream-archive' can only be used with the 'csv' format. Exiting.")
+      exit(17)
+
+   # Verify if the matrix can be written: it reads the CSV files of the tree
+   if options.Matrix is not None and (options.NoTree or options.StreamArchive):
+      print ("Error: '--matrix' cannot be used with '--no-tree' nor '--stream-archive'. Exiting.")
+      exit(21)
+
+   # Verify if the number of concurrent downloads is valid
+   if options.Jobs < 1:
+      print ("Error: value provided in '--jobs' must be 1 or more: %d. Exiting." % (options.Jobs))
+      exit(10)
+
+   # Verify if the retry and rate values are valid
+   if options.Retries < 0 or options.RetryDelay < 0:
+      print ("Error: values provided in '--retries' and '--retry-delay' must be 0 or more. Exiting.")
+      exit(14)
+   if options.Rate is not None and options.Rate <= 0:
+      print ("Error: value provided in '--rate' must be more than 0: %s. Exiting." % (options.Rate))
+      exit(15)
+
+   # Verify if the chunk size is valid
+   if options.ChunkSize < 1:
+      print ("Error: value provided in '--chunk-size' must be 1 or more: %d. Exiting." % (options.ChunkSize))
+      exit(11)
       
       
    # Set the global verbosity
@@ -1052,4 +4748,9 @@ def get_command_line():
 if __name__ == "__main__":
 
    tOptions = get_command_line()
-   get_canadian_weather_observations(tOptions)
+   try:
+      get_canadian_weather_observations(tOptions)
+   except ObservationsError as e:
+      my_print(str(e), nMessageVerbosity=NORMAL)
+      my_print("Exiting.", nMessageVerbosity=NORMAL)
+      exit(e.nExitCode)